@@ -6,6 +6,7 @@ from exponential_steps import *
 from Start_Popup import *
 from Wavelength_Popup import *
 from error_popup import *
+from scan_planner import ORDERS, compare_orders
 import csv
 import numpy as np
 
@@ -18,6 +19,9 @@ class Heatmap_Interface(QObject):
     """This signal transmits the metadata filled in in the pop-up window at measurement start."""
     metadata_signal = Signal(str, str, str, str, float, str, float, str, float, str, str)
 
+    """This signal tells the worker whether raw shots should be recorded during the measurement."""
+    raw_recording_signal = Signal(bool)
+
     """This signal emits the list of delay times after formatting them properly."""
     parsed_content_signal = Signal(list)
 
@@ -190,7 +194,7 @@ class Heatmap_Interface(QObject):
             widget.setPlaceholderText("")
 
         elif isinstance(widget, QComboBox):
-            widget.addItems(["Regular", "Backwards", "Random"])
+            widget.addItems(ORDERS + ["Fly scan"])
             widget.setCurrentIndex(0)
 
     def validate_inputs(self):
@@ -253,6 +257,7 @@ class Heatmap_Interface(QObject):
                 self.scans_box.value()
             )
         print(f"Self.content = {self.content}")
+        self.update_order_estimates(self.content)
         self.parsed_content_signal.emit(self.content)
         self.time_remaining_timer(int((int(self.total_steps.text())*9/30) + 9))
         self.progressbar.setMaximum(int(self.total_steps.text()))
@@ -304,6 +309,7 @@ class Heatmap_Interface(QObject):
                                   excitation_wavelength, exc_wl_unit, 
                                   path_length, path_len_unit, 
                                   excitation_power, exc_power_unit, notes)
+        self.raw_recording_signal.emit(self.startpopup.raw_shots_checkbox.isChecked())
         return True
 
     def time_remaining_timer(self, t):
@@ -388,6 +394,7 @@ class Heatmap_Interface(QObject):
                 if self.content:
                     self.start_from_box.setValue(self.content[0])
                     self.finish_time_box.setValue(self.content[-1])
+                    self.update_order_estimates(self.content)
 
             except Exception as e:
                 show_error_message(f"Failed to load file: {e}")
@@ -421,6 +428,16 @@ class Heatmap_Interface(QObject):
                 self.finish_time_box.setValue(self.content[-1])
             
 
+    def update_order_estimates(self, content):
+        """Show the stage travel and motion time of every stepping order for content in the tooltip of the order box."""
+        if len(content) < 2:
+            return
+        lines = ["Stage travel and motion time for these delays:"]
+        for order, (travel, seconds) in compare_orders(content, self.scans_box.value(), start=0.0).items():
+            lines.append(f"{order}: {travel:.0f} ps, {seconds:.1f} s")
+        self.stepping_order_box.setToolTip("\n".join(lines))
+        print("\n".join(lines))
+
     def disable_stop_button(self):
         self.stop_button.setEnabled(False)
 
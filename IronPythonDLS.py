@@ -3,6 +3,11 @@ import time
 import clr
 import socket
 import json
+import io
+import queue
+import threading
+import stage_protocol
+import stage_sweep
 # Add the path to the Newport DLS Command Interface DLL
 sys.path.append(
     r"C:\Windows\Microsoft.NET\assembly\GAC_64\Newport.DLS.CommandInterface\v4.0_1.0.1.0__90ac4f829985d2bf"
@@ -27,6 +32,12 @@ if result != 0:
     sys.stderr.write(f"Failed to open instrument on {instrument}. Error code: {result}\n")
     sys.exit(1)
 
+# The data connection of the running MeasurementLoop or FlyScan and whether the server was asked to stop it.
+# Stop and Shutdown requests are handled while a command runs, see Serve(). A stop is kept until a
+# MeasurementLoop or FlyScan consumes it, or until the next one is queued.
+measurement_socket = None
+stop_requested = threading.Event()
+
 
 def Initialize():
     errorcode = myDLS.TS()[2]
@@ -63,9 +74,25 @@ def MoveRelative(delay):
         sys.stderr.write("Controller is not in the correct state to move.\n")
 
 def MeasurementLoop(delays, scans=1):
+    """
+    Step through delays scans times and hand every point over to CPython, see stage_protocol.py.
+    With delays None, the sequence is the PLAN message CPython sends first on the data connection.
+    """
+    global measurement_socket
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect(('localhost', 9999))
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    measurement_socket = s
     print("Connected")
+    frames = stage_protocol.FrameReader(s)
+    if delays is None:
+        message = frames.read()
+        if message is None or message[0] != stage_protocol.PLAN:
+            print("No measurement plan received")
+            measurement_socket = None
+            s.close()
+            return
+        delays = list(message[1])
     last_item = 0
     reference = myDLS.RF_Get()[1] * 10**9 * 8 / c
     pos = myDLS.PA_Get()[1]  * 10**9 * 8 / c
@@ -79,41 +106,79 @@ def MeasurementLoop(delays, scans=1):
     # Multiply delays for the number of scans
     repeated_delays = delays * scans
 
-    for delay in repeated_delays:
-        if last_item == 0:
-            pos = delay - difference
-        else:
-            pos = delay - last_item
-        print(pos, delay, last_item)
-        while myDLS.TS()[3] not in ["46", "47", "48", "49"]:
-            print("Controller not ready, waiting...")  
-            time.sleep(0.05)
-        ps_position = myDLS.PR_Set(pos * 10**-9 * c / 8)  # Set relative position in mm
-        last_item = delay
-        if ps_position is not None:
-            # Send data to CPython for calculation
-            data = delay
-            message = json.dumps(data) + "\n"
-            s.sendall(message.encode())
-            print("KLJFEAWHFLSEALF")
-            # Wait for response
-            buffer = b""
-            while b"\n" not in buffer:
-                buffer += s.recv(1024)
-                if b"stop" in buffer:
-                    print("Stopping measurementloop")
-                    response = json.loads(buffer.decode().strip())
-                    print(f"Python response for point {delay}: {response}")
-                    s.close()
-                    s = None
-                    return
-            response = json.loads(buffer.decode().strip())
-            print(f"Python response for point {delay}: {response}")
-        
-        else:
-            print(f"Skipping point {delay} due to hardware state.")
-    s.close()
-    s = None
+    try:
+        for index, delay in enumerate(repeated_delays):
+            if stop_requested.is_set():
+                stop_requested.clear()
+                print("Stopping measurementloop")
+                return
+            if last_item == 0:
+                pos = delay - difference
+            else:
+                pos = delay - last_item
+            print(pos, delay, last_item)
+            while myDLS.TS()[3] not in ["46", "47", "48", "49"]:
+                print("Controller not ready, waiting...")  
+                time.sleep(0.05)
+            ps_position = myDLS.PR_Set(pos * 10**-9 * c / 8)  # Set relative position in mm
+            last_item = delay
+            if ps_position is not None:
+                # PR_Set returns while the stage moves; tell CPython the point is reached once the
+                # controller is ready again, with the position read back at rest
+                stage_sweep.wait_ready(myDLS)
+                position = myDLS.PA_Get()[1] * 10**9 * 8 / c
+                stage_protocol.send(s, stage_protocol.MOVE_DONE, index, delay, position)
+                # Wait until the camera has the shots of this point; CPython processes them while the stage moves on
+                while True:
+                    message = frames.read()
+                    if message is None or message[0] == stage_protocol.STOP:
+                        print("Stopping measurementloop")
+                        return
+                    message_type, values = message
+                    if message_type == stage_protocol.ERROR:
+                        print(f"Python error at point {delay}: {values[0]}")
+                        return
+                    if message_type == stage_protocol.ACQ_DONE and values[0] == index:
+                        break
+            else:
+                print(f"Skipping point {delay} due to hardware state.")
+                stage_protocol.send(s, stage_protocol.ERROR, f"Skipping point {delay} due to hardware state.")
+    finally:
+        measurement_socket = None
+        s.close()
+        s = None
+
+def FlyScan(start, end, velocity, sweeps=1):
+    """Sweep between the delays start and end (ps) at velocity ps/s and stream the position to CPython, see stage_sweep.py."""
+    global measurement_socket
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect(('localhost', 9999))
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    measurement_socket = s
+    print("Connected")
+    try:
+        if stop_requested.is_set():
+            # stopped while it was queued
+            stop_requested.clear()
+            print("Stopping fly scan")
+            return 0
+        return stage_sweep.run_fly_scan(myDLS, s, start, end, velocity, sweeps, c=c)
+    finally:
+        measurement_socket = None
+        s.close()
+
+def StopMeasurement():
+    """
+    End a running MeasurementLoop or FlyScan from another thread: its data connection is shut down,
+    which both handle like a STOP from CPython. A MeasurementLoop that is moving stops before the next point.
+    """
+    stop_requested.set()
+    sock = measurement_socket
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
 def DisableReady():
     state = myDLS.TS()[3]
@@ -170,12 +235,7 @@ def StartGUI():
         print(f"Position: {position}, Reference: {reference}")
 
         # Prepare and send data
-        data = {
-            "position": position,
-            "reference": reference,
-        }
-        message = json.dumps(data) + "\n"
-        s.sendall(message.encode())
+        stage_protocol.send(s, stage_protocol.POSITION, position, reference)
     except Exception as e:
         print(f"Error in StartGUI: {e}")
         raise  # Re-raise the exception for debugging
@@ -196,50 +256,164 @@ def Error(errorCode):
     message = error_messages.get(errorCode, "Unknown error.")
     sys.stderr.write(f"Error: {message}\n")
 
+def RunCommand(command):
+    """Execute one command line, like the command line argument of this script. Returns the result of the function."""
+    if command == "Initialize":
+        return Initialize()
+    elif command == "MovePositive":
+        return MoveRelative(100)  # Adjust value if needed
+    elif command == "MoveNegative":
+        return MoveRelative(-100)
+    elif command == "Disable":
+        return DisableReady()
+    elif command.startswith("MoveRelative"):
+        value = float(command.split()[1])
+        return MoveRelative(value)
+    elif command.startswith("MoveAbsolute"):
+        value = float(command.split()[1])
+        return MoveAbsolute(value)
+    elif command.startswith("MeasurementLoop"):
+        # Parse command: expected format "MeasurementLoop [delays] scans", or "MeasurementLoop plan"
+        # when CPython sends the sequence over the data connection
+        args = command[len("MeasurementLoop"):].strip()
+        if args == "plan":
+            return MeasurementLoop(None)
+        if "]" in args:
+            delays_part, scans_part = args.split("]", 1)
+            delays_str = delays_part.strip().lstrip("[")
+            delays = [float(value.strip()) for value in delays_str.split(",") if value.strip()]
+            scans = int(scans_part.strip())
+        else:
+            delays = []
+            scans = 1
+        return MeasurementLoop(delays, scans)
+    elif command.startswith("FlyScan"):
+        # Parse command: expected format "FlyScan start end velocity sweeps"
+        start, end, velocity, sweeps = command.split()[1:5]
+        return FlyScan(float(start), float(end), float(velocity), int(sweeps))
+    elif command == "SetReference":
+        return SetReference()
+    elif command == "GoToReference":
+        return GoToReference()
+    elif command == "GetPosition":
+        return GetPosition()
+    elif command == "GetReference":
+        return GetReference()
+    elif command == "StartGUI":
+        return StartGUI()
+    else:
+        sys.stderr.write(f"Unknown command: {command}\n")
+
+def ExecuteRequest(request):
+    """
+    Run the command of a request {"id": ..., "command": "..."} and return the reply
+    {"id": ..., "status": "ok" or "error", "result": ..., "output": "...", "errors": "..."}.
+    output and errors are what the command printed, as a command process would have written to stdout/stderr.
+    """
+    command = request.get("command", "")
+    output, errors = io.StringIO(), io.StringIO()
+    sys.stdout, sys.stderr = output, errors
+    status, result = "ok", None
+    try:
+        result = RunCommand(command)
+    except Exception as e:
+        errors.write(f"Error executing command '{command}': {str(e)}\n")
+    finally:
+        sys.stdout, sys.stderr = log_file, log_file
+    if errors.getvalue():
+        status = "error"
+    # keep the debug log complete
+    log_file.write(output.getvalue() + errors.getvalue())
+    log_file.flush()
+    if not isinstance(result, (int, float, str, list, tuple, type(None))):
+        result = str(result)
+    return {"id": request.get("id"), "status": status, "result": result,
+            "output": output.getvalue(), "errors": errors.getvalue()}
+
+def ExecuteRequests(requests):
+    """Run the (request, reply) items of the queue requests one after the other, until None is queued."""
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        request, reply = item
+        try:
+            reply(ExecuteRequest(request))
+        except OSError as e:
+            # the client is gone; the next connection gets the replies of its own commands
+            print(f"Could not send the reply: {e}")
+
+def Serve(port=9998):
+    """
+    Keep the instrument open and execute commands from one client connection at a time.
+    Every request and reply is one JSON object per line, see ExecuteRequest(); the commands of a
+    connection run one after the other on a command thread. {"command": "Stop"} ends a running
+    MeasurementLoop or FlyScan and {"command": "Shutdown"} also stops the server and closes the
+    instrument; both are answered at once instead of waiting behind the running command.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('localhost', port))
+    server.listen(1)
+    requests = queue.Queue()
+    executor = threading.Thread(target=ExecuteRequests, args=(requests,))
+    executor.daemon = True
+    executor.start()
+    print(f"Serving on port {port}")
+    try:
+        while True:
+            conn, _ = server.accept()
+            send_lock = threading.Lock()
+
+            def reply(message, conn=conn, send_lock=send_lock):
+                with send_lock:
+                    conn.sendall((json.dumps(message) + "\n").encode())
+
+            buffer = b""
+            try:
+                while True:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    buffer += chunk
+                    while b"\n" in buffer:
+                        line, buffer = buffer.split(b"\n", 1)
+                        request = json.loads(line.decode())
+                        if request.get("command") in ("Stop", "Shutdown"):
+                            StopMeasurement()
+                            reply({"id": request.get("id"), "status": "ok", "result": None, "output": "", "errors": ""})
+                            if request.get("command") == "Shutdown":
+                                return
+                        else:
+                            if request.get("command", "").startswith(("MeasurementLoop", "FlyScan")):
+                                # a Stop sent before this measurement was queued is not meant for it
+                                stop_requested.clear()
+                            requests.put((request, reply))
+            except (OSError, ValueError) as e:
+                # a broken connection or request ends the connection, not the server
+                print(f"Connection error: {e}")
+            finally:
+                conn.close()
+    finally:
+        # drop the commands that did not start and let the running one end before the instrument is closed
+        try:
+            while True:
+                requests.get_nowait()
+        except queue.Empty:
+            pass
+        requests.put(None)
+        executor.join(5.0)
+        server.close()
+
 # Main logic
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         command = sys.argv[1]
         try:
-            if command == "Initialize":
-                Initialize()
-            elif command == "MovePositive":
-                MoveRelative(100)  # Adjust value if needed
-            elif command == "MoveNegative":
-                MoveRelative(-100)
-            elif command == "Disable":
-                DisableReady()
-            elif command.startswith("MoveRelative"):
-                value = float(command.split()[1])
-                MoveRelative(value)
-            elif command.startswith("MoveAbsolute"):
-                value = float(command.split()[1])
-                MoveAbsolute(value)
-            elif command.startswith("MeasurementLoop"):
-                # Parse command: expected format "MeasurementLoop [delays] scans"
-                args = command[len("MeasurementLoop"):].strip()
-                if "]" in args:
-                    delays_part, scans_part = args.split("]", 1)
-                    delays_str = delays_part.strip().lstrip("[")
-                    delays = [float(value.strip()) for value in delays_str.split(",") if value.strip()]
-                    scans = int(scans_part.strip())
-                else:
-                    delays = []
-                    scans = 1
-                MeasurementLoop(delays, scans)
-            elif command == "SetReference":
-                SetReference()
-            elif command == "GoToReference":
-                GoToReference()
-            elif command == "GetPosition":
-                GetPosition()
-            elif command == "GetReference":
-                GetReference()
-            elif command == "StartGUI":
-                StartGUI()
-
+            if command == "Serve":
+                Serve(int(sys.argv[2]) if len(sys.argv) > 2 else 9998)
             else:
-                sys.stderr.write(f"Unknown command: {command}\n")
+                RunCommand(command)
         except Exception as e:
             sys.stderr.write(f"Error executing command '{command}': {str(e)}\n")
     else:
@@ -247,5 +421,3 @@ if __name__ == "__main__":
 
 # Close the instrument
 myDLS.CloseInstrument()
-
-
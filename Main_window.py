@@ -6,7 +6,9 @@ from HeatmapWindow import *
 from Probewindow import *
 from dAwindow import *
 from error_popup import *
+from stage_client import StageClient
 import time
+import copy
 
 # Paths of the IronPython parts; command prompt file and our command file
 ironpython_executable = r"C:\Users\PC032230\Documents\GitHub\TA-Programming\IronPython 3.4.2\net462\ipy.exe"
@@ -63,6 +65,8 @@ if __name__ == "__main__":
     worker = MeasurementWorker("", "StartUp", 0, 0, 'localhost', 9999)
 
     # --- Signal connections for updating UI and data ---
+    # The worker emits from its own thread and from its processing thread (a plain threading.Thread),
+    # so every worker signal is queued to the GUI thread explicitly.
 
     # Update heatmap and graphs when new data arrives
     worker.plot_row_update.connect(main_app.heatmap_window.ta_widgets.update_row, Qt.QueuedConnection)
@@ -79,26 +83,38 @@ if __name__ == "__main__":
     worker.update_dA.connect(main_app.dA_window.update_dA_graph, Qt.QueuedConnection)
 
     # Update delay sliders, progress bars, and reference time
-    worker.update_delay_bar_signal.connect(main_app.heatmap_window.update_current_delay)
-    worker.update_delay_bar_signal.connect(main_app.probe_window.update_delay_bar)
-    worker.update_ref_signal.connect(main_app.heatmap_window.update_t0)
+    worker.update_delay_bar_signal.connect(main_app.heatmap_window.update_current_delay, Qt.QueuedConnection)
+    worker.update_delay_bar_signal.connect(main_app.probe_window.update_delay_bar, Qt.QueuedConnection)
+    worker.update_ref_signal.connect(main_app.heatmap_window.update_t0, Qt.QueuedConnection)
     main_app.probe_window.delay_bar_update.connect(main_app.heatmap_window.update_current_delay)
-    worker.current_step_signal.connect(main_app.heatmap_window.update_current_step)
+    worker.current_step_signal.connect(main_app.heatmap_window.update_current_step, Qt.QueuedConnection)
     main_app.dA_window.pos_change_signal.connect(main_app.heatmap_window.update_current_delay)
 
     # Display error messages from any part of the application
-    worker.error_occurred.connect(show_error_message)
+    worker.error_occurred.connect(show_error_message, Qt.QueuedConnection)
 
     # Enable/disable stop button appropriately
-    worker.stop_button.connect(main_app.heatmap_window.interface.disable_stop_button)
+    worker.stop_button.connect(main_app.heatmap_window.interface.disable_stop_button, Qt.QueuedConnection)
 
     # --- Process management for IronPython commands ---
 
+    # IronPythonDLS.py stays open as command server; one process per command is the fallback
+    stage_client = StageClient(ironpython_executable, script_path)
+    # start the server while the windows are shown; the replies reach the worker in the GUI thread
+    stage_client.start_async()
+    worker.stage_reply.connect(worker.handle_stage_reply, Qt.QueuedConnection)
+
     def start_process(argument):
         """
-        Start or restart the IronPython process with the given argument.
+        Send the given command to the IronPython command server, or start or restart the IronPython
+        process with the given argument when the server is not available.
         Ensures only one process runs at a time.
         """
+        if isinstance(argument, str) and stage_client.available():
+            # the reply comes when the command is done, MeasurementLoop replies after the whole measurement
+            stage_client.submit(argument).add_done_callback(worker.stage_reply.emit)
+            return
+
         if worker.process is None:
             worker.process = QProcess()
 
@@ -113,6 +129,10 @@ if __name__ == "__main__":
         if isinstance(argument, list):
             # If argument is a list, start the worker thread (used for batch operations)
             worker.data_processor.dark_noise_correction = main_app.probe_window.dark_noise #set dark noise level in the data_processor
+            # rejection mode, thresholds, chopper decoding, pairing, DMA blocks and referencing of the GUI;
+            # the live view may run for a moment longer, so the measurement gets its own copy of the regression
+            main_app.probe_window.apply_processing_settings(worker.data_processor)
+            worker.data_processor.set_referencing(copy.deepcopy(main_app.probe_window.referencing))
             worker.start()
         elif isinstance(argument, str):
             # If argument is a string, run the IronPython script with the argument
@@ -150,6 +170,7 @@ if __name__ == "__main__":
     main_app.heatmap_window.interface.trigger_worker_run.connect(handle_button_press)
     main_app.dA_window.run_command_signal.connect(handle_button_press)
     main_app.heatmap_window.interface.metadata_signal.connect(worker.update_metadata)
+    main_app.heatmap_window.interface.raw_recording_signal.connect(worker.set_raw_recording)
 
     # this function calls the set_wavelength_mapping for both the Heatmap window and the Probe window.
     def set_wavelength_calibration(wavelengths, unit):
@@ -180,6 +201,8 @@ if __name__ == "__main__":
                 worker.process.terminate()
                 worker.process.waitForFinished()
 
+        # Stop the IronPython command server and release the stage
+        stage_client.close()
 
         # Stop probe spectrum thread
         main_app.probe_window.stop_graph_thread()
@@ -191,6 +214,7 @@ if __name__ == "__main__":
 
     """This connects the stop button to the stop function for the worker thread."""
     main_app.heatmap_window.interface.stop_measurement_signal.connect(lambda: worker.stop())
+    main_app.heatmap_window.interface.stop_measurement_signal.connect(stage_client.stop)
 
     # Start the worker thread
     worker.start()
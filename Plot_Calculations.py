@@ -1,12 +1,43 @@
 from camera import *
+from running_stats import ChunkSums, RunningStats
+from shot_pairing import REFERENCE_MODES, adjacent_pairs, interpolation_weights, interpolated_reference
+from threshold_sweep import ThresholdSweep
+from timing import Timings
 import numpy as np
 
+# Outlier rejection modes, see ComputeData.rejection_mode
+REJECTION_MODES = ("percentage", "mad", "sigma_clip", "pixel_clip")
+# Chopper decodings, see ComputeData.chopper_decoding
+CHOPPER_DECODINGS = ("two-state", "four-state")
+# Processing of blocks with several DMA blocks, see ComputeData.block_combination
+BLOCK_COMBINATIONS = ("concatenate", "average")
+
+def row_median(rows):
+    """
+    Median of every row of a 2D array, computed by partitioning the rows in place (the order of the
+    values in each row is lost). About as fast as one sort-free pass, unlike np.median along the short axis.
+    """
+    shots = rows.shape[1]
+    middle = shots // 2
+    rows.partition(middle, axis=1)
+    if shots % 2:
+        return rows[:, middle].astype(np.float64)
+    # for an even number of values the lower middle value is the largest value left of the partition
+    return (rows[:, middle].astype(np.float64) + rows[:, :middle].max(axis=1)) / 2
+
+def same_rows(a, b):
+    """Whether the arrays a and b are views of the same rows of the same memory."""
+    return a.shape == b.shape and a.strides == b.strides and a.dtype == b.dtype and a.ctypes.data == b.ctypes.data
+
 class ComputeData():
     """
     Class to compute the probe spectra, dA spectra and handle outlier rejection.
     """
 
-    def __init__(self):
+    def __init__(self, timings=None):
+        # Timings of the processing phases, usually those of the worker thread; not recorded without
+        self.timings = Timings(enabled=False) if timings is None else timings
+
         # Initialize variables for delta_a_block
         self.blocks = None
         self.probe_spectrum = None
@@ -27,10 +58,92 @@ class ComputeData():
         self.rejected_dA = 0                   # percentage of rejected shots
         self.rejected_probe = 0
 
+        # How outliers are found:
+        # - "percentage": shots whose ROI mean deviates from the block mean by more than deviation_threshold_*
+        # - "mad":        shots whose ROI mean deviates from the median shot by more than robust_threshold_*
+        #                 times the median absolute deviation (scaled to a standard deviation)
+        # - "sigma_clip": shots whose ROI mean deviates from the mean of the kept shots by more than
+        #                 robust_threshold_* standard deviations, repeated up to sigma_clip_iterations times
+        # - "pixel_clip": single ROI pixels that deviate from the median of their pixel by more than
+        #                 robust_threshold_* scaled MADs are set to NaN, the rest of the shot is kept.
+        #                 It compares every ROI value and runs without the process pool, about 6x slower
+        #                 than rejection off: meant for replaying recorded blocks or low shot rates
+        self.rejection_mode = "percentage"
+        self.robust_threshold_dA = 5.0         # threshold in standard deviations for the robust modes
+        self.robust_threshold_probe = 5.0
+        self.sigma_clip_iterations = 5
+        # "pixel_clip" estimates the median and MAD of every pixel from at most this many evenly spaced shots
+        self.pixel_clip_sample = 1024
+
+        # ThresholdSweep of the shot deviations of the last block while outlier rejection is on,
+        # for previewing the rejected percentage of other thresholds; None in "pixel_clip" mode
+        self.probe_sweep = None
+        self.dA_sweep = None
+
+        # Optional {group: reference} that fixes the centre and scale of the shot rejection instead of
+        # computing them from the block, see rejection_reference(). BlockProcessingPool sets the references
+        # of the whole block, so every chunk rejects the shots the whole block would reject.
+        # Groups: "probe", "dA pump-off" and "dA pump-on". The references of the last block are kept
+        # in used_rejection_references.
+        self.rejection_references = None
+        self.used_rejection_references = {}
+        # Optional (dark, pump-only) backgrounds of the four-state decoding and pump-off reference of the
+        # "block" reference mode that replace the averages of the block, like the rejection references:
+        # BlockProcessingPool sets those of the whole block, see background_means()
+        self.four_state_backgrounds = None
+        self.block_reference = None
+
         self.dark_noise_correction = None
 
+        # Per-pixel statistics of the last block: RunningStats of the probe, pump-off and pump-on shots
+        # that went into the spectra and of the dA of every shot pair. Merge them to average blocks or scans.
+        # They are summed in the chunk loops of the kernel, about 1.4x the time of the kernel without them;
+        # without collect_statistics they stay None.
+        self.collect_statistics = True
+        self.probe_stats = None
+        self.pump_off_stats = None
+        self.pump_on_stats = None
+        self.delta_A_stats = None
+
         # Probe plot display toggle: only probe pump-off or probe pump-on and pump-off
-        self.probe_toggle = "pump_off"
+        self.probe_toggle = "pump-off"
+
+        # Blocks with more than one DMA block: "concatenate" processes all shots at once,
+        # "average" processes every DMA block separately and averages the spectra
+        self.block_combination = "concatenate"
+
+        # Work buffers reused across blocks, grown when a block has more shots
+        self.work_buffers = {}
+        # shot pairs per chunk of the dA calculation, small enough for the chunk to stay in the CPU cache
+        self.chunk_rows = 128
+        # split pump-off and pump-on shots with strided views when the chopper pattern is strictly periodic
+        self.use_periodic_split = True
+        # pump-off reference of every pump-on shot: "paired" (neighbouring shot), "block" (block average)
+        # or "interpolated" (pump-off shots before and after), see shot_pairing.py
+        self.reference_mode = "paired"
+        # compute log(pump_on) - log(pump_off) with a lookup table indexed by the 16-bit counts instead of
+        # dividing and taking np.log; used for paired references without dA outlier rejection. Off by
+        # default: it measured about 2x slower than np.log (benchmarks.py log_table), the two gathers
+        # from a 256 kB table cost more than the vectorised division and logarithm
+        self.use_log_table = False
+        self.log_tables = {}
+
+        # Optional BlockProcessingPool (block_pool.py) that processes blocks with at least
+        # parallel_min_scans scans in shot chunks on several processes, with the shot rejection of the whole block
+        self.process_pool = None
+        self.parallel_min_scans = 20000
+
+        # "two-state": shots with the ON/ON chopper word are pump-on, all others pump-off.
+        # "four-state": the probe-only (ON/OFF) and ON/ON shots are corrected with the average of the
+        # OFF/OFF (dark) and the pump-only OFF/ON (scatter and fluorescence) shots of the block:
+        # dA = -log((ON/ON - OFF/ON) / (ON/OFF - OFF/OFF)); dark_noise_correction is then not used
+        self.chopper_decoding = "two-state"
+        # shots per chopper state of the last block, {"OFF/OFF": n, "OFF/ON": n, "ON/OFF": n, "ON/ON": n}
+        self.state_counts = None
+
+        # Optional Referencing (referencing.py): normalise every shot with the reference channel read out
+        # as a second region before dA is computed. Blocks with a reference are not sent to the process pool.
+        self.referencing = None
 
     def OutlierRejection_probe(self, block, range_start: int | None = None, range_end:   int | None = None):
         """
@@ -38,28 +151,38 @@ class ComputeData():
         """
         block = np.asarray(block)
 
-        if self.deviation_threshold_probe >= 100:
-            return block
-        
         # Get rejection range
         range_start = self.range_start_probe if range_start is None else range_start
         range_end   = self.range_end_probe   if range_end   is None else range_end
         block_region = block[:,range_start:range_end] 
 
+        # Calculate the mean of the specified regions in the block, also for the preview of a disabled threshold
+        self.probe_sweep = None
+        if range_start != range_end and self.rejection_mode != "pixel_clip":
+            # float64 whatever the block dtype; the mean of uint16 counts into a uint16 buffer is truncated
+            row_means = np.mean(block_region, axis=1, out=self.work_buffer("probe row means", (len(block),), np.float64))
+            reference = self.rejection_reference(row_means, block_region, self.robust_threshold_probe, "probe")
+            self.probe_sweep = ThresholdSweep(self.shot_deviations(row_means, reference), self.rejection_mode)
+
+        if self.rejection_mode == "percentage" and self.deviation_threshold_probe >= 100:
+            return block
+
         # If range is 0 reject all rows
         if range_start == range_end:
             self.rejected_probe = 100
             return np.zeros_like(block)
 
-        # Calculate the mean of the specified regions in the block
-        row_means = block_region.mean(axis = 1)       # mean per row/shot
-        overall_mean = np.mean(block_region)          # mean of all rows 
+        if self.rejection_mode == "pixel_clip":
+            # mask a copy, the pump-off shots are still needed unmasked for dA
+            block_clean = self.work_buffer("probe clipped", block.shape, np.float32)
+            np.copyto(block_clean, block, casting="unsafe")
+            rejected = self.clip_pixels(block_clean, self.robust_threshold_probe, range_start, range_end, "probe")
+            self.rejected_probe = np.count_nonzero(rejected) / max(rejected.size, 1) * 100
+            return block_clean
 
-        # Determine the maximum allowed deviation
-        allowed_deviation = (self.deviation_threshold_probe / 100.0) * overall_mean
-        
         # Identify rows that are within the allowed deviation
-        accaptable_rows = np.abs(row_means - overall_mean) <= allowed_deviation
+        threshold = self.deviation_threshold_probe if self.rejection_mode == "percentage" else self.robust_threshold_probe
+        accaptable_rows = self.keep_shots(row_means, reference, threshold, "probe")
 
         # Filter the block to keep only the acceptable rows
         block_clean = block[accaptable_rows]
@@ -76,33 +199,46 @@ class ComputeData():
         block1 = np.asarray(block1)
         block2 = np.asarray(block2)
 
-        if self.deviation_threshold_dA >= 100:
-            return block1, block2
-        
         # Get rejection range
         range_start = self.range_start_dA if range_start is None else range_start
         range_end   = self.range_end_dA   if range_end   is None else range_end
         block1_region = block1[:, range_start:range_end] 
         block2_region = block2[:, range_start:range_end] 
+
+        # Calculate the mean of the specified regions in the block, also for the preview of a disabled threshold
+        self.dA_sweep = None
+        if range_start != range_end and self.rejection_mode != "pixel_clip":
+            block1_row_mean = np.mean(block1_region, axis=1, out=self.work_buffer("dA pump-off row means", (len(block1),), np.float64))
+            block2_row_mean = np.mean(block2_region, axis=1, out=self.work_buffer("dA pump-on row means", (len(block2),), np.float64))
+            block1_reference = self.rejection_reference(block1_row_mean, block1_region, self.robust_threshold_dA, "dA pump-off")
+            block2_reference = self.rejection_reference(block2_row_mean, block2_region, self.robust_threshold_dA, "dA pump-on")
+            # a pair is rejected when either of its shots deviates
+            self.dA_sweep = ThresholdSweep(np.maximum(self.shot_deviations(block1_row_mean, block1_reference),
+                                                      self.shot_deviations(block2_row_mean, block2_reference)), self.rejection_mode)
+
+        if self.rejection_mode == "percentage" and self.deviation_threshold_dA >= 100:
+            return block1, block2
         
         # If range is 0 reject all rows
         if range_start == range_end:
             self.rejected_dA = 100
             return np.zeros_like(block1), np.zeros_like(block2)
 
-        # Calculate the mean of the specified regions in the block
-        block1_row_mean = block1_region.mean(axis=1)  # means per row/shot
-        block2_row_mean = block2_region.mean(axis=1) 
-        block1_mean =  np.mean(block1_region)         # overall means
-        block2_mean =  np.mean(block2_region) 
-
-        # Determine the maximum allowed deviations
-        block1_allowed_deviation = (self.deviation_threshold_dA / 100.0) * block1_mean
-        block2_allowed_deviation = (self.deviation_threshold_dA / 100.0) * block2_mean
+        if self.rejection_mode == "pixel_clip":
+            # a block reference is a read-only broadcast of one row
+            if not block1.flags.writeable:
+                block1 = np.array(block1)
+            block1_rejected = self.clip_pixels(block1, self.robust_threshold_dA, range_start, range_end, "dA pump-off")
+            block2_rejected = self.clip_pixels(block2, self.robust_threshold_dA, range_start, range_end, "dA pump-on")
+            # a pixel of a pair is lost when it is masked in either shot
+            np.logical_or(block1_rejected, block2_rejected, out=block1_rejected)
+            self.rejected_dA = np.count_nonzero(block1_rejected) / max(block1_rejected.size, 1) * 100
+            return block1, block2
 
         # Identify rows that are within the allowed deviation
-        block1_acceptable_rows = np.abs(block1_row_mean - block1_mean) <= block1_allowed_deviation
-        block2_acceptable_rows = np.abs(block2_row_mean - block2_mean) <= block2_allowed_deviation
+        threshold = self.deviation_threshold_dA if self.rejection_mode == "percentage" else self.robust_threshold_dA
+        block1_acceptable_rows = self.keep_shots(block1_row_mean, block1_reference, threshold, "dA pump-off")
+        block2_acceptable_rows = self.keep_shots(block2_row_mean, block2_reference, threshold, "dA pump-on")
 
         # Keep only paired "good" shots
         keep_mask = block1_acceptable_rows & block2_acceptable_rows
@@ -114,6 +250,123 @@ class ComputeData():
 
         return block1_clean, block2_clean
 
+    def rejection_reference(self, values, region, threshold, group):
+        """
+        Reference of the shot rejection of group: (centre, scale, sweep centre, sweep scale), from the ROI
+        means values of its shots and their ROI region. A shot is kept when |value - centre| <= threshold * scale,
+        the threshold in percent for "percentage"; its deviation in the threshold sweep is measured from the
+        sweep centre in units of the sweep scale.
+        - "percentage": centre and scale are the block mean
+        - "mad":        centre is the median shot, scale 1.4826 * the median absolute deviation (a standard deviation)
+        - "sigma_clip": centre and scale are the mean and standard deviation of the shots kept by the clipping,
+                        the sweep uses the median and scaled MAD
+        A scale of 0 (no measurable spread) keeps all shots in the robust modes.
+        Taken from rejection_references when they are set, e.g. the references of the whole block for a chunk.
+        """
+        if self.rejection_references is not None:
+            reference = self.rejection_references[group]
+        elif self.rejection_mode == "percentage":
+            block_mean = float(np.mean(region))
+            reference = (block_mean, block_mean, block_mean, block_mean)
+        else:
+            values = np.asarray(values, dtype=np.float64)
+            median, spread = 0.0, 0.0
+            if len(values):
+                median = float(np.median(values))
+                # 1.4826 * MAD estimates the standard deviation of normal distributed values
+                spread = 1.4826 * float(np.median(np.abs(values - median)))
+            if self.rejection_mode == "mad":
+                reference = (median, spread, median, spread)
+            elif self.rejection_mode == "sigma_clip":
+                reference = (*self.sigma_clip(values, threshold), median, spread)
+            else:
+                raise ValueError(f"Unknown shot rejection mode {self.rejection_mode!r}, expected 'percentage', 'mad' or 'sigma_clip'")
+        self.used_rejection_references[group] = reference
+        return reference
+
+    def sigma_clip(self, values, threshold):
+        """
+        Mean and standard deviation of values after clipping the values further than threshold standard
+        deviations from the mean, repeated up to sigma_clip_iterations times; a scale of 0 without spread.
+        """
+        center, scale = 0.0, 0.0
+        if len(values) < 2:
+            return center, scale
+        keep = np.ones(len(values), dtype=np.bool_)
+        kept = len(values)
+        for _ in range(self.sigma_clip_iterations):
+            spread = float(np.std(values, where=keep))
+            if not spread > 0:
+                break
+            center, scale = float(np.mean(values, where=keep)), spread
+            np.less_equal(np.abs(values - center), threshold * scale, out=keep)
+            # converged when no shot was added or removed
+            kept, previous = np.count_nonzero(keep), kept
+            if kept == previous or kept < 2:
+                break
+        return center, scale
+
+    def shot_deviations(self, values, reference):
+        """
+        Deviation of every shot from its ROI mean values, in the unit of the threshold of the rejection mode:
+        percent of the block mean for "percentage", scaled MADs from the median shot for "mad" and "sigma_clip".
+        A shot is rejected when its deviation is larger than the threshold.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        center, scale = reference[2], reference[3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.rejection_mode == "percentage":
+                return np.abs(values - center) / scale * 100
+            # without a measurable spread all shots are kept
+            return np.abs(values - center) / scale if scale > 0 else np.zeros_like(values)
+
+    def keep_shots(self, values, reference, threshold, name):
+        """
+        Boolean mask of the shots to keep, from their ROI means values and the rejection_reference() of their group.
+        The mask and deviation arrays are work buffers named after name and reused for the next block.
+        """
+        keep = self.work_buffer(f"{name} keep", values.shape, np.bool_)
+        deviation = self.work_buffer(f"{name} deviation", values.shape, np.float64)
+        center, scale = reference[0], reference[1]
+        np.subtract(values, center, out=deviation)
+        np.abs(deviation, out=deviation)
+        if self.rejection_mode == "percentage":
+            np.less_equal(deviation, threshold / 100.0 * scale, out=keep)
+        elif scale > 0:
+            np.less_equal(deviation, threshold * scale, out=keep)
+        else:
+            keep.fill(True)
+        return keep
+
+    def clip_pixels(self, block, threshold, range_start, range_end, name):
+        """
+        Set the ROI pixels of a float block to NaN, in place, that deviate from the median of their pixel
+        by more than threshold scaled MADs. The median and MAD of every pixel are estimated from at most
+        pixel_clip_sample evenly spaced shots, then all shots are compared in one vectorised pass.
+        Pixels without a measurable spread are not clipped.
+        Returns the boolean (shots, ROI pixels) mask of the clipped values, a work buffer named after name.
+        """
+        region = block[:, range_start:range_end]
+        rejected = self.work_buffer(f"{name} clipped", region.shape, np.bool_)
+        if len(region) < 2:
+            rejected.fill(False)
+            return rejected
+        # pixel-major sample, so the medians partition contiguous rows of shots
+        sample = region[::-(-len(region) // self.pixel_clip_sample)]
+        scratch = self.work_buffer(f"{name} clip scratch", sample.shape[::-1], np.float32)
+        np.copyto(scratch, sample.T)
+        center = row_median(scratch).astype(np.float32)
+        np.subtract(sample.T, center[:, None], out=scratch)
+        np.abs(scratch, out=scratch)
+        limit = (threshold * 1.4826 * row_median(scratch)).astype(np.float32)
+        limit[limit == 0] = np.inf
+        deviation = self.work_buffer(f"{name} clip deviation", region.shape, np.float32)
+        np.subtract(region, center, out=deviation)
+        np.abs(deviation, out=deviation)
+        np.greater(deviation, limit, out=rejected)
+        np.copyto(region, np.nan, where=rejected)
+        return rejected
+
     """Helper functions that transfer values from the GUI to the outlier rejection functions"""
     # Toggle outlier rejection on/off
     def toggle_outlier_rejection_probe(self, selected):
@@ -127,6 +380,32 @@ class ComputeData():
     def dA_deviation_change(self, value: float):
         self.deviation_threshold_dA = value
 
+    # Sets outlier rejection mode and robust thresholds from GUI
+    def set_rejection_mode(self, mode: str):
+        if mode not in REJECTION_MODES:
+            raise ValueError(f"Unknown rejection mode {mode!r}, expected one of {REJECTION_MODES}")
+        self.rejection_mode = mode
+    def robust_threshold_change(self, value: float):
+        self.robust_threshold_probe = value
+    def dA_robust_threshold_change(self, value: float):
+        self.robust_threshold_dA = value
+
+    # Sets chopper decoding, pump-off reference, DMA block combination and reference channel from GUI
+    def set_chopper_decoding(self, decoding: str):
+        if decoding not in CHOPPER_DECODINGS:
+            raise ValueError(f"Unknown chopper decoding {decoding!r}, expected one of {CHOPPER_DECODINGS}")
+        self.chopper_decoding = decoding
+    def set_reference_mode(self, mode: str):
+        if mode not in REFERENCE_MODES:
+            raise ValueError(f"Unknown reference mode {mode!r}, expected one of {REFERENCE_MODES}")
+        self.reference_mode = mode
+    def set_block_combination(self, combination: str):
+        if combination not in BLOCK_COMBINATIONS:
+            raise ValueError(f"Unknown block combination {combination!r}, expected one of {BLOCK_COMBINATIONS}")
+        self.block_combination = combination
+    def set_referencing(self, referencing):
+        self.referencing = referencing
+
     # Sets outlier rejection range from GUI
     def update_outlier_range(self, start: int, end: int) -> None:
         self.range_start_probe, self.range_end_probe = sorted((int(start), int(end)))
@@ -136,53 +415,330 @@ class ComputeData():
 
     def compute_spectra(self, block, start_pixel=12, end_pixel=1035):
         """
-        Function for computing probe spectra and dA spectra
+        Function for computing probe spectra and dA spectra.
+        block is a CameraBlock, or a raw (shots, 1088) array that is cropped to start_pixel:end_pixel first.
         """
-        block = np.asarray(block)
+        if not isinstance(block, CameraBlock):
+            block = PixelWindow(start_pixel, end_pixel).crop(block)
+        if self.referencing is not None:
+            block = self.referencing.split(block)
+        if block.number_of_blocks > 1 and self.block_combination == "average":
+            return self.compute_sub_block_average(block)
+        # the regression of the referencing is learned in this process; pixel clipping needs the medians of every pixel over all shots
+        pixel_clip = self.rejection_mode == "pixel_clip" and (self.outlier_rejection_probe or self.outlier_rejection_dA)
+        if self.process_pool is not None and len(block) >= self.parallel_min_scans and self.referencing is None and not pixel_clip:
+            with self.timings.span("block pool"):
+                return self.process_pool.process(block, self)
+        pixels = block.pixels
+        self.probe_sweep = self.dA_sweep = None
+
+        # the chopper state of every shot: 0 OFF/OFF, 1 OFF/ON, 2 ON/OFF, 3 ON/ON
+        states = block.chopper >> 14
+        state_counts = np.bincount(states, minlength=4)
+        self.state_counts = dict(zip(chopper_states.values(), state_counts.tolist()))
+        four_state = self.chopper_decoding == "four-state"
+        # pump-on state of the shots that take part in the dA calculation, in shot order
+        pairing_chopper = block.chopper
+        backgrounds = (self.dark_noise_correction, self.dark_noise_correction)
+
+        phases = self.periodic_phases(block.chopper) if self.use_periodic_split and not four_state else None
+        if four_state:
+            # sort the shots by state with one stable index computation and average the
+            # OFF/OFF and OFF/ON shots; probe-only and ON/ON shots keep their order for pairing
+            order = np.argsort(states, kind="stable")
+            bounds = np.r_[0, np.cumsum(state_counts)]
+            gathered = np.take(pixels, order, axis=0, out=self.work_buffer("gathered", pixels.shape, pixels.dtype))
+            dark_rows, pump_only_rows, pump_off_rows, pump_on_rows = (gathered[bounds[i]:bounds[i + 1]] for i in range(4))
+            backgrounds = self.four_state_backgrounds
+            if backgrounds is None:
+                backgrounds = self.background_means(dark_rows, pump_only_rows)
+            pairing_chopper = block.chopper[states >= 2]
+            if block.reference is not None:
+                reference = np.take(block.reference, order, axis=0,
+                                    out=self.work_buffer("gathered reference", block.reference.shape, block.reference.dtype))
+                reference_off = reference[bounds[2]:bounds[3]]
+                reference_on = reference[bounds[3]:]
+        elif phases is not None:
+            # regular chopper: pump-off and pump-on shots are strided views, nothing is gathered
+            period, off_phase, on_phase = phases
+            pump_off_rows = pixels[off_phase::period]
+            pump_on_rows = pixels[on_phase::period]
+            if block.reference is not None:
+                reference_off = block.reference[off_phase::period]
+                reference_on = block.reference[on_phase::period]
+        else:
+            # Decode the chopper state once and sort the shots into pump-off rows followed by
+            # pump-on rows with one stable index computation, so shot pairs keep their order
+            pump_on = block.chopper >= 49152
+            order = np.argsort(pump_on, kind="stable")
+            number_off = len(order) - int(np.count_nonzero(pump_on))
+            gathered = np.take(pixels, order, axis=0, out=self.work_buffer("gathered", pixels.shape, pixels.dtype))
+            pump_off_rows = gathered[:number_off]
+            pump_on_rows = gathered[number_off:]
+            if block.reference is not None:
+                reference = np.take(block.reference, order, axis=0,
+                                    out=self.work_buffer("gathered reference", block.reference.shape, block.reference.dtype))
+                reference_off = reference[:number_off]
+                reference_on = reference[number_off:]
+
+        # Convert the pump-off rows followed by the pump-on rows to float32, dark corrected, in one work buffer
+        number_off = len(pump_off_rows)
+        shots = self.work_buffer("shots", (number_off + len(pump_on_rows), pixels.shape[1]), np.float32)
+        for rows, out, background in ((pump_off_rows, shots[:number_off], backgrounds[0]), (pump_on_rows, shots[number_off:], backgrounds[1])):
+            if background is not None:
+                np.subtract(rows, background, out=out, casting="unsafe")
+            else:
+                np.copyto(out, rows, casting="unsafe")
+        pump_off_dA = shots[:number_off]
+        pump_on_dA = shots[number_off:]
 
-        #Boolean masks for seperating states
-        if self.probe_toggle == "pump-off":
-            probe = block[block[:, 2] < 49152,  start_pixel:end_pixel] #filter pump-off states
         if self.probe_toggle == "pump-off+pump-on":
-            probe = block[start_pixel:end_pixel] #show probe spectrum regardless of the pump state
-
-        pump_off_dA = block[block[:, 2] < 49152,  start_pixel:end_pixel]
-        pump_on_dA = block[block[:, 2] >= 49152, start_pixel:end_pixel]
+            probe = shots #show probe spectrum regardless of the pump state
+        else:
+            probe = pump_off_dA #filter pump-off states
 
-        if self.dark_noise_correction is not None:
-            probe = probe - self.dark_noise_correction
-            pump_off_dA = pump_off_dA - self.dark_noise_correction
-            pump_on_dA = pump_on_dA - self.dark_noise_correction
+        # Pixel clipping masks single values with NaN, which the averages and statistics skip per pixel
+        ignore_nan = self.rejection_mode == "pixel_clip" and (self.outlier_rejection_probe or self.outlier_rejection_dA)
 
         # Probe spectra
         if self.outlier_rejection_probe == True:
-            probe = self.OutlierRejection_probe(probe)
+            with self.timings.span("shot rejection"):
+                probe = self.OutlierRejection_probe(probe)
 
+        self.probe_stats = self.chunk_statistics(probe, ignore_nan) if self.collect_statistics else None
         if len(probe) == 0: # all shots got rejected
             self.probe_spectrum = np.zeros_like(self.probe_spectrum)
+        elif self.collect_statistics:
+            self.probe_spectrum = self.probe_stats.mean
+        elif ignore_nan:
+            with np.errstate(invalid='ignore'):
+                self.probe_spectrum = np.where(np.isnan(probe), 0, probe).sum(axis=0, dtype=np.float64) / (~np.isnan(probe)).sum(axis=0)
         else:
             self.probe_spectrum = np.mean(probe, axis=0)
 
+        # Referenced dA: learn the probe/reference regression from the pump-off shots, then divide every
+        # shot by its intensity predicted from the reference channel. The probe spectrum stays in counts.
+        referenced = self.referencing is not None and block.reference is not None
+        if referenced:
+            self.referencing.update(reference_off, pump_off_dA)
+            self.referencing.normalise(pump_off_dA, reference_off)
+            self.referencing.normalise(pump_on_dA, reference_on)
+
+        # pair every pump-on shot with its pump-off reference; rejection below keeps or drops whole pairs
+        pump_off_shots = pump_off_dA
+        pump_off_dA, pump_on_dA = self.reference_shots(pairing_chopper, pump_off_dA, pump_on_dA, phases is not None)
 
         # dA calulations from pump‑on and pump‑off states
         if self.outlier_rejection_dA == True:
-            pump_off_dA, pump_on_dA = self.OutlierRejection_dA(pump_off_dA, pump_on_dA)
+            with self.timings.span("shot rejection"):
+                pump_off_dA, pump_on_dA = self.OutlierRejection_dA(pump_off_dA, pump_on_dA)
 
         if len(pump_off_dA) == 0 or len(pump_on_dA) == 0:
+            if self.collect_statistics:
+                self.pump_off_stats = RunningStats(ignore_nan=ignore_nan)
+                self.pump_on_stats = RunningStats(ignore_nan=ignore_nan)
+                self.delta_A_stats = RunningStats(ignore_nan=ignore_nan)
             self.delta_A = np.zeros_like(self.delta_A)
             return self.probe_spectrum, self.delta_A
             
-        # warn for mismatched pump-off and pump-on states
-        if len(pump_off_dA) != len(pump_on_dA):
-            print("Pump-off pump-on shots not of equal size")
-        
-        # pair shots and compute delta A
+        # pair shots and compute delta A chunk by chunk in a float32 work buffer
+        pairs = len(pump_on_dA)
+        chunk_shape = (min(self.chunk_rows, pairs), pump_on_dA.shape[1])
+        ratio = self.work_buffer("ratio", chunk_shape, np.float32)
+        delta_A_sum = np.zeros(pump_on_dA.shape[1])
+        delta_A_count = np.zeros(pump_on_dA.shape[1], dtype=np.int64) if ignore_nan else pairs
+        use_log_table = (self.use_log_table and self.reference_mode == "paired" and not self.outlier_rejection_dA
+                         and not referenced and not four_state and not ignore_nan)
+        if use_log_table:
+            # the same pairs, as uint16 counts
+            raw_off, raw_on = self.reference_shots(block.chopper, pump_off_rows, pump_on_rows, phases is not None)
+            table, shift = self.log_table()
+            index = self.work_buffer("table index", chunk_shape, np.intp)
+            log_off = self.work_buffer("log pump-off", chunk_shape, np.float32)
+        if self.collect_statistics:
+            # the statistics are summed while the chunk is in the cache and merged once per block;
+            # the pump-off statistics are those of the shots the references were made of
+            deviation = self.work_buffer("deviation", chunk_shape, np.float32)
+            pump_off_used = pump_off_dA if self.reference_mode == "paired" else pump_off_shots
+            # the pairs of a strictly alternating chopper are usually made of all probe rows, in a new view
+            reuse_probe = not referenced and (pump_off_used is probe or same_rows(pump_off_used, probe))
+            pump_off_sums = ChunkSums(ignore_nan) if pump_off_used is pump_off_dA and not reuse_probe else None
+            pump_on_sums = ChunkSums(ignore_nan)
+            delta_A_sums = ChunkSums(ignore_nan, shifted=False)
         with np.errstate(divide='ignore', invalid='ignore'):
-            ratio = np.divide(pump_on_dA, pump_off_dA)
-            ratio[ratio <= 0] = np.nan  # Avoid -inf from log(0) or log(negative)
-            delta_A = -np.log(ratio)
+            for first in range(0, pairs, self.chunk_rows):
+                last = min(first + self.chunk_rows, pairs)
+                chunk = ratio[:last - first]
+                if use_log_table:
+                    # dA = log(pump_off) - log(pump_on), both looked up by their dark-corrected counts
+                    np.add(raw_on[first:last], shift, out=index[:last - first])
+                    np.take(table, index[:last - first], out=chunk)
+                    np.add(raw_off[first:last], shift, out=index[:last - first])
+                    np.take(table, index[:last - first], out=log_off[:last - first])
+                    np.subtract(log_off[:last - first], chunk, out=chunk)
+                else:
+                    np.divide(pump_on_dA[first:last], pump_off_dA[first:last], out=chunk)
+                    np.log(chunk, out=chunk)  # NaN for negative ratios, -inf for a ratio of 0
+                    np.negative(chunk, out=chunk)
+                if self.collect_statistics:
+                    if pump_off_sums is not None:
+                        pump_off_sums.add(pump_off_dA[first:last], deviation[:last - first])
+                    pump_on_sums.add(pump_on_dA[first:last], deviation[:last - first])
+                    delta_A_sums.add(chunk)
+                elif ignore_nan:
+                    delta_A_count += np.count_nonzero(chunk == chunk, axis=0)
+                    delta_A_sum += np.nansum(chunk, axis=0)
+                else:
+                    delta_A_sum += chunk.sum(axis=0)
           
-        # average delta_A over all shots per pixel
-        self.delta_A = np.mean(delta_A, axis=0)
+            if self.collect_statistics:
+                if reuse_probe:
+                    self.pump_off_stats = self.probe_stats
+                elif pump_off_sums is not None:
+                    self.pump_off_stats = pump_off_sums.stats()
+                else:
+                    self.pump_off_stats = self.chunk_statistics(pump_off_used, ignore_nan)
+                self.pump_on_stats = pump_on_sums.stats()
+                self.delta_A_stats = delta_A_sums.stats()
+
+            # average delta_A over all shots per pixel
+            self.delta_A = self.delta_A_stats.mean if self.collect_statistics else delta_A_sum / delta_A_count
+        # A ratio of 0 or a pump-off intensity of 0 leaves no valid dA for the pixel
+        self.delta_A[np.isinf(self.delta_A)] = np.nan
         
-        return self.probe_spectrum, self.delta_A
\ No newline at end of file
+        return self.probe_spectrum, self.delta_A
+
+    def reference_shots(self, chopper, pump_off_dA, pump_on_dA, periodic=False):
+        """
+        Return (reference, pump-on) arrays with one row per pump-on shot that has a reference, for the
+        dA = -log(pump-on / reference) calculation. pump_off_dA and pump_on_dA are the pump-off and
+        pump-on rows in shot order. periodic: the chopper strictly alternates, so row k of both arrays
+        are neighbouring shots.
+        """
+        if len(pump_off_dA) == 0:
+            return pump_off_dA, pump_on_dA[:0]
+        if self.reference_mode == "block":
+            reference = pump_off_dA.mean(axis=0) if self.block_reference is None else self.block_reference
+            return np.broadcast_to(reference, pump_on_dA.shape), pump_on_dA
+
+        pump_on = chopper >= 49152
+        if self.reference_mode == "interpolated":
+            reference = self.work_buffer("reference", pump_on_dA.shape, np.float32)
+            return interpolated_reference(pump_off_dA, *interpolation_weights(pump_on), out=reference), pump_on_dA
+
+        # paired: neighbouring shots, orphan shots are dropped
+        if periodic:
+            pairs = min(len(pump_off_dA), len(pump_on_dA))
+            return pump_off_dA[:pairs], pump_on_dA[:pairs]
+        off_rows, on_rows = adjacent_pairs(pump_on)
+        if len(off_rows) == len(pump_off_dA) == len(pump_on_dA):
+            # every shot has a partner and the rows are already in pair order
+            return pump_off_dA, pump_on_dA
+        return pump_off_dA[off_rows], pump_on_dA[on_rows]
+
+    def background_means(self, dark_rows, pump_only_rows):
+        """
+        The (dark, pump-only) backgrounds of the four-state decoding: the averages of the OFF/OFF and the
+        OFF/ON shots. Without OFF/OFF shots the dark noise correction is used, without pump-only shots
+        only the dark level is subtracted.
+        """
+        dark = dark_rows.mean(axis=0) if len(dark_rows) else self.dark_noise_correction
+        pump_only = pump_only_rows.mean(axis=0) if len(pump_only_rows) else dark
+        return dark, pump_only
+
+    def whole_block_reference(self, pixels, chopper, backgrounds):
+        """
+        The float32 pump-off reference of the "block" reference mode for all shots of the (shots, pixels)
+        counts, corrected like the shots: by the dark of the four-state backgrounds, or by the dark noise
+        correction when backgrounds is None (two-state decoding). None without pump-off shots.
+        """
+        states = chopper >> 14
+        four_state = self.chopper_decoding == "four-state"
+        pump_off_rows = pixels[states == 2] if four_state else pixels[states < 3]
+        if len(pump_off_rows) == 0:
+            return None
+        background = backgrounds[0] if four_state else self.dark_noise_correction
+        reference = pump_off_rows.mean(axis=0)
+        if background is not None:
+            reference = reference - background
+        return reference.astype(np.float32)
+
+    def periodic_phases(self, chopper, period=2):
+        """
+        Detect a strictly periodic chopper sequence with one pump-off and one pump-on shot per period,
+        the pattern of a pump chopper at half the laser repetition rate.
+        Returns (period, pump-off phase, pump-on phase), or None when the pattern is broken or has
+        another layout, in which case the shots are split with a mask.
+        """
+        if len(chopper) < 2 * period or not np.array_equal(chopper[period:], chopper[:-period]):
+            return None
+        pump_on = chopper[:period] >= 49152
+        if np.count_nonzero(pump_on) != 1 or period - np.count_nonzero(pump_on) != 1:
+            return None
+        return period, int(np.flatnonzero(~pump_on)[0]), int(np.flatnonzero(pump_on)[0])
+
+    def chunk_statistics(self, rows, ignore_nan):
+        """RunningStats of the float rows, summed chunk by chunk in a work buffer."""
+        sums = ChunkSums(ignore_nan)
+        deviation = self.work_buffer("deviation", (min(self.chunk_rows, len(rows)), rows.shape[1]), rows.dtype)
+        for first in range(0, len(rows), self.chunk_rows):
+            chunk = rows[first:first + self.chunk_rows]
+            sums.add(chunk, deviation[:len(chunk)])
+        return sums.stats()
+
+    def log_table(self):
+        """
+        Return (table, shift) such that table[counts + shift] is log(counts - dark) for uint16 counts,
+        with the dark noise correction rounded to whole counts: -inf for 0 and NaN for negative values.
+        """
+        dark = np.zeros(0) if self.dark_noise_correction is None else np.asarray(self.dark_noise_correction)
+        dark = np.rint(dark).astype(np.intp)
+        offset = max(int(dark.max(initial=0)), 0)
+        if offset not in self.log_tables:
+            values = np.arange(-offset, 65536, dtype=np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.log_tables[offset] = np.log(values).astype(np.float32)
+        shift = offset - dark if dark.size else np.intp(0)
+        return self.log_tables[offset], shift
+
+    def work_buffer(self, name, shape, dtype):
+        """
+        Return a reusable array of the given shape and dtype. The memory is kept between blocks
+        and only reallocated when a block needs more rows or has a different width.
+        """
+        buffer = self.work_buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.shape[1:] != shape[1:] or len(buffer) < shape[0]:
+            buffer = np.empty(shape, dtype=dtype)
+            self.work_buffers[name] = buffer
+        return buffer[:shape[0]]
+
+    def compute_sub_block_average(self, block):
+        """
+        Compute the spectra of every DMA block in block separately and average them.
+        """
+        probe_spectra, delta_As, rejected_probe, rejected_dA = [], [], [], []
+        probe_sweeps, dA_sweeps, state_counts = [], [], []
+        statistics = [RunningStats(ignore_nan=False) for _ in range(4)]
+        for sub_block in block.sub_blocks():
+            probe_spectrum, delta_A = self.compute_spectra(sub_block)
+            probe_spectra.append(probe_spectrum)
+            delta_As.append(delta_A)
+            rejected_probe.append(self.rejected_probe)
+            rejected_dA.append(self.rejected_dA)
+            probe_sweeps.append(self.probe_sweep)
+            dA_sweeps.append(self.dA_sweep)
+            state_counts.append(self.state_counts)
+            if self.collect_statistics:
+                for total, stats in zip(statistics, (self.probe_stats, self.pump_off_stats, self.pump_on_stats, self.delta_A_stats)):
+                    total.merge(stats)
+        if self.collect_statistics:
+            self.probe_stats, self.pump_off_stats, self.pump_on_stats, self.delta_A_stats = statistics
+
+        self.probe_spectrum = np.mean(probe_spectra, axis=0)
+        self.delta_A = np.mean(delta_As, axis=0)
+        self.rejected_probe = np.mean(rejected_probe)
+        self.rejected_dA = np.mean(rejected_dA)
+        self.probe_sweep = ThresholdSweep.merge(probe_sweeps)
+        self.dA_sweep = ThresholdSweep.merge(dA_sweeps)
+        self.state_counts = {state: sum(counts[state] for counts in state_counts) for state in chopper_states.values()}
+        return self.probe_spectrum, self.delta_A
@@ -7,6 +7,8 @@ from dAwindow import *
 import csv
 from heatmap import ScaledAxis, HoverPlotWidget
 from error_popup import *
+from threshold_preview import ThresholdPreview
+from referencing import Referencing
 
 class Probewindow(QMainWindow):
     """
@@ -28,7 +30,19 @@ class Probewindow(QMainWindow):
     # - deviation_threshold_changed: change deviation threshold from spinbox
     switch_outlier_rejection = Signal(bool)
     deviation_threshold_changed = Signal(float)
-    
+
+    #Processing signals, for the probe and the dA spectra:
+    # - rejection_mode_changed: outlier rejection mode from the combo box
+    # - robust_threshold_changed: probe threshold of the robust rejection modes, in standard deviations
+    # - chopper_decoding_changed, reference_mode_changed, block_combination_changed: processing combo boxes
+    # - referencing_changed: Referencing of the reference channel, or None
+    rejection_mode_changed = Signal(str)
+    robust_threshold_changed = Signal(float)
+    chopper_decoding_changed = Signal(str)
+    reference_mode_changed = Signal(str)
+    block_combination_changed = Signal(str)
+    referencing_changed = Signal(object)
+
 
     def __init__(self, dA_Window):
         """
@@ -39,6 +53,8 @@ class Probewindow(QMainWindow):
         self.graph_worker = GraphThread()
         self.dA_window = dA_Window
         self.dark_noise = None
+        # reference-channel regression shared by the live views, None without referencing
+        self.referencing = None
 
         # Build GUI
         central_widget = QWidget()
@@ -101,27 +117,82 @@ class Probewindow(QMainWindow):
         self.outlier_checkbox = QCheckBox("Remove bad spectra")
         self.outlier_checkbox.toggled.connect(self.toggle_outlier_rejection) 
         outlier_layout.addWidget(self.outlier_checkbox, 0, 0, 1, 3)
-        # deviation threshold input
+        # rejection mode of the probe and the dA spectra
+        self.rejection_mode_label = QLabel("Rejection mode (probe and dA)")
+        outlier_layout.addWidget(self.rejection_mode_label, 1, 0, 1, 2)
+        self.rejection_mode_box = QComboBox()
+        self.rejection_mode_box.addItem("Deviation from the mean", "percentage")
+        self.rejection_mode_box.addItem("Median/MAD", "mad")
+        self.rejection_mode_box.addItem("Sigma clipping", "sigma_clip")
+        self.rejection_mode_box.addItem("Pixel clipping", "pixel_clip")
+        self.rejection_mode_box.currentIndexChanged.connect(self.emit_rejection_mode_change)
+        outlier_layout.addWidget(self.rejection_mode_box, 1, 2)
+        # deviation threshold input: percentage, or standard deviations in the robust modes
         self.deviation_label = QLabel("Remove spectra that deviate more than")
-        outlier_layout.addWidget(self.deviation_label, 1, 0, 1, 2)
+        outlier_layout.addWidget(self.deviation_label, 2, 0, 1, 2)
         self.deviation_spinbox = QDoubleSpinBox()
         self.deviation_spinbox.valueChanged.connect(self.emit_deviation_change)
         self.deviation_spinbox.setRange(0, 100)
         self.deviation_spinbox.setSuffix(" %")
         self.deviation_spinbox.setSingleStep(0.01)
         self.deviation_spinbox.setValue(100)
-        outlier_layout.addWidget(self.deviation_spinbox, 1, 2)
+        outlier_layout.addWidget(self.deviation_spinbox, 2, 2)
+        self.robust_spinbox = QDoubleSpinBox()
+        self.robust_spinbox.valueChanged.connect(self.emit_robust_threshold_change)
+        self.robust_spinbox.setRange(0.5, 50)
+        self.robust_spinbox.setSuffix(" σ")
+        self.robust_spinbox.setSingleStep(0.1)
+        self.robust_spinbox.setValue(5)
+        outlier_layout.addWidget(self.robust_spinbox, 2, 2)
         # box that displays the percentage of rejected shots
         self.rejected_label = QLabel("Rejected shots (%)")
         self.rejected_value = QLineEdit()
         self.rejected_value.setPlaceholderText("--")    
         self.rejected_value.setReadOnly(True)              
-        outlier_layout.addWidget(self.rejected_label, 2, 0, 1, 2)
-        outlier_layout.addWidget(self.rejected_value, 2, 2)
+        outlier_layout.addWidget(self.rejected_label, 3, 0, 1, 2)
+        outlier_layout.addWidget(self.rejected_value, 3, 2)
+        # preview: histogram of the shot deviations of the last block and the percentage
+        # the active threshold would reject, updated without waiting for the next block
+        self.threshold_preview = ThresholdPreview()
+        self.deviation_spinbox.valueChanged.connect(self.update_rejection_preview)
+        self.robust_spinbox.valueChanged.connect(self.update_rejection_preview)
+        outlier_layout.addWidget(self.threshold_preview, 4, 0, 1, 3)
 
         # add widgets
         outlier_group.setLayout(outlier_layout)
         left_layout.addWidget(outlier_group)
+
+        # Processing controls, used by the live view and copied to a measurement when it starts
+        processing_group = QGroupBox("Processing")
+        processing_layout = QGridLayout()
+        # chopper decoding: pump-on/pump-off, or all four states with the scatter correction
+        processing_layout.addWidget(QLabel("Chopper decoding"), 0, 0)
+        self.chopper_decoding_box = QComboBox()
+        self.chopper_decoding_box.addItem("Pump on/off", "two-state")
+        self.chopper_decoding_box.addItem("Four states, scatter corrected", "four-state")
+        self.chopper_decoding_box.currentIndexChanged.connect(lambda: self.chopper_decoding_changed.emit(self.chopper_decoding_box.currentData()))
+        processing_layout.addWidget(self.chopper_decoding_box, 0, 1)
+        # pump-off reference of every pump-on shot
+        processing_layout.addWidget(QLabel("Pump-off reference"), 1, 0)
+        self.reference_mode_box = QComboBox()
+        self.reference_mode_box.addItem("Neighbouring shot", "paired")
+        self.reference_mode_box.addItem("Block average", "block")
+        self.reference_mode_box.addItem("Interpolated", "interpolated")
+        self.reference_mode_box.currentIndexChanged.connect(lambda: self.reference_mode_changed.emit(self.reference_mode_box.currentData()))
+        processing_layout.addWidget(self.reference_mode_box, 1, 1)
+        # blocks with several DMA blocks
+        processing_layout.addWidget(QLabel("DMA blocks"), 2, 0)
+        self.block_combination_box = QComboBox()
+        self.block_combination_box.addItem("Process all shots at once", "concatenate")
+        self.block_combination_box.addItem("Average the blocks", "average")
+        self.block_combination_box.currentIndexChanged.connect(lambda: self.block_combination_changed.emit(self.block_combination_box.currentData()))
+        processing_layout.addWidget(self.block_combination_box, 2, 1)
+        # normalise every shot with the reference channel read out as second region
+        self.referencing_checkbox = QCheckBox("Normalise with the reference channel")
+        self.referencing_checkbox.toggled.connect(self.toggle_referencing)
+        processing_layout.addWidget(self.referencing_checkbox, 3, 0, 1, 2)
+        processing_group.setLayout(processing_layout)
+        left_layout.addWidget(processing_group)
        
         # initially disable outlier rejection
         self.toggle_outlier_rejection(False)
@@ -316,13 +387,15 @@ class Probewindow(QMainWindow):
         Toggles the outlier rejection on/off
         """
 
-        # show/hide threshold and output fields
+        # show/hide mode, threshold and output fields
+        self.rejection_mode_label.setVisible(selected)
+        self.rejection_mode_box.setVisible(selected)
         self.deviation_label.setVisible(selected)
-        self.deviation_spinbox.setVisible(selected)
 
         # show/hide vertical lines that define the pixel range
         self.rejected_label.setVisible(selected)
         self.rejected_value.setVisible(selected)
+        self.threshold_preview.setVisible(selected)
 
         self.range_line_left.setVisible(selected)
         self.range_line_right.setVisible(selected)
@@ -330,6 +403,7 @@ class Probewindow(QMainWindow):
         if not selected:
             # Ensure the checkbox is unchecked
             self.outlier_checkbox.setChecked(False) 
+        self.show_threshold_spinbox()
 
         # Notify the worker thread to enable or disable outlier rejection
         self.switch_outlier_rejection.emit(selected)
@@ -337,8 +411,16 @@ class Probewindow(QMainWindow):
         if selected:
             # If outlier rejection is enabled, set previous settings
             self.emit_deviation_change(self.deviation_spinbox.value())
+            self.emit_robust_threshold_change(self.robust_spinbox.value())
             self.probe_outlier_range_changed() 
 
+    def show_threshold_spinbox(self) -> None:
+        """Show the threshold spinbox of the rejection mode while outlier rejection is on: % or σ."""
+        selected = self.outlier_checkbox.isChecked()
+        percentage = self.rejection_mode_box.currentData() == "percentage"
+        self.deviation_spinbox.setVisible(selected and percentage)
+        self.robust_spinbox.setVisible(selected and not percentage)
+
     def emit_deviation_change(self, value: float):
         """
         This method is called when the user adjusts the spinbox controlling
@@ -346,6 +428,17 @@ class Probewindow(QMainWindow):
         """
         self.deviation_threshold_changed.emit(value)
 
+    def emit_robust_threshold_change(self, value: float):
+        """Called when the user adjusts the threshold of the robust rejection modes."""
+        self.robust_threshold_changed.emit(value)
+
+    def emit_rejection_mode_change(self) -> None:
+        """Called when the user selects a rejection mode; it applies to the probe and the dA spectra."""
+        mode = self.rejection_mode_box.currentData()
+        self.rejection_mode_changed.emit(mode)
+        self.show_threshold_spinbox()
+        self.dA_window.show_rejection_mode(mode)
+
     @Slot()
     def probe_outlier_range_changed(self):
         """
@@ -378,6 +471,43 @@ class Probewindow(QMainWindow):
         """Fill the read-only box with the latest rejected-spectra percentage."""
         self.rejected_value.setText(f"{percent:.1f}")
 
+    @Slot(object)
+    def update_threshold_sweep(self, sweep) -> None:
+        """Draw the deviation histogram of the latest block and refresh the preview."""
+        self.threshold_preview.update_sweep(sweep, self.preview_threshold(sweep))
+
+    def update_rejection_preview(self) -> None:
+        """Show the percentage of shots of the latest block the active threshold rejects."""
+        self.threshold_preview.update_threshold(self.preview_threshold(self.threshold_preview.threshold_sweep))
+
+    def preview_threshold(self, sweep) -> float:
+        """The threshold of the rejection mode of sweep: the deviation (%) or the robust (σ) spinbox."""
+        if sweep is None:
+            return self.deviation_spinbox.value()
+        return sweep.threshold(self.deviation_spinbox.value(), self.robust_spinbox.value())
+
+    """
+    Helper functions: processing settings
+    """
+
+    def toggle_referencing(self, selected: bool) -> None:
+        """Start normalising with the reference channel with a new regression, or stop."""
+        self.referencing = Referencing() if selected else None
+        self.referencing_changed.emit(self.referencing)
+
+    def apply_processing_settings(self, data_processor) -> None:
+        """
+        Set the rejection mode, the robust thresholds and the processing settings of the GUI on
+        data_processor, e.g. on the ComputeData of a measurement before it starts.
+        """
+        data_processor.set_rejection_mode(self.rejection_mode_box.currentData())
+        data_processor.robust_threshold_change(self.robust_spinbox.value())
+        data_processor.dA_robust_threshold_change(self.dA_window.robust_spinbox.value())
+        data_processor.set_chopper_decoding(self.chopper_decoding_box.currentData())
+        data_processor.set_reference_mode(self.reference_mode_box.currentData())
+        data_processor.set_block_combination(self.block_combination_box.currentData())
+        data_processor.set_referencing(self.referencing)
+
 
     """Helper functions: GraphThread"""
 
@@ -397,6 +527,8 @@ class Probewindow(QMainWindow):
 
         #set dark noise. shape: None / List
         self.graph_worker.data_processor.dark_noise_correction = self.dark_noise  
+        # the processing settings of the GUI, changes arrive through the signals below
+        self.apply_processing_settings(self.graph_worker.data_processor)
 
         # Signal Wiring:
         # GUI → Worker: user enables/disables outlier rejection for probe/dA
@@ -405,12 +537,23 @@ class Probewindow(QMainWindow):
         # GUI → Worker: threshold value changes
         self.deviation_threshold_changed.connect(self.graph_worker.data_processor.deviation_change, Qt.QueuedConnection)
         self.dA_window.dA_deviation_threshold_changed.connect(self.graph_worker.data_processor.dA_deviation_change, Qt.QueuedConnection)
+        self.robust_threshold_changed.connect(self.graph_worker.data_processor.robust_threshold_change, Qt.QueuedConnection)
+        self.dA_window.dA_robust_threshold_changed.connect(self.graph_worker.data_processor.dA_robust_threshold_change, Qt.QueuedConnection)
+        # GUI → Worker: rejection mode and processing settings
+        self.rejection_mode_changed.connect(self.graph_worker.data_processor.set_rejection_mode, Qt.QueuedConnection)
+        self.chopper_decoding_changed.connect(self.graph_worker.data_processor.set_chopper_decoding, Qt.QueuedConnection)
+        self.reference_mode_changed.connect(self.graph_worker.data_processor.set_reference_mode, Qt.QueuedConnection)
+        self.block_combination_changed.connect(self.graph_worker.data_processor.set_block_combination, Qt.QueuedConnection)
+        self.referencing_changed.connect(self.graph_worker.data_processor.set_referencing, Qt.QueuedConnection)
          # Worker → GUI: send updated probe or dA data to UI
         self.graph_worker.probe_update.connect(self.update_probe_data, Qt.QueuedConnection)
         self.graph_worker.dA_update.connect(self.update_dA_graph, Qt.QueuedConnection)
         # Worker → GUI: update how many shots were rejected by outlier logic
         self.graph_worker.probe_rejected.connect(self.update_rejected_percentage, Qt.QueuedConnection)
         self.graph_worker.dA_rejected.connect(self.dA_window.update_rejected_percentage, Qt.QueuedConnection)
+        # Worker → GUI: deviation distributions for the threshold preview
+        self.graph_worker.probe_sweep.connect(self.update_threshold_sweep, Qt.QueuedConnection)
+        self.graph_worker.dA_sweep.connect(self.dA_window.update_threshold_sweep, Qt.QueuedConnection)
         
         # Start the thread
         self.graph_worker.start()
@@ -446,6 +589,12 @@ class Probewindow(QMainWindow):
             self.switch_outlier_rejection.disconnect()    
             self.dA_window.dA_switch_outlier_rejection.disconnect()
             self.deviation_threshold_changed.disconnect()
+            self.dA_window.dA_deviation_threshold_changed.disconnect()
+            self.robust_threshold_changed.disconnect()
+            self.dA_window.dA_robust_threshold_changed.disconnect()
+            for signal in (self.rejection_mode_changed, self.chopper_decoding_changed, self.reference_mode_changed,
+                           self.block_combination_changed, self.referencing_changed):
+                signal.disconnect()
 
             if hard_stop:
                 # If thread is stopped for a measurement, disable outlier rejection
@@ -42,6 +42,11 @@ class StartPopup(QDialog):
         layout.addWidget(self.notes_label)
         layout.addWidget(self.notes_box)
 
+        # Optionally keep every raw shot in a binary archive next to the CSV files
+        self.raw_shots_checkbox = QCheckBox("Record raw shots")
+        self.raw_shots_checkbox.setToolTip('Saves every camera shot to "<filename>_raw.raw" so the measurement can be reprocessed later. Needs a lot of disk space.')
+        layout.addWidget(self.raw_shots_checkbox)
+
         hbox = QHBoxLayout()
         self.filename_label = QLabel("Filename:")
         self.filename = QLineEdit("")
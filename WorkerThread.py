@@ -4,7 +4,16 @@ from PySide6.QtGui import *
 import numpy as np
 from Plot_Calculations import *
 from camera import *
+from raw_archive import RawShotRecorder
+from timing import Timings
+from running_stats import RunningStats
+from block_pool import BlockProcessingPool, useful_workers
+import stage_protocol
+from fly_scan import FlyScan, sweep_range, sweep_velocity
+from scan_planner import ORDERS, plan_scans, plan_travel, motion_time
 import socket
+import queue
+import threading
 import json
 import time
 import csv
@@ -24,39 +33,81 @@ class GraphThread(QThread):
     # - probe_rejected: emits percent of rejected probe measurements
     # - dA_update: emits averaged delta-A array
     # - dA_rejected: emits percent of rejected delta-A measurements
+    # - probe_sweep / dA_sweep: emit the ThresholdSweep of the block (None while outlier rejection is off)
     probe_update = Signal(np.ndarray)
     probe_rejected = Signal(float)
     dA_update = Signal(np.ndarray)
     dA_rejected = Signal(float)
+    probe_sweep = Signal(object)
+    dA_sweep = Signal(object)
     
 
-    def __init__(self, shots = 1000, parent: QObject | None = None):
+    def __init__(self, shots = 1000, acquisition_mode = "pipelined", parent: QObject | None = None):
         """
         Initialize the thread.
         shots: number of shots per acquisition block. 
+        acquisition_mode: "pipelined" acquires the next block while the current one is processed,
+        "continuous" lets the board stream blocks without restarting (not verified on the board yet),
+        "blocking" measures and processes one block at a time.
         """
         super().__init__(parent)
         self.shots = shots
+        self.acquisition_mode = acquisition_mode
         self.running = True
         self.scan_complete = False
         self.wavelengths = [f'{i}' for i in range(1, 1023)]
-        self.data_processor = ComputeData()
+        # the live view's own timings, a measurement does not reset them
+        self.timings = Timings()
+        self.data_processor = ComputeData(self.timings)
+        # the live view only shows the means
+        self.data_processor.collect_statistics = False
     
     def run(self):
         """Main execution loop. Continuously capture shots and process data until stopped."""
-        while self.running:
-            # capture raw data block from camera
-            block_buffer = camera(self.shots, 0)
-            block_2d_array = np.array(block_buffer).reshape(self.shots, 1088)
-
-            # process data: compute probe and dA averages
+        # keep the camera board open for as long as the thread runs
+        with CameraSession(timings=self.timings) as session:
+            if self.acquisition_mode == "continuous":
+                # the board keeps measuring; completed blocks are pulled from a queue
+                acquisition = ContinuousAcquisition(session, self.shots)
+                acquisition.start()
+                try:
+                    while self.running:
+                        with self.timings.span("block wait"):
+                            block_2d_array = acquisition.get(timeout=0.5)
+                        if block_2d_array is not None:
+                            self.process_block(block_2d_array)
+                finally:
+                    acquisition.stop()
+            elif self.acquisition_mode == "pipelined":
+                # the board acquires the next block while this one is processed
+                blocks = session.stream(self.shots)
+                try:
+                    for block_2d_array in blocks:
+                        if not self.running:
+                            break
+                        self.process_block(block_2d_array)
+                finally:
+                    blocks.close()
+            else:
+                while self.running:
+                    # capture a data block from camera, cropped to the chopper word and the active pixels
+                    block_2d_array = session.measure(self.shots)
+                    self.process_block(block_2d_array)
+
+    def process_block(self, block_2d_array):
+        """Compute the probe and dA averages of one block and emit them to the GUI."""
+        # process data: compute probe and dA averages
+        with self.timings.span("compute_spectra"):
             probe_spectrum, delta_A = self.data_processor.compute_spectra(block_2d_array)
 
-            # Emit processed data and rejection stats to visualize them in the GUI
+        # Emit processed data and rejection stats to visualize them in the GUI
+        with self.timings.span("signal emit"):
             self.probe_update.emit(probe_spectrum)
             self.dA_update.emit(delta_A)
             self.probe_rejected.emit(self.data_processor.rejected_probe)
             self.dA_rejected.emit(self.data_processor.rejected_dA)
+            self.probe_sweep.emit(self.data_processor.probe_sweep)
+            self.dA_sweep.emit(self.data_processor.dA_sweep)
     
     def stop(self):
         """
@@ -79,6 +130,8 @@ class MeasurementWorker(QThread):
     stop_button = Signal()
     plot_row_update = Signal(float, np.ndarray, int)
     reset_currentMatrix =  Signal()
+    # Future of a StageClient command, emitted from its reader thread and handled in the GUI thread
+    stage_reply = Signal(object)
 
     def __init__(self, content, orientation, shots, scans, host='localhost', port=9999):
         super().__init__()
@@ -90,10 +143,24 @@ class MeasurementWorker(QThread):
         self._scans = scans
         self.ref = None
         self.position = None
-        self.data_processor = ComputeData()
+        self.timings = Timings()
+        self.data_processor = ComputeData(self.timings)
         self.socket_host = host
         self.socket_port = port
         self.sock = None
+        self.camera_session = None
+        self.record_raw_shots = False
+        self.raw_recorder = None
+        # process blocks with many shots in a BlockProcessingPool on machines where useful_workers() is not 0;
+        # off by default, the pool was not measured faster than processing in place (benchmarks.py pool)
+        self.use_process_pool = False
+        # delay points that wait for processing while the next ones are acquired; 0 processes every point before the next one
+        self.processing_queue_size = 2
+        self.processing_queue = None
+        self.processing_thread = None
+        self.processing_error = None
+        # scan rate of the camera in continuous mode (the laser repetition rate), sets the fly-scan velocity
+        self.shot_rate_hz = 1000.0
 
     def setup_socket(self, argument):
         try:
@@ -107,8 +174,9 @@ class MeasurementWorker(QThread):
             self.start_process_signal.emit(argument)
             print("Waiting for connection from IronPython...")
             self.conn, _ = self.server_socket.accept()
+            self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             print("Connected.")
-            self.buffer = b""
+            self.frames = stage_protocol.FrameReader(self.conn)
         except Exception as e:
             print(f"Error in setup_socket: {e}")
             self.error_occurred.emit(str(e))
@@ -116,21 +184,15 @@ class MeasurementWorker(QThread):
 
 
     def receive_data_from_client(self):
+        """The next stage_protocol message from IronPython as (message type, values), None when the connection is closed."""
         try:
             print("Waiting for data from IronPython...")
-            while b"\n" not in self.buffer:
-                chunk = self.conn.recv(1024)  # Receive data from the client
-                if not chunk:
-                    print("Connection closed by client.")
-                    return None  # Return None if the connection is closed
-                self.buffer += chunk
-
-            # Parse the received message
-            line, self.buffer = self.buffer.split(b"\n", 1)
-            data = json.loads(line.decode())
-            print(f"Received data: {data}")
-            self.buffer = b""
-            return data  # Return the parsed data
+            message = self.frames.read()
+            if message is None:
+                print("Connection closed by client.")
+                return None  # Return None if the connection is closed
+            print(f"Received data: {stage_protocol.NAMES.get(message[0], message[0])} {message[1]}")
+            return message
         except Exception as e:
             print(f"Error receiving data from client: {e}")
             self.error_occurred.emit(str(e))
@@ -164,16 +226,26 @@ class MeasurementWorker(QThread):
     def wavelength_change(self, wavelengths):
         self.wavelengths = wavelengths
 
+    def set_raw_recording(self, enabled: bool):
+        """Record every raw block of the next measurement to <directory>/<filename>_raw.*"""
+        self.record_raw_shots = enabled
+
     @Slot(str)
     def run(self):
         print(f"This is {self._orientation}")
         self._is_running = True
-        if self._orientation in ("Regular", "Backwards", "Random"):
+        if self._orientation in ORDERS:
             try:
                 self._run_measurement_loop(self._content, self._shots, self._scans)
             except Exception as e:
                 self.error_occurred.emit(str(e))
 
+        if self._orientation == "Fly scan":
+            try:
+                self._run_fly_scan(self._content, self._shots, self._scans)
+            except Exception as e:
+                self.error_occurred.emit(str(e))
+
         if self._orientation == "ButtonPress":
             argument = self._content
             print(f"Running script with argument: {argument}")
@@ -212,39 +284,177 @@ class MeasurementWorker(QThread):
             self.scans = 1
             self.nos = scans
             self.averaged_probe_measurement = []
-            self.measurement_average = []
-            self.setup_socket(f"MeasurementLoop {content} {scans}")
+            # per delay: RunningStats of the probe and dA shots of all scans
+            self.delay_statistics = {}
+            self.timings.reset()
+            # open the camera once for the whole measurement instead of once per delay point
+            self.camera_session = CameraSession(timings=self.timings)
+            self.camera_session.open()
+            if self.use_process_pool and useful_workers():
+                # blocks with many shots are processed on all cores; the workers start with the first large block
+                self.data_processor.process_pool = BlockProcessingPool(useful_workers())
+            if self.record_raw_shots:
+                self.raw_recorder = RawShotRecorder(os.path.join(self.directory, f"{self.filename}_raw"))
+            self.start_processing()
+            # the stage script gets the delays of all scans in the planned order as a single scan, sent as
+            # a PLAN message: on the command line they can exceed the Windows limit of the process fallback
+            self.plan = plan_scans(content, self._orientation, scans, start=self.position - self.ref)
+            sequence = [delay for scan_delays in self.plan for delay in scan_delays]
+            print(f"{self._orientation} order: {plan_travel(self.plan, self.position - self.ref):.1f} ps of travel, "
+                  f"about {motion_time(self.plan, self.position - self.ref):.1f} s of motion")
+            self.setup_socket("MeasurementLoop plan")
+            stage_protocol.send(self.conn, stage_protocol.PLAN, *sequence)
+            # the scan whose points are being measured; scans are counted by the index of the stage, not by
+            # the delay, so orders in which a scan does not end on content[-1] are saved at the right point
+            current_scan = None
             while self._is_running:
-                while b"\n" not in self.buffer:
-                    chunk = self.conn.recv(1024)
-                    if not chunk:
-                        print("Connection closed.")
-                        return
-                    self.buffer += chunk
-
-                line, self.buffer = self.buffer.split(b"\n", 1)
-                data = json.loads(line.decode())
+                # time from the end of processing until the next delay point is reached; the stage moves
+                # while the previous block is processed, so this is only the part of the motion that is left
+                waiting_since = time.perf_counter()
+                message = self.frames.read()
+                if message is None:
+                    print("Connection closed.")
+                    if current_scan is not None and self._is_running:
+                        # the last points of the scan were skipped by the stage
+                        self.queue_processing(self.end_scan, current_scan + 1)
+                    return
+                self.timings.add("stage + socket", time.perf_counter() - waiting_since)
+
+                message_type, values = message
+                if message_type == stage_protocol.ERROR:
+                    print(f"Stage error: {values[0]}")
+                    self.error_occurred.emit(values[0])
+                    continue
+                if message_type != stage_protocol.MOVE_DONE:
+                    print(f"Unexpected message: {stage_protocol.NAMES.get(message_type, message_type)}")
+                    continue
 
                 # You receive one data point here
+                index, data, self.position = values
                 print(f"Received: {data}")
-                result = self.process_content(data, shots)
-
-                # Send a message back to the client socket
-                response = {"status": "processed", "counter": self.counter}
-                self.conn.sendall((json.dumps(response) + "\n").encode())
+                scan, point = divmod(index, len(content))
+                if scan != current_scan:
+                    if current_scan is not None:
+                        self.queue_processing(self.end_scan, current_scan + 1)
+                    self.queue_processing(self.start_scan, scan + 1)
+                    current_scan = scan
+                self.process_content(data, shots, index)
+                if point == len(content) - 1:
+                    self.queue_processing(self.end_scan, scan + 1)
+                    current_scan = None
 
                 self.counter += 1
 
         except Exception as e:
             self.error_occurred.emit(str(e))
+            # let the stage script end its loop instead of waiting for the acquisition
+            try:
+                stage_protocol.send(self.conn, stage_protocol.ERROR, str(e))
+            except OSError:
+                pass
         finally:
+            # process the points that were acquired before the loop ended
+            self.finish_processing()
+            if self.camera_session is not None:
+                self.camera_session.close()
+                self.camera_session = None
+            if self.raw_recorder is not None:
+                self.raw_recorder.close()
+                self.raw_recorder = None
+            if self.data_processor.process_pool is not None:
+                self.data_processor.process_pool.close()
+                self.data_processor.process_pool = None
             self.conn.close()
             self.server_socket.close()
 
+    def _run_fly_scan(self, content, shots: int, scans) -> None:
+        """
+        Measure content with constant-velocity sweeps instead of steps, see fly_scan.py. Every scan is one
+        sweep, alternately up and down; shots is the number of shots per delay bin of the narrowest spacing.
+        """
+        try:
+            self.ref, self.position = self.start_gui()
+            if not self.validate_reference_and_position(self.ref, content):
+                return
+
+            self.barvalue = self.ref
+            self.update_delay_bar_signal.emit(self.ref)
+            self.last_item = 0
+            self.counter = 0
+            self.teller = 0
+            self.content = content
+            self.scans = 1
+            self.nos = scans
+            self.averaged_probe_measurement = []
+            self.delay_statistics = {}
+            self.timings.reset()
+            self.camera_session = CameraSession(timings=self.timings)
+            self.camera_session.open()
+            if self.use_process_pool and useful_workers():
+                self.data_processor.process_pool = BlockProcessingPool(useful_workers())
+            if self.record_raw_shots:
+                self.raw_recorder = RawShotRecorder(os.path.join(self.directory, f"{self.filename}_raw"))
+            self.start_processing()
+
+            # the sweep reaches half a bin beyond the first and last delay, but not beyond the stage travel
+            start, end = sweep_range(content, -self.ref, 8672 - self.ref)
+            velocity = sweep_velocity(content, shots, self.shot_rate_hz)
+            print(f"Fly scan from {start} to {end} ps at {velocity} ps/s")
+            self.setup_socket(f"FlyScan {start} {end} {velocity} {scans}")
+            # the four chopper states repeat every four shots, pump-off/pump-on pairs every two
+            chopper_period = 4 if self.data_processor.chopper_decoding == "four-state" else 2
+            fly_scan = FlyScan(self.conn, self.camera_session, shots, content, scans, self.shot_rate_hz,
+                               chopper_period, keep_raw=self.raw_recorder is not None)
+            # the callbacks run on the processing thread, in the order of acquisition
+            fly_scan.run(lambda delay, block: self.queue_processing(self.process_bin, delay, block),
+                         lambda sweep, delays: self.queue_processing(self.start_scan, sweep),
+                         lambda sweep: self.queue_processing(self.end_scan, sweep),
+                         lambda: self._is_running)
+            if fly_scan.dropped_blocks:
+                print(f"Fly scan: {fly_scan.dropped_blocks} camera blocks were overwritten before they were binned")
+
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+        finally:
+            self.finish_processing()
+            if self.camera_session is not None:
+                self.camera_session.close()
+                self.camera_session = None
+            if self.raw_recorder is not None:
+                self.raw_recorder.close()
+                self.raw_recorder = None
+            if self.data_processor.process_pool is not None:
+                self.data_processor.process_pool.close()
+                self.data_processor.process_pool = None
+            if hasattr(self, "conn"):
+                self.conn.close()
+            self.server_socket.close()
+
+    def start_scan(self, scan):
+        """A scan (or fly-scan sweep) starts: collect the rows of its scan file from scratch."""
+        self.averaged_probe_measurement = []
+        self.scan_complete = False
 
+    def process_bin(self, delay, block):
+        """Process the shots binned at delay like a delay point of a step scan."""
+        self.barvalue = self.ref + delay
+        self.update_delay_bar_signal.emit(self.barvalue)
+        self.process_point(delay, block)
+
+    def end_scan(self, scan):
+        """A scan (or fly-scan sweep) ended: save it, unless that already happened."""
+        # a scan cut short by the stop button is saved by stop()
+        if not self.scan_complete and self._is_running:
+            self.complete_scan()
 
     def handle_process_output(self):
         stdout_line = self.process.readAllStandardOutput().data().decode('utf-8').strip()
+        for line in stdout_line.splitlines():
+            self.parse_stage_output(line.strip())
+        return self.ref, self.position
+
+    def parse_stage_output(self, stdout_line):
+        """Set the reference and current position from a line printed by IronPythonDLS.py."""
         if stdout_line:
 
             try:
@@ -280,6 +490,22 @@ class MeasurementWorker(QThread):
 
         return self.ref, self.position
 
+    @Slot(object)
+    def handle_stage_reply(self, future):
+        """Slot of stage_reply: parse the output of a StageClient command like that of a single ipy.exe process."""
+        try:
+            reply = future.result()
+        except Exception as e:
+            print(f"Error output: {e}")
+            self.error_occurred.emit(str(e))
+            return
+        for line in reply.get("output", "").splitlines():
+            self.parse_stage_output(line.strip())
+        if reply.get("errors"):
+            print(f"Error output: {reply['errors']}")
+            self.error_occurred.emit(reply["errors"])
+        print("Command finished.", time.time())
+
 
     def handle_process_error(self):
         stderr_line = self.process.readAllStandardError().data().decode('utf-8').strip()
@@ -297,8 +523,7 @@ class MeasurementWorker(QThread):
                 # Check if socket is still open
                 try:
                     if self.conn.fileno() != -1:
-                        stop_message = {"command": "stop"}
-                        self.conn.sendall((json.dumps(stop_message) + "\n").encode())
+                        stage_protocol.send(self.conn, stage_protocol.STOP)
                         print("Sent stop command to client.")
                     else:
                         pass
@@ -309,6 +534,13 @@ class MeasurementWorker(QThread):
         except Exception as e:
             print(f"Error sending stop command to client: {e}")
 
+        # The measurement thread leaves its loop once the stage script has closed the connection and
+        # processes the points that were queued before stop; only then are the partial files saved,
+        # so the processing thread no longer changes the scan while it is written
+        if self.isRunning() and QThread.currentThread() is not self:
+            self.wait(5000)
+        self.finish_processing()
+
         # Save current scan data if available
         if hasattr(self, "averaged_probe_measurement") and self.averaged_probe_measurement and self.scan_complete is False:
             try:
@@ -327,7 +559,7 @@ class MeasurementWorker(QThread):
                 print(f"Error saving partial scan data: {e}")
 
         # Save average of all scans if more than one scan
-        if hasattr(self, "measurement_average") and self.nos > 1 and self.measurement_average and self.scan_complete is False:
+        if hasattr(self, "delay_statistics") and self.nos > 1 and self.delay_statistics and self.scan_complete is False:
             try:
                 self.save_avg_file(
                     getattr(self, "directory", ""),
@@ -386,13 +618,15 @@ class MeasurementWorker(QThread):
     def start_gui(self):
         self.setup_socket("StartGUI")
         try:
-            data = self.receive_data_from_client()
-            if data is None:
+            message = self.receive_data_from_client()
+            if message is None:
                 return 
 
             # Extract position and reference from the received data
-            self.position = data.get("position", 0)
-            self.ref = data.get("reference", 0)
+            message_type, values = message
+            if message_type == stage_protocol.ERROR:
+                raise RuntimeError(values[0])
+            self.position, self.ref = values
 
             # Emit signals to update the GUI
             self.update_ref_signal.emit(self.ref)
@@ -406,61 +640,174 @@ class MeasurementWorker(QThread):
 
 
 
-    def process_content(self, delay_relative, number_of_shots):
-        blocks = []
-        dA_inputs_avg = 0
+    def start_processing(self):
+        """Start the thread that processes the acquired delay points in the order of acquisition."""
+        self.processing_error = None
+        if self.processing_queue_size <= 0:
+            return
+        self.processing_queue = queue.Queue(maxsize=self.processing_queue_size)
+        self.processing_thread = threading.Thread(target=self._process_points, args=(self.processing_queue,), daemon=True)
+        self.processing_thread.start()
+
+    def _process_points(self, processing_queue):
+        """Processing thread: call the (function, arguments) of processing_queue until None is queued."""
+        while True:
+            point = processing_queue.get()
+            if point is None:
+                return
+            if self.processing_error is not None:
+                # after an error the remaining points are only taken off the queue
+                continue
+            try:
+                function, arguments = point
+                function(*arguments)
+            except Exception as e:
+                self.processing_error = e
+
+    def finish_processing(self):
+        """
+        Wait until the queued points are processed and stop the processing thread. Called by the
+        measurement thread when it ends and by stop(); only the first call joins the thread.
+        """
+        thread, processing_queue = self.processing_thread, self.processing_queue
+        self.processing_thread = None
+        self.processing_queue = None
+        if thread is not None:
+            processing_queue.put(None)
+            thread.join()
+        if self.processing_error is not None:
+            error, self.processing_error = self.processing_error, None
+            print(f"Error processing delay point: {error}")
+            self.error_occurred.emit(str(error))
+
+    def process_content(self, delay_relative, number_of_shots, index=None):
+        """
+        Measure the delay point delay_relative and process it. index is the number of the point in the
+        measurement loop; the stage script moves on as soon as its acquisition is confirmed.
+        With a processing thread, the point is queued and the next point can be acquired while it is
+        processed; when processing_queue_size points are waiting, this waits for the oldest one.
+        """
+        block_2d_array = self.acquire_point(delay_relative, number_of_shots, index)
+        if not self._is_running:
+            # stopped during the acquisition: the point is not part of the saved scan
+            return []
+        if self.processing_thread is None:
+            return self.process_point(delay_relative, block_2d_array)
+        if self.processing_error is not None:
+            raise self.processing_error
+        # the camera reuses its buffers, the queued block needs its own copy
+        with self.timings.span("block copy"):
+            block_2d_array = block_2d_array.copy(raw=self.raw_recorder is not None)
+        self.queue_processing(self.process_point, delay_relative, block_2d_array)
+        return [block_2d_array]
+
+    def queue_processing(self, function, *arguments):
+        """
+        Call function(*arguments) on the processing thread, or right away without one.
+        Delay points and fly-scan bins that arrive after stop() are dropped.
+        """
+        if not self._is_running and function in (self.process_point, self.process_bin):
+            return None
+        if self.processing_thread is None:
+            return function(*arguments)
+        if self.processing_error is not None:
+            raise self.processing_error
+        with self.timings.span("processing backlog"):
+            self.processing_queue.put((function, arguments))
+
+    def acquire_point(self, delay_relative, number_of_shots, index=None):
+        """Measure the shots of a delay point and confirm the acquisition to the stage script."""
         pos = delay_relative
         pos -= self.last_item
-        if delay_relative == self.content[0]:
-            self.averaged_probe_measurement = []
-        self.scan_complete = False
         self.barvalue += pos
+        self.last_item = delay_relative
 
         self.update_delay_bar_signal.emit(self.barvalue)
-        block_buffer = camera(number_of_shots, self.counter)
-        block_2d_array = np.array(block_buffer).reshape(number_of_shots, 1088)
-        blocks.append(block_2d_array)
+        with self.timings.span("camera"):
+            block_2d_array = self.camera_session.measure(number_of_shots)
+        if index is not None:
+            # the exposure is done: the stage moves to the next point while this block is processed
+            with self.timings.span("socket reply"):
+                stage_protocol.send(self.conn, stage_protocol.ACQ_DONE, index)
+        return block_2d_array
+
+    def process_point(self, delay_relative, block_2d_array):
+        """Process, plot and save the block of a delay point."""
+        blocks = [block_2d_array]
+        dA_inputs_avg = 0
+        self.scan_complete = False
 
-        probe_avg, dA_avg = self.data_processor.compute_spectra(block_2d_array)
+        if self.raw_recorder is not None:
+            # the delay index is the position of the delay in the grid, whatever order the points are measured in
+            positions = self.content_positions()
+            with self.timings.span("raw recording"):
+                self.raw_recorder.record(self.scans, positions.get(float(delay_relative), len(positions)), delay_relative, block_2d_array)
+
+        with self.timings.span("compute_spectra"):
+            probe_avg, dA_avg = self.data_processor.compute_spectra(block_2d_array)
+            # add the shots of this block to the statistics of its delay point over all scans
+            probe_stats, dA_stats = self.delay_statistics.setdefault(delay_relative, (RunningStats(), RunningStats()))
+            probe_stats.merge(self.data_processor.probe_stats)
+            dA_stats.merge(self.data_processor.delta_A_stats)
         self.averaged_probe_measurement.append((delay_relative, *probe_avg))
         delaytime = delay_relative                                     
         # last‑shot ΔA row
         row_data_avg = dA_avg
-        self.plot_row_update.emit(delaytime, row_data_avg, self.scans) 
-        self.update_dA.emit(row_data_avg) 
+        with self.timings.span("signal emit"):
+            self.plot_row_update.emit(delaytime, row_data_avg, self.scans) 
+            self.update_dA.emit(row_data_avg) 
 
-        self.update_probe.emit(probe_avg)  # Emit probe data incrementally
+            self.update_probe.emit(probe_avg)  # Emit probe data incrementally
         dA_average = np.mean(dA_avg, axis=0)
         
-        self.last_item = delaytime # Convert to picoseconds for display
         dA_inputs_avg = np.mean(dA_average)
 
-        self.measurement_data_updated.emit(delaytime, dA_inputs_avg)
-        self.teller += 1
-        self.current_step_signal.emit(self.teller, self.scans)
+        with self.timings.span("signal emit"):
+            self.measurement_data_updated.emit(delaytime, dA_inputs_avg)
+            self.teller += 1
+            self.current_step_signal.emit(self.teller, self.scans)
+
+        return blocks
 
-        """When a scan is completed, save the data to a CSV file in the format:
-        Delay, Probe_Avg (per pixel)"""
-        if delay_relative == self.content[-1]:
+    def complete_scan(self):
+        """
+        When a scan is completed, save the data to a CSV file in the format:
+        Delay, Probe_Avg (per pixel)
+        """
+        with self.timings.span("save files"):
             self.save_scan_file(self.directory, self.filename, self.sample, self.solvent, self.pump, self.pathlength, self.exc_power, self.notes)
-            self.scan_complete = True
-            if self.nos == self.scans and self.nos > 1:
+        self.scan_complete = True
+        if self.nos == self.scans and self.nos > 1:
+            with self.timings.span("save files"):
                 self.save_avg_file(self.directory, self.filename, self.sample, self.solvent, self.pump, self.pathlength, self.exc_power, self.notes)
- 
-            if self.scans != self.nos:
-                self.reset_currentMatrix.emit() 
-                
-            self.scans += 1
+        # per-scan timing summary next to the scan files
+        self.timings.end_scan(self.scans)
+        self.timings.save_summary(os.path.join(self.directory, f"{self.filename}_Timing.csv"))
+        print(self.timings.report())
+
+        if self.scans != self.nos:
+            self.reset_currentMatrix.emit() 
             
-        return blocks
+        self.scans += 1
     
 
+    def content_positions(self):
+        """Position of every delay in the delay grid content, by delay."""
+        return {float(delay): position for position, delay in enumerate(getattr(self, "content", []))}
+
+    def in_content_order(self, items, key=lambda delay: delay):
+        """items sorted in the order of their delays (key(item)) in content; other delays go last."""
+        positions = self.content_positions()
+        return sorted(items, key=lambda item: positions.get(float(key(item)), len(positions)))
+
     def save_scan_file(self, directory, name, sample, solvent, pump, pathlength, exc_power, notes):
         if self.nos > 1:
             filename = f"{name}_Scan_{self.scans}.csv"
         else:
             filename = f"{name}.csv"
         filepath = os.path.join(directory, filename)  # Combine directory and filename
+        # the rows follow the delay grid, whatever order the points were measured in
+        rows = self.in_content_order(self.averaged_probe_measurement, key=lambda row: row[0])
         with open(filepath, mode='w', newline='') as file:
             writer = csv.writer(file)
             
@@ -468,45 +815,44 @@ class MeasurementWorker(QThread):
             writer.writerow(['Sample', 'Solvent', f'Pump ({self.pump_unit})', f'Path Length ({self.pathlength_unit})', f'Excitation Power({self.exc_power_unit})', 'Notes', 'Delay (ps)'] + [f'{i}' for i in self.wavelengths])
             
             # Write metadata and the first row of measurement data in the next row
-            writer.writerow([sample, solvent, pump, pathlength, exc_power, notes, self.averaged_probe_measurement[0][0]] + list(self.averaged_probe_measurement[0][1:]))
+            writer.writerow([sample, solvent, pump, pathlength, exc_power, notes, rows[0][0]] + list(rows[0][1:]))
             
             # Write the remaining rows of measurement data (excluding the first row already written)
-            for row in self.averaged_probe_measurement[1:]:
+            for row in rows[1:]:
                 writer.writerow([None, None, None, None, None, None, row[0]] + list(row[1:]))  # Convert tuple to list for concatenation
         
         print(f"Saved measurement data to {filepath}")
-        self.measurement_average.append(np.array([list(row[1:]) for row in self.averaged_probe_measurement]))  # Exclude delay time for averaging
 
         # Make sure the stop button gets disabled after the measurement is done.
         if self.nos == 1:
             self.stop_button.emit()
 
     def save_avg_file(self, directory, name, sample, solvent, pump, pathlength, exc_power, notes):
-        # Allow averaging even if scans have different lengths (pad with NaN)
-        if not self.measurement_average:
+        # The statistics hold every shot of every scan per delay, so scans with missing delay points need no padding
+        if not self.delay_statistics:
             print("No scans to average.")
             return
 
-        max_len = max(scan.shape[0] for scan in self.measurement_average)
-        num_pixels = self.measurement_average[0].shape[1] if self.measurement_average else 0
-
-        # Pad scans with NaN so all have the same number of delay points
-        padded_scans = []
-        for scan in self.measurement_average:
-            if scan.shape[0] < max_len:
-                pad_width = ((0, max_len - scan.shape[0]), (0, 0))
-                padded = np.pad(scan, pad_width, mode='constant', constant_values=np.nan)
-                padded_scans.append(padded)
-            else:
-                padded_scans.append(scan)
-        all_scans = np.array(padded_scans)  # Shape: (scans, max_len, pixels)
-
-        # Calculate the average for each delay across all scans, ignoring NaN
-        avg_all_scans = np.round(np.nanmean(all_scans, axis=0), 4)  # Shape: (max_len, pixels)
+        delays = self.in_content_order(self.delay_statistics)
+        probe_statistics = [self.delay_statistics[delay][0] for delay in delays]
+        dA_statistics = [self.delay_statistics[delay][1] for delay in delays]
+
+        # Save the averages and their standard errors of the mean to CSV files
+        for filename, rows in (
+            (f"{name}_Average_Probe_Entire_Measurement.csv", [np.round(stats.mean, 4) for stats in probe_statistics]),
+            (f"{name}_Average_Probe_SEM_Entire_Measurement.csv", [stats.sem for stats in probe_statistics]),
+            (f"{name}_Average_dA_Entire_Measurement.csv", [stats.mean for stats in dA_statistics]),
+            (f"{name}_Average_dA_SEM_Entire_Measurement.csv", [stats.sem for stats in dA_statistics]),
+        ):
+            filepath = os.path.join(directory, filename)
+            self.write_delay_matrix(filepath, delays, rows, sample, solvent, pump, pathlength, exc_power, notes)
+        self.stop_button.emit()
+        self.averaged_probe_measurement = []
+        self.delay_statistics = {}
+        print(f"Saved averaged measurement data to {directory}")
 
-        # Save the averaged data to a CSV file
-        filename = f"{name}_Average_Probe_Entire_Measurement.csv"
-        filepath = os.path.join(directory, filename)
+    def write_delay_matrix(self, filepath, delays, rows, sample, solvent, pump, pathlength, exc_power, notes):
+        """Write one row per delay in the layout of the scan files, with the metadata in the first data row."""
         with open(filepath, mode='w', newline='') as file:
             writer = csv.writer(file)
 
@@ -514,14 +860,8 @@ class MeasurementWorker(QThread):
             writer.writerow(['Sample', 'Solvent', f'Pump ({self.pump_unit})', f'Path Length ({self.pathlength_unit})', f'Excitation Power({self.exc_power_unit})', 'Notes', 'Delay (ps)'] + [f'{i}' for i in self.wavelengths])
 
             # Write metadata and the first row of measurement data in the next row
-            delay = self.content[0] if len(self.content) > 0 else None
-            writer.writerow([sample, solvent, pump, pathlength, exc_power, notes, delay] + avg_all_scans[0].tolist())
+            writer.writerow([sample, solvent, pump, pathlength, exc_power, notes, delays[0]] + rows[0].tolist())
 
-            # Write the averaged data for each delay (excluding the first row already written)
-            for i, row in enumerate(avg_all_scans[1:], start=1):
-                delay = self.content[i] if i < len(self.content) else None
+            # Write the data for each delay (excluding the first row already written)
+            for delay, row in zip(delays[1:], rows[1:]):
                 writer.writerow([None, None, None, None, None, None, delay] + row.tolist())
-        self.stop_button.emit()
-        self.averaged_probe_measurement = []
-        self.measurement_average = []
-        print(f"Saved averaged measurement data to {filepath}")
@@ -0,0 +1,482 @@
+"""
+Benchmarks for the acquisition and processing pipeline that run without the camera board.
+
+Usage: python benchmarks.py <benchmark> [<benchmark> ...]
+Run without arguments to see the available benchmarks.
+"""
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from camera import *
+from Plot_Calculations import ComputeData
+from simulated_camera import SimulatedESLSCDLL, SimulatedTASample
+from block_pool import BlockProcessingPool, useful_workers
+from referencing import Referencing
+from simulated_stage import SimulatedDLS
+from stage_sweep import run_fly_scan
+from fly_scan import FlyScan, bin_edges, sweep_velocity
+from scan_planner import ORDERS, plan_scans, plan_travel, motion_time
+
+def report(label, seconds, repeats):
+    print(f"{label:<45} {seconds / repeats * 1000:10.3f} ms per block")
+
+def bench_session(blocks=20, shots=1000):
+    """Driver init/exit per block (old camera()) versus one long-lived CameraSession."""
+    dll = SimulatedESLSCDLL()
+
+    start = time.perf_counter()
+    for _ in range(blocks):
+        with CameraSession(dll) as session:
+            session.measure(shots)
+    report("init/exit per block", time.perf_counter() - start, blocks)
+
+    start = time.perf_counter()
+    with CameraSession(dll) as session:
+        for _ in range(blocks):
+            session.measure(shots)
+    report("persistent CameraSession", time.perf_counter() - start, blocks)
+
+def bench_transfer(repeats=5, scans=1000, pixel=1088):
+    """ctypes block buffer to NumPy: copying np.array() versus a zero-copy view."""
+    block_buffer = (c_uint16 * (scans * pixel))(0)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        np.array(block_buffer).reshape(scans, pixel)
+    report(f"np.array(buffer) {scans}x{pixel}", time.perf_counter() - start, repeats)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        np.ctypeslib.as_array(block_buffer).reshape(scans, pixel)
+    report(f"np.ctypeslib.as_array view {scans}x{pixel}", time.perf_counter() - start, repeats)
+
+def bench_pipeline(blocks=20, shots=1000, scan_rate_hz=20000):
+    """Blocking acquire-then-process loop versus the double-buffered stream()."""
+    dll = SimulatedESLSCDLL(scan_rate_hz=scan_rate_hz)
+    data_processor = ComputeData()
+
+    with CameraSession(dll) as session:
+        session.configure(shots)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            data_processor.compute_spectra(session.measure(shots))
+        report("blocking measure + compute_spectra", time.perf_counter() - start, blocks)
+
+        start = time.perf_counter()
+        stream = session.stream(shots)
+        for _, block in zip(range(blocks), stream):
+            data_processor.compute_spectra(block)
+        stream.close()
+        report("pipelined stream + compute_spectra", time.perf_counter() - start, blocks)
+    print(f"acquisition time alone: {dll.measurement_duration() * 1000:.3f} ms per block")
+
+def bench_continuous(blocks=20, shots=1000, scan_rate_hz=20000):
+    """Live-view refresh rate: pipelined stream() versus the free-running ContinuousAcquisition."""
+    dll = SimulatedESLSCDLL(scan_rate_hz=scan_rate_hz)
+    data_processor = ComputeData()
+
+    with CameraSession(dll) as session:
+        start = time.perf_counter()
+        stream = session.stream(shots)
+        for _, block in zip(range(blocks), stream):
+            data_processor.compute_spectra(block)
+        stream.close()
+        report("pipelined stream + compute_spectra", time.perf_counter() - start, blocks)
+
+        acquisition = ContinuousAcquisition(session, shots)
+        acquisition.start()
+        start = time.perf_counter()
+        received = 0
+        while received < blocks:
+            block = acquisition.get(timeout=1.0)
+            if block is not None:
+                data_processor.compute_spectra(block)
+                received += 1
+        report("continuous acquisition + compute_spectra", time.perf_counter() - start, blocks)
+        acquisition.stop()
+        print(f"dropped blocks: {acquisition.dropped_blocks}")
+
+def legacy_compute_spectra(block, start_pixel=12, end_pixel=1035):
+    """The pump-off probe and dA computation on uncropped (shots, 1088) blocks, as it was before cropping."""
+    block = np.asarray(block)
+    probe = block[block[:, 2] < 49152, start_pixel:end_pixel]
+    pump_off_dA = block[block[:, 2] < 49152, start_pixel:end_pixel]
+    pump_on_dA = block[block[:, 2] >= 49152, start_pixel:end_pixel]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.divide(pump_on_dA, pump_off_dA)
+        ratio[ratio <= 0] = np.nan
+        delta_A = -np.log(ratio)
+    return np.mean(probe, axis=0), np.mean(delta_A, axis=0)
+
+def measure_peak(function, *args):
+    """Run function once and return (seconds, peak traced memory in MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 1e6
+
+def bench_crop(shot_counts=(1000, 10000, 50000)):
+    """
+    Memory and throughput of processing uncropped blocks versus the cropped views of a CameraBlock.
+    compute_spectra runs without statistics, like the uncropped computation, and with them.
+    """
+    dll = SimulatedESLSCDLL()
+    data_processor = ComputeData()
+    pixel_window = sensor_pixel_windows[4]
+    for shots in shot_counts:
+        with CameraSession(dll) as session:
+            block = session.measure(shots)
+        raw = block.raw
+        print(f"{len(raw)} scans: raw block {raw.nbytes / 1e6:.1f} MB, active pixels {block.pixels.size * 2 / 1e6:.1f} MB")
+        seconds, peak = measure_peak(legacy_compute_spectra, raw)
+        print(f"  {'uncropped compute':<38}{seconds * 1000:10.3f} ms, peak {peak:8.1f} MB")
+        seconds, peak = measure_peak(pixel_window.crop, raw)
+        print(f"  {'crop (views)':<38}{seconds * 1000:10.3f} ms, peak {peak:8.1f} MB")
+        for collect_statistics in (False, True):
+            data_processor.collect_statistics = collect_statistics
+            data_processor.compute_spectra(block)  # allocate the work buffers
+            seconds, peak = measure_peak(data_processor.compute_spectra, pixel_window.crop(raw))
+            label = "crop + compute_spectra" + (" + statistics" if collect_statistics else "")
+            print(f"  {label:<38}{seconds * 1000:10.3f} ms, peak {peak:8.1f} MB")
+
+def bench_sample(blocks=20, shots=1000, delays=(-1.0, 0.5, 5.0, 100.0)):
+    """Throughput of acquisition + compute_spectra with realistic shots, and the recovered dA per delay."""
+    sample = SimulatedTASample()
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=sample, seed=0)
+    data_processor = ComputeData()
+
+    with CameraSession(dll) as session:
+        session.configure(shots)
+        session.measure(shots)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            block = session.measure(shots)
+        report("simulated sample acquisition", time.perf_counter() - start, blocks)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            data_processor.compute_spectra(block)
+        report("compute_spectra on simulated sample", time.perf_counter() - start, blocks)
+
+        for delay in delays:
+            sample.delay_ps = delay
+            delta_A = np.mean([data_processor.compute_spectra(session.measure(shots))[1] for _ in range(blocks)], axis=0)
+            expected = sample.delta_A()
+            print(f"delay {delay:8.2f} ps: max |dA| expected {np.abs(expected).max():.5f}, "
+                  f"rms error {np.sqrt(np.nanmean((delta_A - expected) ** 2)):.5f}")
+
+def float64_compute_spectra(block, dark_noise_correction=None):
+    """The compute_spectra dA path before the single-pass kernel: three masked copies, float64 division and log."""
+    pixels = block.pixels
+    probe = pixels[block.chopper < 49152]
+    pump_off_dA = pixels[block.chopper < 49152]
+    pump_on_dA = pixels[block.chopper >= 49152]
+    if dark_noise_correction is not None:
+        probe = probe - dark_noise_correction
+        pump_off_dA = pump_off_dA - dark_noise_correction
+        pump_on_dA = pump_on_dA - dark_noise_correction
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.divide(pump_on_dA, pump_off_dA)
+        ratio[ratio <= 0] = np.nan
+        delta_A = -np.log(ratio)
+    return np.mean(probe, axis=0), np.mean(delta_A, axis=0)
+
+def bench_kernel(shot_counts=(1000, 5000, 10000), repeats=10):
+    """compute_spectra before and after the single-pass float32 kernel, with dark correction."""
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=SimulatedTASample(delay_ps=1.0), seed=0)
+    data_processor = ComputeData()
+    data_processor.dark_noise_correction = np.full(sensor_pixel_windows[4].width, 400.0)
+    for shots in shot_counts:
+        with CameraSession(dll) as session:
+            block = session.measure(shots)
+        print(f"{len(block)} scans per block")
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, expected = float64_compute_spectra(block, data_processor.dark_noise_correction)
+        report("  float64 masked copies", time.perf_counter() - start, repeats)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, delta_A = data_processor.compute_spectra(block)
+        report("  single-pass float32 kernel", time.perf_counter() - start, repeats)
+        print(f"  max |difference| in dA: {np.nanmax(np.abs(delta_A - expected)):.2e}")
+        data_processor.collect_statistics = False
+        start = time.perf_counter()
+        for _ in range(repeats):
+            data_processor.compute_spectra(block)
+        report("  kernel without per-pixel statistics", time.perf_counter() - start, repeats)
+        data_processor.collect_statistics = True
+
+def bench_periodic(shot_counts=(1000, 5000, 10000), repeats=10):
+    """
+    compute_spectra with mask splitting versus strided views for an alternating chopper, without and with
+    the statistics pass; with statistics the split is a smaller part of the time and the gain is smaller.
+    """
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=SimulatedTASample(delay_ps=1.0), seed=0)
+    for shots in shot_counts:
+        with CameraSession(dll) as session:
+            block = session.measure(shots)
+        print(f"{len(block)} scans per block, chopper phases {ComputeData().periodic_phases(block.chopper)}")
+        for collect_statistics in (False, True):
+            for use_periodic_split, label in ((False, "mask split"), (True, "strided split")):
+                # a new ComputeData, so the first call allocates its own work buffers
+                data_processor = ComputeData()
+                data_processor.collect_statistics = collect_statistics
+                data_processor.use_periodic_split = use_periodic_split
+                seconds, peak = measure_peak(data_processor.compute_spectra, block)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    data_processor.compute_spectra(block)
+                label += ", statistics" if collect_statistics else ""
+                report(f"  {label} (first call peak {peak:.1f} MB)", time.perf_counter() - start, repeats)
+
+def bench_pairing(shots=2000, dropped=300, repeats=10):
+    """dA error and time per reference mode for blocks with dropped shots, versus truncated pairing."""
+    sample = SimulatedTASample(delay_ps=1.0, shot_jitter=0.05, scatter_counts=0)
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=sample, seed=0)
+    rng = np.random.default_rng(0)
+    with CameraSession(dll) as session:
+        block = session.measure(shots)
+    # dropped shots break the alternating chopper pattern, as missed triggers do
+    keep = np.ones(len(block), dtype=bool)
+    keep[rng.choice(len(block), dropped, replace=False)] = False
+    cropped = sensor_pixel_windows[4].crop(block.raw[keep])
+    expected = sample.delta_A()
+
+    pump_on = cropped.chopper >= 49152
+    pairs = min(np.count_nonzero(pump_on), np.count_nonzero(~pump_on))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        truncated = -np.log(cropped.pixels[pump_on][:pairs] / cropped.pixels[~pump_on][:pairs]).mean(axis=0)
+    print(f"{len(cropped)} scans, {dropped} dropped")
+    print(f"  {'truncated pairing':<30} rms dA error {np.sqrt(np.nanmean((truncated - expected) ** 2)):.5f}")
+    for mode in ("paired", "block", "interpolated"):
+        data_processor = ComputeData()
+        data_processor.reference_mode = mode
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, delta_A = data_processor.compute_spectra(cropped)
+        seconds = (time.perf_counter() - start) / repeats
+        print(f"  {mode:<30} rms dA error {np.sqrt(np.nanmean((delta_A - expected) ** 2)):.5f}, {seconds * 1000:.3f} ms per block")
+
+def bench_log_table(shot_counts=(1000, 5000, 10000), repeats=10):
+    """
+    dA with division and np.log versus the opt-in 16-bit log lookup table, with a fractional dark correction.
+    The table is the slower of the two, which is why use_log_table stays off.
+    """
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=SimulatedTASample(delay_ps=1.0), seed=0)
+    dark = np.linspace(395, 405, sensor_pixel_windows[4].width)
+    for shots in shot_counts:
+        with CameraSession(dll) as session:
+            block = session.measure(shots)
+        print(f"{len(block)} scans per block")
+        results = {}
+        for use_log_table, label in ((False, "division + np.log"), (True, "log lookup table")):
+            data_processor = ComputeData()
+            data_processor.collect_statistics = False
+            data_processor.dark_noise_correction = dark
+            data_processor.use_log_table = use_log_table
+            data_processor.compute_spectra(block)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                results[label] = data_processor.compute_spectra(block)[1]
+            report(f"  {label}", time.perf_counter() - start, repeats)
+        print(f"  max |difference| in dA: {np.nanmax(np.abs(results['log lookup table'] - results['division + np.log'])):.2e}")
+
+def bench_pool(shot_counts=(10000, 50000), repeats=3, modes=("off", "percentage", "mad", "sigma_clip")):
+    """
+    compute_spectra in this process versus shot chunks in a BlockProcessingPool with one worker per CPU,
+    for every rejection mode on blocks with outlier shots; the pool has to reject the same shots.
+    """
+    sample = SimulatedTASample(delay_ps=1.0, outlier_probability=0.01, outlier_factor=0.5)
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=sample, seed=0)
+    with BlockProcessingPool() as pool:
+        print(f"{pool.workers} worker processes, used by the measurement: {useful_workers() > 0}")
+        for shots in shot_counts:
+            with CameraSession(dll) as session:
+                block = session.measure(shots)
+            print(f"{len(block)} scans per block")
+            for mode in modes:
+                data_processor = ComputeData()
+                if mode != "off":
+                    data_processor.outlier_rejection_probe = data_processor.outlier_rejection_dA = True
+                    data_processor.rejection_mode = mode
+                    data_processor.deviation_threshold_probe = data_processor.deviation_threshold_dA = 10
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    _, expected = data_processor.compute_spectra(block)
+                report(f"  {mode}: single process", time.perf_counter() - start, repeats)
+                rejected = (data_processor.rejected_probe, data_processor.rejected_dA)
+
+                data_processor.process_pool = pool
+                data_processor.parallel_min_scans = 0
+                # the first block starts the workers
+                data_processor.compute_spectra(block)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    _, delta_A = data_processor.compute_spectra(block)
+                report(f"  {mode}: process pool", time.perf_counter() - start, repeats)
+                print(f"  max |difference| in dA: {np.nanmax(np.abs(delta_A - expected)):.2e}, rejected probe/dA "
+                      f"{rejected[0]:.2f}/{rejected[1]:.2f} % in one process, "
+                      f"{data_processor.rejected_probe:.2f}/{data_processor.rejected_dA:.2f} % in the pool")
+
+def bench_rejection(shots=5000, repeats=5):
+    """Time, rejected percentage and dA error of every outlier rejection mode on a block with outlier shots."""
+    sample = SimulatedTASample(delay_ps=1.0, outlier_probability=0.01, outlier_factor=0.5, scatter_counts=0)
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=sample, seed=0)
+    with CameraSession(dll) as session:
+        block = session.measure(shots)
+    expected = sample.delta_A()
+    print(f"{len(block)} scans per block, {sample.outlier_probability:.0%} outlier shots")
+    for mode, threshold in (("off", None), ("percentage", 10), ("mad", 5.0), ("sigma_clip", 5.0), ("pixel_clip", 5.0)):
+        data_processor = ComputeData()
+        data_processor.collect_statistics = False
+        if threshold is not None:
+            data_processor.outlier_rejection_probe = data_processor.outlier_rejection_dA = True
+            data_processor.rejection_mode = mode
+            data_processor.deviation_threshold_probe = data_processor.deviation_threshold_dA = threshold
+            data_processor.robust_threshold_probe = data_processor.robust_threshold_dA = threshold
+        data_processor.compute_spectra(block)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, delta_A = data_processor.compute_spectra(block)
+        seconds = (time.perf_counter() - start) / repeats
+        print(f"  {mode:<12} rejected {data_processor.rejected_dA:6.2f} %, rms dA error "
+              f"{np.sqrt(np.nanmean((delta_A - expected) ** 2)):.5f}, {seconds * 1000:.3f} ms per block")
+
+def bench_referencing(blocks=5, shots=5000, jitters=(0.005, 0.02, 0.05)):
+    """dA error and time without and with reference-channel normalisation, for several laser jitters."""
+    for jitter in jitters:
+        sample = SimulatedTASample(delay_ps=1.0, shot_jitter=jitter, scatter_counts=0, outlier_probability=0, reference_counts=12000)
+        dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=sample, seed=0)
+        expected = sample.delta_A()
+        with CameraSession(dll) as session:
+            # copies, the session reuses its buffers
+            measured = [session.measure(shots) for _ in range(blocks)]
+            measured = [CameraBlock(block.chopper.copy(), block.pixels.copy()) for block in measured]
+        print(f"shot jitter {jitter:.1%}, {blocks} blocks of {len(measured[0]) // 2} shots")
+        for referencing, label in ((None, "probe only"), (Referencing(), "referenced")):
+            data_processor = ComputeData()
+            data_processor.referencing = referencing
+            errors = []
+            start = time.perf_counter()
+            for block in measured:
+                if referencing is None:
+                    block = CameraBlock(block.chopper[0::2], block.pixels[0::2])
+                _, delta_A = data_processor.compute_spectra(block)
+                errors.append(np.sqrt(np.nanmean((delta_A - expected) ** 2)))
+            seconds = (time.perf_counter() - start) / blocks
+            print(f"  {label:<12} rms dA error per block {np.mean(errors):.5f}, {seconds * 1000:.3f} ms per block")
+
+def bench_four_state(shots=5000, repeats=5):
+    """Scatter bias of two-state decoding versus the four-state correction, with pump scatter in every pump-on shot."""
+    dark = np.full(sensor_pixel_windows[4].width, 400.0)
+    for pattern, decoding in (((32768, 49152), "two-state"), ((0, 16384, 32768, 49152), "four-state")):
+        sample = SimulatedTASample(delay_ps=1.0, chopper_pattern=pattern, scatter_counts=150)
+        dll = SimulatedESLSCDLL(0, 0, 0, 0, sample=sample, seed=0)
+        with CameraSession(dll) as session:
+            block = session.measure(shots)
+        data_processor = ComputeData()
+        data_processor.chopper_decoding = decoding
+        data_processor.dark_noise_correction = dark
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, delta_A = data_processor.compute_spectra(block)
+        seconds = (time.perf_counter() - start) / repeats
+        print(f"{decoding:<12} {data_processor.state_counts}")
+        print(f"  rms dA error {np.sqrt(np.nanmean((delta_A - sample.delta_A()) ** 2)):.5f}, {seconds * 1000:.3f} ms per block")
+
+def bench_fly_scan(points=21, window=(0.0, 100.0), shots=500, sweeps=2, scan_rate_hz=5000, block_shots=250, settle_seconds=0.05):
+    """
+    Fly scan with the simulated stage and camera: scan time versus a step scan with the same shots per point,
+    and the dA error per bin versus that of step-scan blocks at the bin delays.
+    """
+    delays = np.linspace(*window, points)
+    edges = bin_edges(delays)
+    velocity = sweep_velocity(delays, shots, scan_rate_hz)
+    stage = SimulatedDLS()
+    sample = SimulatedTASample(lifetime_ps=30.0, delay_source=stage.delay_at)
+    dll = SimulatedESLSCDLL(0, 0, 0, 0, scan_rate_hz=scan_rate_hz, sample=sample, seed=0)
+    data_processor = ComputeData()
+    errors = []
+    shots_per_bin = []
+
+    def process_bin(delay, block):
+        _, delta_A = data_processor.compute_spectra(block)
+        errors.append(np.sqrt(np.nanmean((delta_A - sample.delta_A(delay)) ** 2)))
+        shots_per_bin.append(len(block))
+
+    stage_socket, gui_socket = socket.socketpair()
+    stage_thread = threading.Thread(target=run_fly_scan, args=(stage, stage_socket, edges[0], edges[-1], velocity, sweeps))
+    with CameraSession(dll) as session:
+        start = time.perf_counter()
+        stage_thread.start()
+        fly_scan = FlyScan(gui_socket, session, block_shots, delays, sweeps, scan_rate_hz)
+        finished = fly_scan.run(process_bin)
+        seconds = time.perf_counter() - start
+        stage_thread.join()
+        stage_socket.close()
+        gui_socket.close()
+
+        # the same sample measured at rest at every delay
+        sample.delay_source = None
+        step_errors = []
+        for delay in delays:
+            sample.delay_ps = delay
+            _, delta_A = data_processor.compute_spectra(session.measure(shots))
+            step_errors.append(np.sqrt(np.nanmean((delta_A - sample.delta_A(delay)) ** 2)))
+
+    # a step scan acquires the same shots per point and settles the stage before every point
+    step_seconds = sweeps * points * (shots / scan_rate_hz + settle_seconds)
+    print(f"{finished} sweeps at {velocity:.1f} ps/s in {seconds:.2f} s, step scan with {settle_seconds * 1000:.0f} ms settling: {step_seconds:.2f} s")
+    print(f"bins: {len(shots_per_bin)}, shots per bin {min(shots_per_bin)} to {max(shots_per_bin)}, dropped blocks: {fly_scan.dropped_blocks}")
+    print(f"rms dA error per bin: mean {np.mean(errors):.5f}, max {np.max(errors):.5f} (dA amplitude {sample.dA_spectrum.max():.3f})")
+    print(f"rms dA error of step-scan blocks: mean {np.mean(step_errors):.5f}, max {np.max(step_errors):.5f}")
+
+def bench_scan_orders(scans=4, shots=1000, shot_rate_hz=1000.0, settle_seconds=0.05, seed=0):
+    """
+    Stage travel and motion time of every stepping order on a typical grid (dense around t0, logarithmic
+    after), and how strongly the measurement time within a scan follows the delay: the mean |correlation|
+    of delay rank and time, 1 when a slow drift maps onto the delay axis, about 0 when it is spread out.
+    """
+    delays = np.concatenate((np.linspace(-5, 5, 21), np.geomspace(6, 1000, 30)))
+    rank = np.arange(len(delays))
+    acquisition_seconds = scans * len(delays) * shots / shot_rate_hz
+    print(f"{len(delays)} delays, {scans} scans, {acquisition_seconds:.0f} s of shots")
+    for order in ORDERS:
+        plan = plan_scans(delays, order, scans, start=0.0, rng=np.random.default_rng(seed))
+        correlations = [abs(np.corrcoef(rank, np.argsort(np.searchsorted(delays, scan_delays)))[0, 1]) for scan_delays in plan]
+        print(f"{order:<22} travel {plan_travel(plan, 0.0):8.0f} ps, motion {motion_time(plan, 0.0, settle_seconds=settle_seconds):6.1f} s, "
+              f"delay-time correlation {np.mean(correlations):.2f}")
+
+benchmarks = {
+    "session": bench_session,
+    "transfer": bench_transfer,
+    "pipeline": bench_pipeline,
+    "continuous": bench_continuous,
+    "crop": bench_crop,
+    "sample": bench_sample,
+    "kernel": bench_kernel,
+    "periodic": bench_periodic,
+    "pairing": bench_pairing,
+    "log_table": bench_log_table,
+    "pool": bench_pool,
+    "rejection": bench_rejection,
+    "referencing": bench_referencing,
+    "four_state": bench_four_state,
+    "fly_scan": bench_fly_scan,
+    "scan_orders": bench_scan_orders,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        print("Available benchmarks: " + ", ".join(benchmarks))
+    for name in sys.argv[1:]:
+        if name not in benchmarks:
+            sys.stderr.write(f"Unknown benchmark: {name}\n")
+            continue
+        print(f"--- {name} ---")
+        benchmarks[name]()
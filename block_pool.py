@@ -0,0 +1,220 @@
+"""
+Parallel processing of large camera blocks in a persistent process pool.
+
+The cropped pixels and chopper words of a block are copied once into shared memory. Every worker
+attaches to the shared memory, processes a range of shots with its own ComputeData and returns only
+the RunningStats states of its chunk, which are merged in the calling process.
+
+Shot rejection is decided for the whole block before it is split: the calling process reduces every
+shot to the mean of its rejection ROI and runs compute_spectra on these means, which gives the
+rejection references (centre and scale), rejected percentages and threshold sweeps of the whole block.
+The workers reject against the same references, so they keep the shots a single process would keep.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import numpy as np
+from camera import CameraBlock
+from running_stats import RunningStats
+
+# ComputeData attributes that are sent to the workers with every block
+SETTINGS = (
+    "outlier_rejection_dA", "outlier_rejection_probe",
+    "deviation_threshold_dA", "deviation_threshold_probe",
+    "range_start_dA", "range_start_probe", "range_end_dA", "range_end_probe",
+    "rejection_mode", "robust_threshold_dA", "robust_threshold_probe", "sigma_clip_iterations",
+    "chopper_decoding",
+    "dark_noise_correction", "probe_toggle", "reference_mode",
+    "use_periodic_split", "use_log_table", "chunk_rows",
+)
+
+# fewer worker processes do not make up for copying the block into shared memory
+MIN_WORKERS = 4
+
+def useful_workers():
+    """
+    Number of worker processes for a pool on this machine, 0 when processing in place is faster.
+    No crossover was measured yet (benchmarks.py pool), so MeasurementWorker.use_process_pool is off by default.
+    """
+    cpus = os.cpu_count() or 1
+    return cpus if cpus >= MIN_WORKERS else 0
+
+def shot_means(pixels, start, end, dark):
+    """(shots, 1) float64 mean of every shot over pixels start:end, and the mean of dark (or None) over them."""
+    if start == end:
+        return np.zeros((len(pixels), 1)), None if dark is None else np.zeros(1)
+    means = pixels[:, start:end].mean(axis=1, dtype=np.float64)[:, None]
+    if dark is None:
+        return means, None
+    dark = np.broadcast_to(np.asarray(dark, dtype=np.float64), (pixels.shape[1],))
+    return means, np.array([dark[start:end].mean()])
+
+# Per worker process: the ComputeData and the attached shared memory blocks
+_data_processor = None
+_attached = {}
+
+def _initialize_worker():
+    global _data_processor
+    from Plot_Calculations import ComputeData
+    _data_processor = ComputeData()
+
+def _attach(name):
+    if name not in _attached:
+        # only the newest buffer is used, older ones were replaced by the pool
+        for old in _attached.values():
+            old.close()
+        _attached.clear()
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return _attached[name]
+
+def process_chunk(name, scans, width, first, last, settings):
+    """
+    Worker function: process shots first:last of the block in shared memory name.
+    Returns the states of the probe, pump-off, pump-on and dA RunningStats and the shots per chopper state.
+    """
+    memory = _attach(name)
+    pixels = np.ndarray((scans, width), dtype=np.uint16, buffer=memory.buf)
+    chopper = np.ndarray((scans,), dtype=np.uint16, buffer=memory.buf, offset=pixels.nbytes)
+    for setting, value in settings.items():
+        setattr(_data_processor, setting, value)
+    _data_processor.collect_statistics = True
+    _data_processor.compute_spectra(CameraBlock(chopper[first:last], pixels[first:last]))
+    statistics = (_data_processor.probe_stats, _data_processor.pump_off_stats, _data_processor.pump_on_stats, _data_processor.delta_A_stats)
+    return [stats.state() for stats in statistics], _data_processor.state_counts
+
+
+class BlockProcessingPool():
+    """
+    Persistent pool of worker processes that run compute_spectra on shot chunks of large blocks.
+
+    Assign it to ComputeData.process_pool; compute_spectra then hands every block with at least
+    ComputeData.parallel_min_scans scans to process(). Chunks start at even shots (every fourth shot
+    for four-state decoding), so pump-off/pump-on pairs of an alternating chopper stay together.
+    Shot rejection uses the references of the whole block; "pixel_clip" rejection is not run in the pool.
+    The four-state backgrounds and the "block" pump-off reference are averaged over the whole block in
+    the calling process as well and sent to the workers with the settings.
+    Create a pool only when useful_workers() is not 0. Call close() when done to stop the workers and free the shared memory.
+    """
+
+    def __init__(self, workers=None, chunks_per_worker=2):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunks_per_worker = chunks_per_worker
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_initialize_worker)
+        self.memory = None
+        # ComputeData that decides the shot rejection of whole blocks on their ROI means
+        self.rejection_processor = None
+
+    def _shared_block(self, block):
+        """Copy the pixels and chopper words of block into the shared memory, growing it when needed."""
+        scans, width = block.pixels.shape
+        size = scans * (width + 1) * 2
+        if self.memory is None or self.memory.size < size:
+            self._free_memory()
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        pixels = np.ndarray((scans, width), dtype=np.uint16, buffer=self.memory.buf)
+        chopper = np.ndarray((scans,), dtype=np.uint16, buffer=self.memory.buf, offset=pixels.nbytes)
+        np.copyto(pixels, block.pixels)
+        np.copyto(chopper, block.chopper)
+        return scans, width
+
+    def process(self, block, data_processor):
+        """
+        Process block with the settings of data_processor. Sets the merged statistics, spectra and
+        rejection percentages on data_processor and returns (probe spectrum, dA spectrum).
+        """
+        scans, width = self._shared_block(block)
+        settings = {setting: getattr(data_processor, setting) for setting in SETTINGS}
+        rejection = self.reject_whole_block(block, data_processor)
+        settings["rejection_references"] = None if rejection is None else rejection.used_rejection_references
+        settings["four_state_backgrounds"], settings["block_reference"] = self.whole_block_averages(block, data_processor)
+        # chunks start at a multiple of the chopper period
+        period = 4 if data_processor.chopper_decoding == "four-state" else 2
+        chunks = min(self.workers * self.chunks_per_worker, max(scans // period, 1))
+        bounds = np.linspace(0, scans // period, chunks + 1).astype(int) * period
+        bounds[-1] = scans
+        futures = [self.executor.submit(process_chunk, self.memory.name, scans, width, first, last, settings)
+                   for first, last in zip(bounds[:-1], bounds[1:])]
+
+        statistics = [RunningStats(ignore_nan=False) for _ in range(4)]
+        state_counts = {}
+        for future in futures:
+            states, chunk_state_counts = future.result()
+            for state, count in chunk_state_counts.items():
+                state_counts[state] = state_counts.get(state, 0) + count
+            for total, state in zip(statistics, states):
+                if state["count"] is not None:
+                    total.merge(RunningStats.from_state(state, ignore_nan=False))
+
+        data_processor.probe_stats, data_processor.pump_off_stats, data_processor.pump_on_stats, data_processor.delta_A_stats = statistics
+        # the rejection of the whole block, as decided before the split
+        data_processor.rejected_probe = 0 if rejection is None else rejection.rejected_probe
+        data_processor.rejected_dA = 0 if rejection is None else rejection.rejected_dA
+        data_processor.probe_sweep = None if rejection is None else rejection.probe_sweep
+        data_processor.dA_sweep = None if rejection is None else rejection.dA_sweep
+        data_processor.used_rejection_references = {} if rejection is None else dict(rejection.used_rejection_references)
+        data_processor.state_counts = state_counts
+        data_processor.probe_spectrum = statistics[0].mean if len(statistics[0]) else np.zeros(width)
+        delta_A = statistics[3].mean if len(statistics[3]) else np.zeros(width)
+        # a ratio of 0 or a pump-off intensity of 0 leaves no valid dA for the pixel
+        delta_A[np.isinf(delta_A)] = np.nan
+        data_processor.delta_A = delta_A
+        return data_processor.probe_spectrum, data_processor.delta_A
+
+    def whole_block_averages(self, block, data_processor):
+        """
+        The four-state (dark, pump-only) backgrounds and the "block" pump-off reference of the whole block,
+        None where the settings of data_processor do not use them.
+        """
+        backgrounds = reference = None
+        if data_processor.chopper_decoding == "four-state":
+            states = block.chopper >> 14
+            backgrounds = data_processor.background_means(block.pixels[states == 0], block.pixels[states == 1])
+        if data_processor.reference_mode == "block":
+            reference = data_processor.whole_block_reference(block.pixels, block.chopper, backgrounds)
+        return backgrounds, reference
+
+    def reject_whole_block(self, block, data_processor):
+        """
+        Run compute_spectra with the settings of data_processor on a block of the ROI means of every shot
+        (probe ROI and dA ROI as two columns). Returns the ComputeData with the rejection references,
+        rejected percentages and threshold sweeps of the whole block, or None when no shots are rejected.
+        """
+        if not (data_processor.outlier_rejection_probe or data_processor.outlier_rejection_dA):
+            return None
+        from Plot_Calculations import ComputeData
+        if self.rejection_processor is None:
+            self.rejection_processor = ComputeData()
+        processor = self.rejection_processor
+        for setting in SETTINGS:
+            setattr(processor, setting, getattr(data_processor, setting))
+        processor.collect_statistics = False
+        processor.rejection_references = None
+        processor.used_rejection_references = {}
+        dark = data_processor.dark_noise_correction
+        probe_means, probe_dark = shot_means(block.pixels, data_processor.range_start_probe, data_processor.range_end_probe, dark)
+        dA_means, dA_dark = shot_means(block.pixels, data_processor.range_start_dA, data_processor.range_end_dA, dark)
+        # the row mean of a one-pixel ROI is the shot mean, the mean of the ROI the block mean
+        processor.range_start_probe, processor.range_end_probe = (0, 0) if data_processor.range_start_probe == data_processor.range_end_probe else (0, 1)
+        processor.range_start_dA, processor.range_end_dA = (1, 1) if data_processor.range_start_dA == data_processor.range_end_dA else (1, 2)
+        processor.dark_noise_correction = None if dark is None else np.concatenate((probe_dark, dA_dark))
+        processor.compute_spectra(CameraBlock(block.chopper, np.hstack((probe_means, dA_means))))
+        return processor
+
+    def _free_memory(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def close(self):
+        """Stop the worker processes and free the shared memory."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self._free_memory()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
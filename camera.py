@@ -5,74 +5,185 @@
 from ctypes import *
 # matplotlib is used for the data plot
 import csv
+import os
+import queue
+import threading
+import time
+import numpy as np
+from timing import Timings
 from error_popup import *
 
-def	camera(number_of_shots, delay_number):
+# These are the settings structs. It must be the same like in EBST_CAM/shared_src/struct.h regarding order, data formats and size.
+class camera_settings(Structure):
+	_fields_ = [("use_software_polling", c_uint32),
+		("sti_mode", c_uint32),
+		("bti_mode", c_uint32),
+		("stime_in_microsec", c_uint32),
+		("btime_in_microsec", c_uint32),
+		("sdat_in_10ns", c_uint32),
+		("bdat_in_10ns", c_uint32),
+		("sslope", c_uint32),
+		("bslope", c_uint32),
+		("xckdelay_in_10ns", c_uint32),
+		("sec_in_10ns", c_uint32),
+		("trigger_mode_integrator", c_uint32),
+		("SENSOR_TYPE", c_uint32),
+		("CAMERA_SYSTEM", c_uint32),
+		("CAMCNT", c_uint32),
+		("PIXEL", c_uint32),
+		("is_fft_legacy", c_uint32),
+		("led_off", c_uint32),
+		("sensor_gain", c_uint32),
+		("adc_gain", c_uint32),
+		("temp_level", c_uint32),
+		("bticnt", c_uint32),
+		("gpx_offset", c_uint32),
+		("FFT_LINES", c_uint32),
+		("VFREQ", c_uint32),
+		("fft_mode", c_uint32),
+		("lines_binning", c_uint32),
+		("number_of_regions", c_uint32),
+		("s1s2_read_delay_in_10ns", c_uint32),
+		("region_size", c_uint32 * 8),
+		("dac_output", c_uint32 * 8 * 8), # 8 channels for 8 possible cameras in line
+		("tor", c_uint32),
+		("adc_mode", c_uint32),
+		("adc_custom_pattern", c_uint32),
+		("bec_in_10ns", c_uint32),
+		("IS_HS_IR", c_uint32),
+		("ioctrl_impact_start_pixel", c_uint32),
+		("ioctrl_output_width_in_5ns", c_uint32 * 8),
+		("ioctrl_output_delay_in_5ns", c_uint32 * 8),
+		("ictrl_T0_period_in_10ns", c_uint32),
+		("dma_buffer_size_in_scans", c_uint32),
+		("tocnt", c_uint32),
+		("sticnt", c_uint32),
+		("sensor_reset_length", c_uint32),
+		("write_to_disc", c_uint32),
+		("file_path", c_char * 256),
+		("file_split_mode", c_uint32),
+		("is_cooled_camera_legacy_mode", c_uint32),
+		("bnc_out", c_uint32)]
+
+class measurement_settings(Structure):
+	_fields_ = [("board_sel", c_uint32),
+	("nos", c_uint32),
+	("nob", c_uint32),
+	("contiuous_measurement", c_uint32),
+	("cont_pause_in_microseconds", c_uint32),
+	("camera_settings", camera_settings * 5)]
+
+# Always use board 0. There is only one PCIe board in this example script.
+drvno = 0
+# Region sizes used for the FFT partial binning readout
+default_region_size = (10, 50, 10, 50, 8)
+
+
+class CameraBlock():
+	"""
+	One acquired block, split into the chopper state word and the active pixel window of every shot.
+
+	chopper: (shots,) uint16 chopper word (0, 16384, 32768 or 49152)
+	pixels:  (shots, width) uint16 counts of the active pixels
+	raw:     (shots, pixel) uint16 view of the uncropped scans in the camera buffer, valid as long as the buffer is not reused
+	Blocks from the camera hold views of raw in chopper and pixels; copy() makes compact arrays.
+	number_of_blocks: number of DMA blocks (settings.nob) that are concatenated in this block
+	reference: (shots, width) counts of the reference channel of every shot, or None (see referencing.py)
+	end_time: perf_counter() time at which the last scan of the block was seen, set by ContinuousAcquisition
+	"""
+
+	def __init__(self, chopper, pixels, raw=None, number_of_blocks=1, reference=None):
+		self.chopper = chopper
+		self.pixels = pixels
+		self.raw = raw
+		self.number_of_blocks = number_of_blocks
+		self.reference = reference
+		self.end_time = None
+
+	def __len__(self):
+		return len(self.chopper)
+
+	def copy(self, raw=True):
+		"""A CameraBlock with its own arrays, which stays valid when the camera buffer is reused. raw=False leaves out the uncropped scans."""
+		block = CameraBlock(self.chopper.copy(), self.pixels.copy(),
+			None if self.raw is None or not raw else self.raw.copy(),
+			self.number_of_blocks,
+			None if self.reference is None else self.reference.copy())
+		block.end_time = self.end_time
+		return block
+
+	def sub_blocks(self):
+		"""Split into one CameraBlock view per DMA block."""
+		if self.number_of_blocks == 1:
+			return [self]
+		scans = len(self) // self.number_of_blocks
+		sub_blocks = []
+		for i in range(self.number_of_blocks):
+			rows = slice(i * scans, (i + 1) * scans)
+			raw = None if self.raw is None else self.raw[rows]
+			reference = None if self.reference is None else self.reference[rows]
+			sub_blocks.append(CameraBlock(self.chopper[rows], self.pixels[rows], raw, reference=reference))
+		return sub_blocks
+
+
+class PixelWindow():
+	"""
+	Position of the chopper word and the active pixels in a raw camera scan.
+	"""
+
+	def __init__(self, start_pixel=12, end_pixel=1035, chopper_pixel=2):
+		self.start_pixel = start_pixel
+		self.end_pixel = end_pixel
+		self.chopper_pixel = chopper_pixel
+
+	@property
+	def width(self):
+		return self.end_pixel - self.start_pixel
+
+	def crop(self, raw, block=None):
+		"""
+		Split a (scans, pixel) raw block into the chopper word and the active pixels, updating block if given.
+		Both are views of raw, nothing is copied: the kernel reads the active pixels straight from the buffer.
+		"""
+		raw = np.asarray(raw)
+		if block is None:
+			block = CameraBlock(None, None)
+		block.chopper = raw[:, self.chopper_pixel]
+		block.pixels = raw[:, self.start_pixel:self.end_pixel]
+		block.raw = raw
+		return block
+
+# Pixel window per sensor type (camera_settings.SENSOR_TYPE)
+sensor_pixel_windows = {
+	4: PixelWindow(start_pixel=12, end_pixel=1035, chopper_pixel=2),
+}
+
+# Chopper word in the chopper pixel: probe chopper/pump chopper state
+chopper_states = {0: "OFF/OFF", 16384: "OFF/ON", 32768: "ON/OFF", 49152: "ON/ON"}
 
-	use_blocking_call = True
-
-	# These are the settings structs. It must be the same like in EBST_CAM/shared_src/struct.h regarding order, data formats and size.
-	class camera_settings(Structure):
-		_fields_ = [("use_software_polling", c_uint32),
-			("sti_mode", c_uint32),
-			("bti_mode", c_uint32),
-			("stime_in_microsec", c_uint32),
-			("btime_in_microsec", c_uint32),
-			("sdat_in_10ns", c_uint32),
-			("bdat_in_10ns", c_uint32),
-			("sslope", c_uint32),
-			("bslope", c_uint32),
-			("xckdelay_in_10ns", c_uint32),
-			("sec_in_10ns", c_uint32),
-			("trigger_mode_integrator", c_uint32),
-			("SENSOR_TYPE", c_uint32),
-			("CAMERA_SYSTEM", c_uint32),
-			("CAMCNT", c_uint32),
-			("PIXEL", c_uint32),
-			("is_fft_legacy", c_uint32),
-			("led_off", c_uint32),
-			("sensor_gain", c_uint32),
-			("adc_gain", c_uint32),
-			("temp_level", c_uint32),
-			("bticnt", c_uint32),
-			("gpx_offset", c_uint32),
-			("FFT_LINES", c_uint32),
-			("VFREQ", c_uint32),
-			("fft_mode", c_uint32),
-			("lines_binning", c_uint32),
-			("number_of_regions", c_uint32),
-			("s1s2_read_delay_in_10ns", c_uint32),
-			("region_size", c_uint32 * 8),
-			("dac_output", c_uint32 * 8 * 8), # 8 channels for 8 possible cameras in line
-			("tor", c_uint32),
-			("adc_mode", c_uint32),
-			("adc_custom_pattern", c_uint32),
-			("bec_in_10ns", c_uint32),
-			("IS_HS_IR", c_uint32),
-			("ioctrl_impact_start_pixel", c_uint32),
-			("ioctrl_output_width_in_5ns", c_uint32 * 8),
-			("ioctrl_output_delay_in_5ns", c_uint32 * 8),
-			("ictrl_T0_period_in_10ns", c_uint32),
-			("dma_buffer_size_in_scans", c_uint32),
-			("tocnt", c_uint32),
-			("sticnt", c_uint32),
-			("sensor_reset_length", c_uint32),
-			("write_to_disc", c_uint32),
-			("file_path", c_char * 256),
-			("file_split_mode", c_uint32),
-			("is_cooled_camera_legacy_mode", c_uint32),
-			("bnc_out", c_uint32)]
-
-	class measurement_settings(Structure):
-		_fields_ = [("board_sel", c_uint32),
-		("nos", c_uint32),
-		("nob", c_uint32),
-		("contiuous_measurement", c_uint32),
-		("cont_pause_in_microseconds", c_uint32),
-		("camera_settings", camera_settings * 5)]
-
-	# Always use board 0. There is only one PCIe board in this example script.
-	drvno = 0
+def load_camera_dll(backend=None):
+	"""
+	Load the camera backend that CameraSession talks to.
+	backend is "hardware" for ESLSCDLL.dll or "simulated" for the stand-in from simulated_camera.py,
+	which offers the same DLL functions. By default it is read from the TA_CAMERA_BACKEND environment variable.
+	"""
+	backend = os.environ.get("TA_CAMERA_BACKEND", "hardware") if backend is None else backend
+	if backend == "simulated":
+		from simulated_camera import SimulatedESLSCDLL, SimulatedTASample
+		return SimulatedESLSCDLL(scan_rate_hz=1000, sample=SimulatedTASample())
+	if backend != "hardware":
+		raise ValueError(f"Unknown camera backend: {backend}")
+
+	dll = WinDLL("./ESLSCDLL")
+	# Set the return type of DLLConvertErrorCodeToMsg to c-string pointer
+	dll.DLLConvertErrorCodeToMsg.restype = c_char_p
+	return dll
+
+def create_measurement_settings(number_of_shots, region_size=default_region_size, continuous=False, cont_pause_in_microseconds=0):
+	"""
+	Build the measurement_settings struct for one block of number_of_shots shots.
+	With continuous=True the board restarts the measurement by itself after cont_pause_in_microseconds.
+	"""
 	# Create an instance of the settings struct
 	settings = measurement_settings()
 	# Set all settings that are needed for the measurement. See EBST_CAM/shared_src/struct.h for details.
@@ -80,6 +191,8 @@ def	camera(number_of_shots, delay_number):
 	settings.board_sel = 1
 	settings.nos = number_of_shots * 2
 	settings.nob = 2
+	settings.contiuous_measurement = 1 if continuous else 0
+	settings.cont_pause_in_microseconds = cont_pause_in_microseconds
 	settings.camera_settings[drvno].sti_mode = 1
 	settings.camera_settings[drvno].bti_mode = 4
 	settings.camera_settings[drvno].SENSOR_TYPE = 4
@@ -92,134 +205,394 @@ def	camera(number_of_shots, delay_number):
 	settings.camera_settings[drvno].fft_mode = 1
 	settings.camera_settings[drvno].FFT_LINES = 128
 	settings.camera_settings[drvno].lines_binning = 1
-	settings.camera_settings[drvno].number_of_regions = 5
-	settings.camera_settings[drvno].region_size[0] = 10
-	settings.camera_settings[drvno].region_size[1] = 50
-	settings.camera_settings[drvno].region_size[2] = 10
-	settings.camera_settings[drvno].region_size[3] = 50
-	settings.camera_settings[drvno].region_size[4] = 8
+	settings.camera_settings[drvno].number_of_regions = len(region_size)
+	for i, size in enumerate(region_size):
+		settings.camera_settings[drvno].region_size[i] = size
 	settings.camera_settings[drvno].use_software_polling = 0
 	settings.camera_settings[drvno].VFREQ = 7
-	settings.camera_settings[drvno].dac_output[0][0] = 55000
-	settings.camera_settings[drvno].dac_output[0][1] = 55000
-	settings.camera_settings[drvno].dac_output[0][2] = 55000
-	settings.camera_settings[drvno].dac_output[0][3] = 55000
-	settings.camera_settings[drvno].dac_output[0][4] = 55000
-	settings.camera_settings[drvno].dac_output[0][5] = 55000
-	settings.camera_settings[drvno].dac_output[0][6] = 55000
-	settings.camera_settings[drvno].dac_output[0][7] = 55000
-
-	# Load ESLSCDLL.dll
-	"""Maybe make this a global variable in Main_window.py?"""
-	dll = WinDLL("./ESLSCDLL") 
-	# Set the return type of DLLConvertErrorCodeToMsg to c-string pointer
-	dll.DLLConvertErrorCodeToMsg.restype = c_char_p
+	for i in range(8):
+		settings.camera_settings[drvno].dac_output[0][i] = 55000
+	return settings
+
+
+class CameraSession():
+	"""
+	Long-lived connection to the camera board.
+
+	The driver and board are initialized once in open(). The measurement settings are
+	only sent to the board again when the number of shots or the region sizes change,
+	so repeated calls to measure() skip the driver init/exit overhead of camera().
+	"""
 
-	# Create a variable of type uint8_t
-	number_of_boards = c_uint8(0)
-	# Get the pointer the variable
-	ptr_number_of_boards = pointer(number_of_boards)
-	# Initialize the driver and pass the created pointer to it. number_of_boards should show the number of detected PCIe boards after the next call.
-	status = dll.DLLInitDriver(ptr_number_of_boards)
-	# Check the status code after each DLL call. When it is not 0, which means there is no error, an exception is raised. The error message will be displayed and the script will stop.
-	if(status != 0):
-		show_error_message(dll.DLLConvertErrorCodeToMsg(status))
-		raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-	# Initialize the PCIe board.
-	status = dll.DLLInitBoard()
-	if(status != 0):
-		show_error_message(dll.DLLConvertErrorCodeToMsg(status))
-		raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-	# Set all settings with the earlier created settings struct
-	status = dll.DLLSetGlobalSettings(settings)
-	if(status != 0):
-		show_error_message(dll.DLLConvertErrorCodeToMsg(status))
-		raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-	# Initialize the measurement. The settings from the step before will be used for this.
-	status = dll.DLLInitMeasurement()
-	if(status != 0):
-		show_error_message(dll.DLLConvertErrorCodeToMsg(status))
-		raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-
-	if use_blocking_call:
-		# Start the measurement. This is the blocking call, which means it will return when the measurement is finished. This is done to ensure that no data access happens before all data is collected.
-		status = dll.DLLStartMeasurement_blocking()
+	def __init__(self, dll=None, pixel_window=None, timings=None):
+		# Load ESLSCDLL.dll, unless another backend (e.g. the simulated DLL) is passed in
+		self.dll = load_camera_dll() if dll is None else dll
+		# Timings of the driver calls, usually those of the thread that owns the session
+		self.timings = Timings() if timings is None else timings
+		# None: use the pixel window of the configured sensor type
+		self.pixel_window = pixel_window
+		self.settings = None
+		self.configuration = None
+		self.number_of_shots = None
+		self.region_size = None
+		self.block_buffers = []
+		self.blocks = []
+		self.buffer_index = 0
+		self.is_open = False
+		self.use_blocking_call = True
+		# copy all blocks of a measurement (settings.nob) instead of only the second one
+		self.use_all_blocks = True
+		self.measurement_running = False
+		# seconds between two DLLGetCurrentScanNumber calls while waiting for a measurement
+		self.poll_interval = 0.0005
+
+	def check_status(self, status):
+		"""
+		Check the status code after each DLL call. When it is not 0, which means there is no error, an exception is raised.
+		"""
 		if(status != 0):
-			raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-	else:
-		# Start the measurement. This is the nonblocking call, which means it will return immediately. 
-		dll.DLLStartMeasurement_nonblocking()
+			show_error_message(self.dll.DLLConvertErrorCodeToMsg(status))
+			raise BaseException(self.dll.DLLConvertErrorCodeToMsg(status))
+
+	def open(self):
+		"""
+		Initialize the driver and the PCIe board. Does nothing when the session is already open.
+		"""
+		if self.is_open:
+			return
+		# Create a variable of type uint8_t
+		number_of_boards = c_uint8(0)
+		with self.timings.span("driver init"):
+			# Initialize the driver and pass the pointer to it. number_of_boards should show the number of detected PCIe boards after the next call.
+			self.check_status(self.dll.DLLInitDriver(pointer(number_of_boards)))
+			# Initialize the PCIe board.
+			self.check_status(self.dll.DLLInitBoard())
+		self.is_open = True
+
+	def configure(self, number_of_shots, region_size=default_region_size, continuous=False, cont_pause_in_microseconds=0):
+		"""
+		Apply the measurement settings, but only when shots, regions or the continuous mode differ from the active ones.
+		"""
+		self.open()
+		configuration = (number_of_shots, tuple(region_size), bool(continuous), cont_pause_in_microseconds)
+		if self.settings is not None and configuration == self.configuration:
+			return
+		settings = create_measurement_settings(number_of_shots, region_size, continuous, cont_pause_in_microseconds)
+		with self.timings.span("configure"):
+			# Set all settings with the created settings struct
+			self.check_status(self.dll.DLLSetGlobalSettings(settings))
+			# Initialize the measurement. The settings from the step before will be used for this.
+			self.check_status(self.dll.DLLInitMeasurement())
+		self.settings = settings
+		self.configuration = configuration
+		self.number_of_shots = number_of_shots
+		self.region_size = tuple(region_size)
+
+		if self.pixel_window is None:
+			self.pixel_window = sensor_pixel_windows[settings.camera_settings[drvno].SENSOR_TYPE]
 
+		# Preallocate two buffers that DLLCopyOneBlock writes into. The buffers are reused for every block.
+		# Copies alternate between the two buffers, so the previous block stays valid while the next one is read.
+		self.block_buffers = []
+		self.blocks = []
+		for _ in range(2):
+			block_buffer, block = self.allocate_buffer()
+			self.block_buffers.append(block_buffer)
+			self.blocks.append(block)
+		self.buffer_index = 0
+
+	def allocate_buffer(self):
+		"""
+		Create a c-style uint16 array of the block size and a CameraBlock on it.
+		The raw, chopper and pixels attributes of the block are NumPy views on the same memory as the c-style array.
+		"""
+		settings = self.settings
+		pixel = settings.camera_settings[drvno].PIXEL
+		number_of_blocks = settings.nob if self.use_all_blocks else 1
+		scans = settings.nos * number_of_blocks
+		block_buffer = (c_uint16 * (pixel * scans * settings.camera_settings[drvno].CAMCNT))(0)
+		block = self.pixel_window.crop(np.ctypeslib.as_array(block_buffer).reshape(-1, pixel))
+		block.number_of_blocks = number_of_blocks
+		return block_buffer, block
+
+	def start(self):
+		"""
+		Start the measurement with the nonblocking call, which means it will return immediately.
+		"""
+		self.check_status(self.dll.DLLStartMeasurement_nonblocking())
+		self.measurement_running = True
+
+	def wait(self):
+		"""
+		Poll the scan counter until the last scan of the last block has been written to the DMA buffer.
+		"""
+		settings = self.settings
 		cur_sample = c_int64(-2)
 		ptr_cur_sample = pointer(cur_sample)
 		cur_block = c_int64(-2)
 		ptr_cur_block = pointer(cur_block)
 
-		while cur_sample.value < settings.nos-1 or cur_block.value < settings.nob-1:
-			dll.DLLGetCurrentScanNumber(drvno, ptr_cur_sample, ptr_cur_block)
-			print("sample: "+str(cur_sample.value)+" block: "+str(cur_block.value))
-
-	# Create an c-style uint16 array of size pixel which is initialized to 0
-	#frame_buffer = (c_uint16 * settings.camera_settings[0].PIXEL)(0)
-	#ptr_frame_buffer = pointer(frame_buffer)
-	# Get the data of one frame. Sample 1, block 2, camera 0
-	#status = dll.DLLReturnFrame(drvno, 5, 0, 0, settings.camera_settings[0].PIXEL, ptr_frame_buffer)
-	#if(status != 0):
-	#	raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-	# Convert the c-style array to a python list
-	#list_frame_buffer = [frame_buffer[i] for i in range(settings.camera_settings[0].PIXEL)]
-	# Plot the frame
-	#plt.plot(list_frame_buffer)
-	#plt.show()
-
-	# This block is showing you how to get all data of one frame with one DLL call
-	block_buffer = (c_uint16 * (settings.camera_settings[drvno].PIXEL * settings.nos * settings.camera_settings[drvno].CAMCNT))(0)
-	ptr_block_buffer = pointer(block_buffer)
-	status = dll.DLLCopyOneBlock(drvno, 1, ptr_block_buffer)
-	if(status != 0):
-		show_error_message(dll.DLLConvertErrorCodeToMsg(status))
-		raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-	
-	# with open(f"camera_output{delay_number}.csv", mode="w", newline="") as file:
-	# 	writer = csv.writer(file)
-
-	# 	# Write header
-	# 	header = [f"pixel_{i}" for i in range(settings.camera_settings[drvno].PIXEL)]
-	# 	writer.writerow(header)
-
-	# 	# Write scan rows
-	# 	for scan_idx in range(settings.nos):
-	# 		start = scan_idx * settings.camera_settings[drvno].PIXEL
-	# 		scan_row = block_buffer[start:start + settings.camera_settings[drvno].PIXEL]
-	# 		if (scan_row[2] == 0):
-	# 			scan_row[2] = "OFF/OFF"
-	# 		elif (scan_row[2] == 16384):
-	# 			scan_row[2] = "OFF/ON"
-	# 		elif (scan_row[2] == 32768):
-	# 			scan_row[2] = "ON/OFF"
-	# 		elif (scan_row[2] == 49152):
-	# 			scan_row[2] = "ON/ON"
-	# 		else:
-	# 			print("Unexpected value")
-	# 		writer.writerow(scan_row)
-
-	# print(f"Data exported to camera_output{delay_number}.csv")
-
-	# This block is showing you how to get all data of the whole measurement with one DLL call
-	# data_buffer = (c_uint16 * (settings.PIXEL * settings.nos * settings.CAMCNT * settings.nob))(0)
-	# ptr_data_buffer = pointer(data_buffer)
-	# status = dll.DLLCopyAllData(drvno, ptr_data_buffer)
-	# if(status != 0):
-	# 	raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-
-	# Exit the driver
-	status = dll.DLLExitDriver()
-	if(status != 0):
-		show_error_message(dll.DLLConvertErrorCodeToMsg(status))
-		raise BaseException(dll.DLLConvertErrorCodeToMsg(status))
-	
-	return block_buffer
+		with self.timings.span("measurement"):
+			while cur_sample.value < settings.nos-1 or cur_block.value < settings.nob-1:
+				self.dll.DLLGetCurrentScanNumber(drvno, ptr_cur_sample, ptr_cur_block)
+				time.sleep(self.poll_interval)
+		self.measurement_running = False
+
+	def abort(self):
+		"""
+		Abort a measurement that was started with start() and has not been waited for.
+		"""
+		if self.measurement_running:
+			self.measurement_running = False
+			self.check_status(self.dll.DLLAbortMeasurement(drvno))
+
+	def read_block(self):
+		"""
+		Copy the finished measurement into the next free buffer and return it as a CameraBlock.
+		"""
+		self.buffer_index = 1 - self.buffer_index
+		return self.copy_block(self.block_buffers[self.buffer_index], self.blocks[self.buffer_index])
+
+	def copy_block(self, block_buffer, block):
+		"""
+		Copy the last measurement into block_buffer, which block holds views of.
+		With use_all_blocks all blocks are copied one after another, otherwise only the second block.
+		"""
+		with self.timings.span("DMA copy"):
+			if block.number_of_blocks > 1:
+				# This is showing you how to get all data of the whole measurement with one DLL call
+				self.check_status(self.dll.DLLCopyAllData(drvno, pointer(block_buffer)))
+			else:
+				# This block is showing you how to get all data of one frame with one DLL call
+				self.check_status(self.dll.DLLCopyOneBlock(drvno, 1, pointer(block_buffer)))
+		# the NumPy views on the buffer are free, the block needs no conversion
+		return block
+
+	def get_scan_position(self):
+		"""
+		Return the number of the last scan written to the DMA buffer, counted over all blocks of the measurement.
+		"""
+		cur_sample = c_int64(-2)
+		cur_block = c_int64(-2)
+		self.dll.DLLGetCurrentScanNumber(drvno, pointer(cur_sample), pointer(cur_block))
+		return cur_block.value * self.settings.nos + cur_sample.value
+
+	def measure(self, number_of_shots, region_size=default_region_size):
+		"""
+		Do one measurement and return its data as a CameraBlock.
+		The block lives in one of the two reused buffers, so it stays valid until the second next measure() call.
+		"""
+		self.configure(number_of_shots, region_size)
+
+		if self.use_blocking_call:
+			# Start the measurement. This is the blocking call, which means it will return when the measurement is finished. This is done to ensure that no data access happens before all data is collected.
+			with self.timings.span("measurement"):
+				self.check_status(self.dll.DLLStartMeasurement_blocking())
+		else:
+			self.start()
+			self.wait()
+
+		block = self.read_block()
+
+		# with open(f"camera_output{delay_number}.csv", mode="w", newline="") as file:
+		# 	writer = csv.writer(file)
+
+		# 	# Write header
+		# 	header = [f"pixel_{i}" for i in range(settings.camera_settings[drvno].PIXEL)]
+		# 	writer.writerow(header)
+
+		# 	# Write scan rows
+		# 	for scan_idx in range(settings.nos):
+		# 		scan_row = list(block.raw[scan_idx])
+		# 		if (scan_row[2] == 0):
+		# 			scan_row[2] = "OFF/OFF"
+		# 		elif (scan_row[2] == 16384):
+		# 			scan_row[2] = "OFF/ON"
+		# 		elif (scan_row[2] == 32768):
+		# 			scan_row[2] = "ON/OFF"
+		# 		elif (scan_row[2] == 49152):
+		# 			scan_row[2] = "ON/ON"
+		# 		else:
+		# 			print("Unexpected value")
+		# 		writer.writerow(scan_row)
+
+		# print(f"Data exported to camera_output{delay_number}.csv")
+
+		return block
+
+	def stream(self, number_of_shots, region_size=default_region_size):
+		"""
+		Generator for pipelined acquisition. Every yielded block is copied out of the DMA buffer
+		before the next measurement is started, so the board acquires block N+1 while the caller
+		processes block N. The yielded CameraBlock is valid until the next block is requested.
+		"""
+		self.configure(number_of_shots, region_size)
+		self.start()
+		try:
+			while True:
+				self.wait()
+				block = self.read_block()
+				self.start()
+				yield block
+		finally:
+			self.abort()
+
+	def close(self):
+		"""
+		Exit the driver. The next measure() call opens the session again.
+		"""
+		if not self.is_open:
+			return
+		self.abort()
+		self.is_open = False
+		self.settings = None
+		self.block_buffers = []
+		self.blocks = []
+		with self.timings.span("driver exit"):
+			self.check_status(self.dll.DLLExitDriver())
+
+	def __enter__(self):
+		self.open()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+class ContinuousAcquisition():
+	"""
+	Free-running acquisition for the live view.
+
+	The board runs in continuous measurement mode and restarts every measurement by itself.
+	A reader thread watches the scan counter, copies every completed block into one of a few
+	preallocated buffers and puts it on a queue. When the consumer falls behind, the oldest
+	waiting block is dropped so the newest data is always shown.
+
+	The board writes the next cycle into the same DMA buffer, so a block can only be copied in the
+	pause between two cycles. A block whose last scan the reader did not see before the next cycle
+	started, or whose copy was not finished before the next cycle wrote its first scan, would mix
+	the scans of two cycles and is dropped instead. cont_pause_in_microseconds must cover a poll
+	interval and the copy of a block; the default of 10 ms also covers the switch interval (5 ms)
+	the reader thread may wait for the interpreter lock while blocks are processed.
+	dropped_blocks counts the blocks that were lost.
+	"""
+
+	def __init__(self, session, number_of_shots, region_size=default_region_size, cont_pause_in_microseconds=10000, buffers=3):
+		self.session = session
+		self.number_of_shots = number_of_shots
+		self.region_size = region_size
+		self.cont_pause_in_microseconds = cont_pause_in_microseconds
+		self.number_of_buffers = buffers
+		self.block_buffers = []
+		self.blocks = []
+		self.free_buffers = queue.Queue()
+		self.filled_buffers = queue.Queue()
+		self.held_buffer = None
+		self.dropped_blocks = 0
+		self.stop_event = threading.Event()
+		self.reader = None
+		self.error = None
+
+	def start(self):
+		"""Configure the board for continuous measurement, start it and start the reader thread."""
+		session = self.session
+		session.configure(self.number_of_shots, self.region_size, True, self.cont_pause_in_microseconds)
+		for index in range(self.number_of_buffers):
+			block_buffer, block = session.allocate_buffer()
+			self.block_buffers.append(block_buffer)
+			self.blocks.append(block)
+			self.free_buffers.put(index)
+		self.stop_event.clear()
+		session.start()
+		self.reader = threading.Thread(target=self._read_blocks, daemon=True)
+		self.reader.start()
+
+	def _next_free_buffer(self):
+		"""Return a free buffer index, reusing the oldest unread block when none is free."""
+		try:
+			return self.free_buffers.get_nowait()
+		except queue.Empty:
+			pass
+		try:
+			index = self.filled_buffers.get_nowait()
+			self.dropped_blocks += 1
+			return index
+		except queue.Empty:
+			return None
+
+	def _copy_completed_block(self, end_time, last_scan):
+		"""Copy the completed block, whose last scan was seen at end_time, unless the next cycle overwrote it meanwhile."""
+		index = self._next_free_buffer()
+		if index is None:
+			self.dropped_blocks += 1
+			return
+		self.blocks[index].end_time = end_time
+		self.session.copy_block(self.block_buffers[index], self.blocks[index])
+		# the counter stays at the last scan during the pause and is negative until the first scan of the next cycle is written
+		position = self.session.get_scan_position()
+		if 0 <= position < last_scan:
+			self.dropped_blocks += 1
+			self.free_buffers.put(index)
+			return
+		self.filled_buffers.put(index)
+
+	def _read_blocks(self):
+		"""Reader thread: copy a block every time the board completes a measurement cycle."""
+		settings = self.session.settings
+		last_scan = settings.nos * settings.nob - 1
+		last_position = -1
+		copied = False
+		try:
+			while not self.stop_event.is_set():
+				position = self.session.get_scan_position()
+				poll_time = time.perf_counter()
+				if position < last_position:
+					# the board started a new cycle, which overwrites the previous one in the same buffer;
+					# if its end was not seen, its first scans are already gone
+					if not copied:
+						self.dropped_blocks += 1
+					copied = False
+				if position == last_scan and not copied:
+					self._copy_completed_block(poll_time, last_scan)
+					copied = True
+				last_position = position
+				time.sleep(self.session.poll_interval)
+		except BaseException as e:
+			self.error = e
+
+	def get(self, timeout=None):
+		"""
+		Return the oldest completed CameraBlock, or None after timeout seconds.
+		The block stays valid until the next get() call.
+		"""
+		if self.held_buffer is not None:
+			self.free_buffers.put(self.held_buffer)
+			self.held_buffer = None
+		if self.error is not None:
+			raise self.error
+		try:
+			self.held_buffer = self.filled_buffers.get(timeout=timeout)
+		except queue.Empty:
+			return None
+		return self.blocks[self.held_buffer]
+
+	def stop(self):
+		"""Stop the reader thread and abort the running measurement."""
+		self.stop_event.set()
+		if self.reader is not None:
+			self.reader.join()
+			self.reader = None
+		self.session.abort()
+
+
+def	camera(number_of_shots, delay_number):
+	"""
+	Do one complete measurement: initialize the driver, measure one block and exit the driver again.
+	Prefer a CameraSession when measuring more than one block.
+	"""
+	with CameraSession() as session:
+		return session.measure(number_of_shots)
 	
 # Run main()
 if __name__ == "__main__":
-    camera()
\ No newline at end of file
+    camera(1000, 0)
@@ -5,18 +5,22 @@ from WorkerThread import *
 import pyqtgraph as pg
 import csv
 from error_popup import *
+from threshold_preview import ThresholdPreview
 
 
 class dAwindow(QWidget):
     run_command_signal = Signal(str, str, int, int)
     dA_switch_outlier_rejection = Signal(bool)
     dA_deviation_threshold_changed = Signal(float)
+    dA_robust_threshold_changed = Signal(float)
     pos_change_signal = Signal(float)
 
     def __init__(self):
         super().__init__()
         self.t_0 = 0
         self.setWindowTitle("Camera Interface")
+        # rejection mode selected in the probe window, it decides which threshold spinbox is shown
+        self.rejection_mode = "percentage"
 
         self.setupUi(self)
         for child in self.findChildren(QWidget):
@@ -86,6 +90,14 @@ class dAwindow(QWidget):
         self.deviation_spinbox.setSingleStep(0.01)
         self.deviation_spinbox.setValue(100)
         outlier_layout.addWidget(self.deviation_spinbox, 1, 2)
+        # threshold of the robust rejection modes, in standard deviations
+        self.robust_spinbox = QDoubleSpinBox()
+        self.robust_spinbox.valueChanged.connect(self.emit_robust_threshold_change)
+        self.robust_spinbox.setRange(0.5, 50)
+        self.robust_spinbox.setSuffix(" σ")
+        self.robust_spinbox.setSingleStep(0.1)
+        self.robust_spinbox.setValue(5)
+        outlier_layout.addWidget(self.robust_spinbox, 1, 2)
 
         self.rejected_label = QLabel("Rejected shots (%)")
         self.rejected_value = QLineEdit()
@@ -94,6 +106,13 @@ class dAwindow(QWidget):
         outlier_layout.addWidget(self.rejected_label, 2, 0, 1, 2)
         outlier_layout.addWidget(self.rejected_value, 2, 2)
 
+        # preview: histogram of the shot deviations of the last block and the percentage
+        # the active threshold would reject, updated without waiting for the next block
+        self.threshold_preview = ThresholdPreview()
+        self.deviation_spinbox.valueChanged.connect(self.update_rejection_preview)
+        self.robust_spinbox.valueChanged.connect(self.update_rejection_preview)
+        outlier_layout.addWidget(self.threshold_preview, 3, 0, 1, 3)
+
         outlier_group.setLayout(outlier_layout)
         self.left_layout.addWidget(outlier_group)
 
@@ -161,10 +180,10 @@ class dAwindow(QWidget):
 
     def toggle_outlier_rejection(self, selected: bool) -> None:
         self.deviation_label.setVisible(selected)
-        self.deviation_spinbox.setVisible(selected)
 
         self.rejected_label.setVisible(selected)
         self.rejected_value.setVisible(selected)
+        self.threshold_preview.setVisible(selected)
 
         self.range_line_left.setVisible(selected)
         self.range_line_right.setVisible(selected)
@@ -172,18 +191,34 @@ class dAwindow(QWidget):
         if not selected:
             # Ensure the checkbox is unchecked
             self.outlier_checkbox.setChecked(False) 
+        self.show_threshold_spinbox()
 
         self.dA_switch_outlier_rejection.emit(selected)
 
         if selected:
              # If outlier rejection is enabled, set previous settings
             self.emit_deviation_change(self.deviation_spinbox.value())
+            self.emit_robust_threshold_change(self.robust_spinbox.value())
             self.dA_outlier_range_changed() 
 
+    def show_rejection_mode(self, mode: str) -> None:
+        """Follow the rejection mode selected in the probe window."""
+        self.rejection_mode = mode
+        self.show_threshold_spinbox()
+
+    def show_threshold_spinbox(self) -> None:
+        """Show the threshold spinbox of the rejection mode while outlier rejection is on: % or σ."""
+        selected = self.outlier_checkbox.isChecked()
+        percentage = self.rejection_mode == "percentage"
+        self.deviation_spinbox.setVisible(selected and percentage)
+        self.robust_spinbox.setVisible(selected and not percentage)
 
     def emit_deviation_change(self, value: float):
         self.dA_deviation_threshold_changed.emit(value)
 
+    def emit_robust_threshold_change(self, value: float):
+        self.dA_robust_threshold_changed.emit(value)
+
     @Slot()
     def dA_outlier_range_changed(self):
         start = int(round(self.range_line_left.value()))
@@ -208,6 +243,21 @@ class dAwindow(QWidget):
         """Fill the read-only box with the latest rejected-spectra percentage."""
         self.rejected_value.setText(f"{percent:.1f}")
 
+    @Slot(object)
+    def update_threshold_sweep(self, sweep) -> None:
+        """Draw the deviation histogram of the latest block and refresh the preview."""
+        self.threshold_preview.update_sweep(sweep, self.preview_threshold(sweep))
+
+    def update_rejection_preview(self) -> None:
+        """Show the percentage of shots of the latest block the active threshold rejects."""
+        self.threshold_preview.update_threshold(self.preview_threshold(self.threshold_preview.threshold_sweep))
+
+    def preview_threshold(self, sweep) -> float:
+        """The threshold of the rejection mode of sweep: the deviation (%) or the robust (σ) spinbox."""
+        if sweep is None:
+            return self.deviation_spinbox.value()
+        return sweep.threshold(self.deviation_spinbox.value(), self.robust_spinbox.value())
+
     def set_current(self):
         self.run_command_signal.emit("SetReference", "ButtonPress", 0, 0)
         self.t_0 = round(float(self.abs_pos_line.text()),2)
@@ -0,0 +1,262 @@
+"""
+GUI side of a fly scan: continuous acquisition during a constant-velocity stage sweep.
+
+The stage script (stage_sweep.py) streams position readbacks during every sweep. They are timestamped
+on arrival and every camera block is tagged with the time its last scan was seen (CameraBlock.end_time).
+The delay of every shot is interpolated from the readbacks at its acquisition time, and the shots are
+binned onto the requested delay grid: a bin collects the shots whose delay lies between the midpoints
+to its neighbouring grid points. Each bin is then processed like a block of a step scan.
+"""
+import threading
+import time
+import numpy as np
+from camera import CameraBlock, ContinuousAcquisition
+import stage_protocol
+
+def bin_edges(delays):
+    """Edges of the bins around the sorted delays: halfway between neighbours and half a spacing beyond the ends."""
+    delays = np.unique(np.asarray(delays, dtype=np.float64))
+    if len(delays) < 2:
+        raise ValueError("A fly scan needs at least two delays")
+    middle = (delays[1:] + delays[:-1]) / 2
+    return np.concatenate(([2 * delays[0] - middle[0]], middle, [2 * delays[-1] - middle[-1]]))
+
+def sweep_range(delays, lower, upper):
+    """
+    Start and end (ps) of the sweep over delays: the outer bin edges, clamped to the stage travel from lower
+    to upper. The outer bins then collect fewer shots. Raises ValueError when a delay is outside the travel.
+    """
+    edges = bin_edges(delays)
+    if np.min(delays) < lower or np.max(delays) > upper:
+        raise ValueError(f"Delays from {np.min(delays)} to {np.max(delays)} ps are outside the stage travel ({lower} to {upper} ps)")
+    return float(max(edges[0], lower)), float(min(edges[-1], upper))
+
+def sweep_velocity(delays, shots, shot_rate_hz):
+    """
+    Stage velocity in ps/s at which the narrowest bin still collects shots shots.
+    Wider bins collect proportionally more, so fly scans suit grids with about equal spacing.
+    """
+    return float(np.diff(bin_edges(delays)).min() * shot_rate_hz / shots)
+
+def shot_times(block, shot_rate_hz):
+    """perf_counter() acquisition time of every scan of a block, counted back from its end_time."""
+    return block.end_time - (len(block) - 1 - np.arange(len(block))) / shot_rate_hz
+
+
+class PositionTrack():
+    """Stage delays (ps, relative to the reference) read back during a fly scan, with their arrival times."""
+
+    def __init__(self, latency=0.0):
+        # time between reading the position and the arrival of the message, subtracted from the arrival time
+        self.latency = latency
+        self.times = []
+        self.delays = []
+        self.lock = threading.Lock()
+
+    def add(self, arrival_time, delay):
+        with self.lock:
+            self.times.append(arrival_time - self.latency)
+            self.delays.append(delay)
+
+    def latest_time(self):
+        with self.lock:
+            return self.times[-1] if self.times else -np.inf
+
+    def delays_at(self, times):
+        """The delay at each of times, linearly interpolated between readbacks; NaN outside the readbacks."""
+        with self.lock:
+            track_times = np.array(self.times)
+            track_delays = np.array(self.delays)
+        if len(track_times) == 0:
+            return np.full(np.shape(times), np.nan)
+        return np.interp(times, track_times, track_delays, left=np.nan, right=np.nan)
+
+
+class FlyScanBinner():
+    """
+    Bins the shots of one sweep onto the delay grid.
+
+    Within a sweep the delay changes monotonically, so the shots of a bin are contiguous. Every block
+    is cut where the interpolated delay crosses a bin edge, at a multiple of chopper_period so that
+    pump-off/pump-on pairs stay together, and the pieces of a bin are collected until the sweep leaves it.
+    The collected pieces are returned as one CameraBlock per bin. Shots outside the grid end the bin
+    and are dropped; shots without a known delay are dropped without ending it.
+    """
+
+    def __init__(self, delays, chopper_period=2, keep_raw=False):
+        self.delays = np.unique(np.asarray(delays, dtype=np.float64))
+        self.edges = bin_edges(self.delays)
+        self.chopper_period = chopper_period
+        self.keep_raw = keep_raw
+        self.current = None
+        self.pieces = []
+
+    def add(self, block, delays):
+        """
+        Add a CameraBlock with the delay of every shot. The block may be reused afterwards, the pieces
+        are copied. Returns the completed bins as a list of (delay, CameraBlock).
+        """
+        period = self.chopper_period
+        groups = len(block) // period
+        # the bin of a pair (or chopper period) is the bin of its first shot
+        group_delays = delays[:groups * period:period]
+        bins = np.searchsorted(self.edges, group_delays, side="right") - 1
+        bins[(bins < 0) | (bins >= len(self.delays))] = -1
+        bins[np.isnan(group_delays)] = -2
+
+        completed = []
+        changes = np.flatnonzero(bins[1:] != bins[:-1]) + 1
+        for first, last in zip(np.r_[0, changes], np.r_[changes, groups]):
+            if first == last or bins[first] == -2:
+                continue
+            if bins[first] != self.current:
+                completed += self.flush()
+                self.current = bins[first]
+            if self.current >= 0:
+                rows = slice(first * period, last * period)
+                raw = None if block.raw is None else block.raw[rows]
+                reference = None if block.reference is None else block.reference[rows]
+                self.pieces.append(CameraBlock(block.chopper[rows], block.pixels[rows], raw, reference=reference).copy(self.keep_raw))
+        return completed
+
+    def flush(self):
+        """Complete the bin that is being collected; returns [(delay, CameraBlock)] or an empty list."""
+        pieces, self.pieces = self.pieces, []
+        current, self.current = self.current, None
+        if current is None or current < 0 or not pieces:
+            return []
+        raw = None
+        if all(piece.raw is not None for piece in pieces):
+            raw = np.concatenate([piece.raw for piece in pieces])
+        reference = None
+        if pieces[0].reference is not None:
+            reference = np.concatenate([piece.reference for piece in pieces])
+        block = CameraBlock(np.concatenate([piece.chopper for piece in pieces]),
+                            np.concatenate([piece.pixels for piece in pieces]), raw, reference=reference)
+        return [(float(self.delays[current]), block)]
+
+
+class FlyScan():
+    """
+    Runs the GUI side of a fly scan on the connection conn to stage_sweep.run_fly_scan.
+
+    When the stage is at the start of the window, the camera of session is started in continuous mode
+    with shots scans per block and the stage is told to sweep. The readbacks are collected by a reader
+    thread, the blocks are binned per sweep and handed to the callbacks in sweep order:
+    start_sweep(sweep, delays) with the grid in the order of the sweep, process_bin(delay, block) for
+    every bin and end_sweep(sweep). shot_rate_hz is the scan rate of the camera (the laser repetition rate).
+    """
+
+    def __init__(self, conn, session, shots, delays, sweeps=1, shot_rate_hz=1000.0, chopper_period=2,
+                 keep_raw=False, latency=0.0, buffers=4):
+        self.conn = conn
+        self.session = session
+        self.shots = shots
+        self.delays = np.unique(np.asarray(delays, dtype=np.float64))
+        self.sweeps = sweeps
+        self.shot_rate_hz = shot_rate_hz
+        self.chopper_period = chopper_period
+        self.keep_raw = keep_raw
+        self.buffers = buffers
+        self.track = PositionTrack(latency)
+        self.frames = stage_protocol.FrameReader(conn)
+        # arrival time of the MOVE_DONE of every finished sweep
+        self.sweep_ends = []
+        self.errors = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.reader = None
+        # blocks the camera overwrote before they were binned; their shots are missing in the bins
+        self.dropped_blocks = 0
+
+    def _read_messages(self):
+        """Reader thread: collect readbacks and sweep ends until the stage closes the connection."""
+        try:
+            while True:
+                message = self.frames.read()
+                arrival_time = time.perf_counter()
+                if message is None:
+                    return
+                message_type, values = message
+                if message_type == stage_protocol.POSITION:
+                    self.track.add(arrival_time, values[0] - values[1])
+                elif message_type == stage_protocol.MOVE_DONE:
+                    with self.lock:
+                        self.sweep_ends.append(arrival_time)
+                elif message_type == stage_protocol.ERROR:
+                    with self.lock:
+                        self.errors.append(values[0])
+        except OSError as e:
+            with self.lock:
+                self.errors.append(str(e))
+        finally:
+            with self.lock:
+                # a sweep that was cut short ends here, no further sweep will start
+                self.sweep_ends.append(time.perf_counter())
+                self.closed = True
+
+    def sweep_order(self, sweep):
+        return self.delays if sweep % 2 == 1 else self.delays[::-1]
+
+    def run(self, process_bin, start_sweep=None, end_sweep=None, is_running=lambda: True):
+        """Run the sweeps; returns the number of finished sweeps. Errors reported by the stage are raised as RuntimeError."""
+        message = self.frames.read()
+        if message is None or message[0] != stage_protocol.MOVE_DONE:
+            raise RuntimeError(f"Stage did not reach the start of the fly scan: {message}")
+        acquisition = ContinuousAcquisition(self.session, self.shots, buffers=self.buffers)
+        acquisition.start()
+        stage_protocol.send(self.conn, stage_protocol.ACQ_DONE, 0)
+        self.reader = threading.Thread(target=self._read_messages, daemon=True)
+        self.reader.start()
+
+        sweep = 1
+        binner = FlyScanBinner(self.delays, self.chopper_period, self.keep_raw)
+        if start_sweep is not None:
+            start_sweep(sweep, self.sweep_order(sweep))
+        try:
+            while sweep <= self.sweeps and is_running():
+                if self.errors:
+                    raise RuntimeError(self.errors[0])
+                if self.closed and len(self.sweep_ends) < sweep:
+                    break
+                block = acquisition.get(timeout=0.1)
+                if block is None:
+                    continue
+                # wait until a readback after the end of the block has arrived, or the sweep has ended
+                while self.track.latest_time() < block.end_time and len(self.sweep_ends) < sweep and is_running():
+                    time.sleep(0.001)
+                times = shot_times(block, self.shot_rate_hz)
+                delays = self.track.delays_at(times)
+                first = 0
+                while first < len(block):
+                    with self.lock:
+                        sweep_end = self.sweep_ends[sweep - 1] if len(self.sweep_ends) >= sweep else np.inf
+                    # the shots up to the end of the sweep belong to it, the rest to the next sweep
+                    last = first + int(np.searchsorted(times[first:], sweep_end, side="right"))
+                    last -= (last - first) % self.chopper_period if last < len(block) else 0
+                    piece = CameraBlock(block.chopper[first:last], block.pixels[first:last],
+                                        None if block.raw is None else block.raw[first:last],
+                                        reference=None if block.reference is None else block.reference[first:last])
+                    for delay, bin_block in binner.add(piece, delays[first:last]):
+                        process_bin(delay, bin_block)
+                    first = last
+                    if last < len(block) or sweep_end <= block.end_time:
+                        for delay, bin_block in binner.flush():
+                            process_bin(delay, bin_block)
+                        if end_sweep is not None:
+                            end_sweep(sweep)
+                        sweep += 1
+                        if sweep > self.sweeps:
+                            break
+                        binner = FlyScanBinner(self.delays, self.chopper_period, self.keep_raw)
+                        if start_sweep is not None:
+                            start_sweep(sweep, self.sweep_order(sweep))
+        finally:
+            acquisition.stop()
+            self.dropped_blocks = acquisition.dropped_blocks
+            if self.reader.is_alive():
+                try:
+                    stage_protocol.send(self.conn, stage_protocol.STOP)
+                except OSError:
+                    pass
+        return min(sweep - 1, self.sweeps)
@@ -0,0 +1,154 @@
+import json
+import os
+import queue
+import threading
+import numpy as np
+from camera import CameraBlock, PixelWindow
+
+# One index record per recorded block. first_row and rows locate the block in the .raw file.
+INDEX_DTYPE = np.dtype([
+    ("scan", "<u4"),
+    ("delay_index", "<u4"),
+    ("delay", "<f8"),
+    ("block", "<u4"),
+    ("first_row", "<u8"),
+    ("rows", "<u4"),
+])
+
+class RawShotRecorder():
+    """
+    Streams raw camera shots to a binary archive from a background thread.
+
+    An archive consists of three files that share one base path:
+    - <path>.raw:  every recorded scan as a row of uint16 pixels, appended block after block
+    - <path>.idx:  one INDEX_DTYPE record per block (scan, delay index, delay, block number, rows)
+    - <path>.json: the row width and the pixel window, written when the first block arrives
+
+    record() copies the block and puts it on a bounded queue, so at most max_queued_blocks
+    blocks are held in memory. When the disk falls behind, record() waits instead of buffering more.
+    """
+
+    def __init__(self, path, pixel_window=None, max_queued_blocks=8):
+        self.path = path
+        self.pixel_window = PixelWindow() if pixel_window is None else pixel_window
+        self.queue = queue.Queue(maxsize=max_queued_blocks)
+        self.width = None
+        self.rows_written = 0
+        self.block_counts = {}
+        self.error = None
+
+        self.data_file = open(path + ".raw", "wb")
+        self.index_file = open(path + ".idx", "wb")
+        self.writer = threading.Thread(target=self._write_blocks, daemon=True)
+        self.writer.start()
+
+    def _write_header(self, width):
+        header = {
+            "width": width,
+            "dtype": "uint16",
+            "chopper_pixel": self.pixel_window.chopper_pixel,
+            "start_pixel": self.pixel_window.start_pixel,
+            "end_pixel": self.pixel_window.end_pixel,
+        }
+        with open(self.path + ".json", "w") as file:
+            json.dump(header, file, indent=4)
+
+    def record(self, scan, delay_index, delay, block):
+        """
+        Queue one block for writing. block is a CameraBlock (its raw scans are recorded) or a (scans, pixel) array.
+        """
+        if self.error is not None:
+            raise self.error
+        raw = block.raw if isinstance(block, CameraBlock) else block
+        # copy, because the camera reuses its buffers for the next blocks
+        raw = np.array(raw, dtype=np.uint16, copy=True)
+
+        if self.width is None:
+            self.width = raw.shape[1]
+            self._write_header(self.width)
+        elif raw.shape[1] != self.width:
+            raise ValueError(f"Block has {raw.shape[1]} pixels per scan, archive has {self.width}.")
+
+        key = (scan, delay_index)
+        block_number = self.block_counts.get(key, 0)
+        self.block_counts[key] = block_number + 1
+
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record["scan"] = scan
+        record["delay_index"] = delay_index
+        record["delay"] = delay
+        record["block"] = block_number
+        record["first_row"] = self.rows_written
+        record["rows"] = len(raw)
+        self.rows_written += len(raw)
+        self.queue.put((record, raw))
+
+    def _write_blocks(self):
+        """Writer thread: append queued blocks and their index records until close() sends None."""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            record, raw = item
+            try:
+                raw.tofile(self.data_file)
+                record.tofile(self.index_file)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """Write the remaining queued blocks and close the archive files."""
+        if self.writer is None:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.writer = None
+        self.data_file.close()
+        self.index_file.close()
+
+
+class RawShotArchive():
+    """
+    Read access to an archive written by RawShotRecorder.
+
+    The shots are memory-mapped, so blocks are only read from disk when they are used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + ".json") as file:
+            self.header = json.load(file)
+        self.width = self.header["width"]
+        self.pixel_window = PixelWindow(self.header["start_pixel"], self.header["end_pixel"], self.header["chopper_pixel"])
+        self.index = np.fromfile(path + ".idx", dtype=INDEX_DTYPE)
+
+        rows = os.path.getsize(path + ".raw") // (2 * self.width)
+        # only map the rows that belong to a complete index record
+        if len(self.index):
+            rows = min(rows, int(self.index["first_row"][-1] + self.index["rows"][-1]))
+        if rows > 0:
+            self.shots = np.memmap(path + ".raw", dtype=np.uint16, mode="r", shape=(rows, self.width))
+        else:
+            self.shots = np.zeros((0, self.width), dtype=np.uint16)
+
+    def __len__(self):
+        return len(self.index)
+
+    def raw_block(self, i):
+        """Return the raw (scans, pixel) shots of index record i as a memory-mapped view."""
+        record = self.index[i]
+        first_row = int(record["first_row"])
+        return self.shots[first_row:first_row + int(record["rows"])]
+
+    def block(self, i):
+        """Return index record i as a CameraBlock, cropped with the pixel window of the recording."""
+        return self.pixel_window.crop(self.raw_block(i))
+
+    def select(self, scan=None, delay_index=None):
+        """Return the index record numbers for a scan and/or delay index."""
+        keep = np.ones(len(self.index), dtype=bool)
+        if scan is not None:
+            keep &= self.index["scan"] == scan
+        if delay_index is not None:
+            keep &= self.index["delay_index"] == delay_index
+        return np.flatnonzero(keep)
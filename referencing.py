@@ -0,0 +1,200 @@
+"""
+Reference-channel normalisation of the probe shots.
+
+A part of the probe light is sent onto a second track of the sensor before the sample. The camera
+reads it out as its own region, so every laser shot gives a probe scan and a reference scan.
+Per pixel, the probe counts of the pump-off shots are regressed linearly on the reference counts,
+probe = intercept + slope * reference, and the regression is updated with every block. Every probe
+shot is then divided by its intensity relative to the average shot, as predicted from its reference
+scan. This removes the shot-to-shot fluctuations of the laser that the two channels share, before
+the pump-on shots are divided by their pump-off references.
+"""
+import numpy as np
+from camera import CameraBlock
+
+class RunningRegression():
+    """
+    Streaming per-pixel linear regression y = intercept + slope * x.
+
+    Like RunningStats, only the count, the means and the (co-)moments of the deviations from the means
+    are stored per pixel. Rows are added with update() and regressions of different blocks or
+    processes are combined with merge().
+    """
+
+    def __init__(self, width=None, chunk_rows=256):
+        self.chunk_rows = chunk_rows
+        self.count = 0
+        self.mean_x = None
+        self.mean_y = None
+        self.m_xx = None
+        self.m_xy = None
+        if width is not None:
+            self._allocate(width)
+
+    def _allocate(self, width):
+        self.count = 0
+        self.mean_x = np.zeros(width)
+        self.mean_y = np.zeros(width)
+        self.m_xx = np.zeros(width)
+        self.m_xy = np.zeros(width)
+
+    def __len__(self):
+        return self.count
+
+    def update(self, x_rows, y_rows):
+        """Add (shots, pixels) arrays of x and y values, e.g. the reference and probe counts of pump-off shots."""
+        x_rows = np.asarray(x_rows)
+        y_rows = np.asarray(y_rows)
+        if self.mean_x is None:
+            self._allocate(x_rows.shape[1])
+        for first in range(0, len(x_rows), self.chunk_rows):
+            x = x_rows[first:first + self.chunk_rows].astype(np.float64)
+            y = y_rows[first:first + self.chunk_rows].astype(np.float64)
+            mean_x = x.mean(axis=0)
+            mean_y = y.mean(axis=0)
+            x -= mean_x
+            y -= mean_y
+            self._combine(len(x), mean_x, mean_y, np.einsum("ij,ij->j", x, x), np.einsum("ij,ij->j", x, y))
+        return self
+
+    def _combine(self, count, mean_x, mean_y, m_xx, m_xy):
+        """Chan's parallel update of the means and co-moments with those of another set of rows."""
+        if count == 0:
+            return
+        total = self.count + count
+        fraction = count / total
+        delta_x = mean_x - self.mean_x
+        delta_y = mean_y - self.mean_y
+        self.m_xx += m_xx + delta_x * delta_x * self.count * fraction
+        self.m_xy += m_xy + delta_x * delta_y * self.count * fraction
+        self.mean_x += delta_x * fraction
+        self.mean_y += delta_y * fraction
+        self.count = total
+
+    def merge(self, other):
+        """Add the rows of another RunningRegression."""
+        if other.count == 0:
+            return self
+        if self.mean_x is None:
+            self._allocate(len(other.mean_x))
+        self._combine(other.count, other.mean_x, other.mean_y, other.m_xx, other.m_xy)
+        return self
+
+    @property
+    def slope(self):
+        """Per-pixel slope, 0 for pixels where x does not vary."""
+        return np.divide(self.m_xy, self.m_xx, out=np.zeros_like(self.m_xy), where=self.m_xx > 0)
+
+    @property
+    def intercept(self):
+        return self.mean_y - self.slope * self.mean_x
+
+    def state(self):
+        """The regression state as a dict, see from_state()."""
+        return {"count": self.count, "mean_x": self.mean_x, "mean_y": self.mean_y, "m_xx": self.m_xx, "m_xy": self.m_xy}
+
+    @classmethod
+    def from_state(cls, state):
+        regression = cls()
+        regression.count = int(state["count"])
+        for name in ("mean_x", "mean_y", "m_xx", "m_xy"):
+            setattr(regression, name, np.array(state[name], dtype=np.float64))
+        return regression
+
+
+class Referencing():
+    """
+    Reference-channel normalisation for ComputeData.referencing.
+
+    regions: number of scans the camera reads out per laser shot (one per configured region that is
+    processed), probe_region / reference_region: position of the probe and the reference scan among them.
+    learn: update the regression with the pump-off shots of every block; turn it off to keep the
+    coefficients fixed, e.g. during a measurement after they were learned in the live view.
+    min_shots: pump-off shots the regression needs before shots are normalised.
+    smoothing: width in pixels of a moving average over the reference spectrum. The shot noise of a single
+    reference pixel adds to the probe noise; averaging neighbouring pixels keeps the correlated laser
+    fluctuations and averages the shot noise away. 1 regresses every pixel on its own reference pixel.
+    """
+
+    def __init__(self, regions=2, probe_region=0, reference_region=1, learn=True, min_shots=100, smoothing=15, chunk_rows=128):
+        self.regions = regions
+        self.probe_region = probe_region
+        self.reference_region = reference_region
+        self.learn = learn
+        self.min_shots = min_shots
+        self.smoothing = smoothing
+        self.chunk_rows = chunk_rows
+        self.regression = RunningRegression()
+        self.buffer = None
+
+    def reset(self):
+        """Forget the learned regression, e.g. after the reference beam was realigned."""
+        self.regression = RunningRegression()
+
+    def split(self, block):
+        """
+        Split a cropped CameraBlock whose scans alternate between the regions into a block of the probe
+        scans with the reference scans as block.reference. The arrays are strided views, nothing is copied.
+        Blocks that already have a reference are returned unchanged.
+        """
+        if block.reference is not None:
+            return block
+        shots = len(block) // self.regions
+        probe = slice(self.probe_region, shots * self.regions, self.regions)
+        reference = slice(self.reference_region, shots * self.regions, self.regions)
+        raw = None if block.raw is None else block.raw[probe]
+        return CameraBlock(block.chopper[probe], block.pixels[probe], raw, block.number_of_blocks, block.pixels[reference])
+
+    def smoothed(self, reference_rows):
+        """The reference rows as float64, averaged over smoothing neighbouring pixels (fewer at the edges)."""
+        rows = np.array(reference_rows, dtype=np.float64)
+        if self.smoothing <= 1:
+            return rows
+        width = rows.shape[1]
+        before, after = self.smoothing // 2, (self.smoothing + 1) // 2
+        cumulative = np.zeros((len(rows), width + 1))
+        np.cumsum(rows, axis=1, out=cumulative[:, 1:])
+        # full windows are differences of shifted slices, the few edge pixels average fewer pixels
+        np.subtract(cumulative[:, before + after:], cumulative[:, :width + 1 - before - after], out=rows[:, before:width + 1 - after])
+        rows[:, before:width + 1 - after] /= before + after
+        for pixel in (*range(before), *range(width + 1 - after, width)):
+            lower, upper = max(pixel - before, 0), min(pixel + after, width)
+            rows[:, pixel] = (cumulative[:, upper] - cumulative[:, lower]) / (upper - lower)
+        return rows
+
+    def update(self, reference_rows, probe_rows):
+        """Learn from the reference and probe rows of pump-off shots."""
+        if not self.learn:
+            return
+        for first in range(0, len(probe_rows), self.chunk_rows):
+            last = first + self.chunk_rows
+            self.regression.update(self.smoothed(reference_rows[first:last]), probe_rows[first:last])
+
+    def normalise(self, probe_rows, reference_rows):
+        """
+        Divide float probe_rows in place by the intensity of every shot relative to the average shot,
+        (intercept + slope * reference) / (intercept + slope * mean reference), chunk by chunk.
+        Does nothing while the regression has seen fewer than min_shots shots.
+        """
+        if len(self.regression) < self.min_shots:
+            return probe_rows
+        slope = self.regression.slope.astype(np.float32)
+        intercept = self.regression.intercept.astype(np.float32)
+        average = (self.regression.mean_y).astype(np.float32)
+        # a pixel without signal in the average shot is not normalised
+        slope[average <= 0] = 0
+        intercept[average <= 0] = 1
+        average[average <= 0] = 1
+
+        shape = (min(self.chunk_rows, len(probe_rows)), probe_rows.shape[1])
+        if self.buffer is None or self.buffer.shape[1:] != shape[1:] or len(self.buffer) < shape[0]:
+            self.buffer = np.empty(shape, dtype=np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for first in range(0, len(probe_rows), self.chunk_rows):
+                last = min(first + self.chunk_rows, len(probe_rows))
+                relative = self.buffer[:last - first]
+                np.multiply(self.smoothed(reference_rows[first:last]), slope, out=relative, casting="unsafe")
+                relative += intercept
+                relative /= average
+                probe_rows[first:last] /= relative
+        return probe_rows
@@ -0,0 +1,163 @@
+"""
+Headless replay of a raw shot archive through ComputeData.
+
+Every delay point of the archive is processed with the same compute_spectra and outlier rejection
+code as during the measurement, so rejection settings can be tuned after the fact.
+Delay points are distributed over a process pool.
+
+Usage: python replay.py <archive path without extension> [options]
+"""
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Plot_Calculations import ComputeData
+from raw_archive import RawShotArchive
+from running_stats import RunningStats
+
+# Archive opened once per worker process
+_archives = {}
+
+def _open_archive(path):
+    if path not in _archives:
+        _archives[path] = RawShotArchive(path)
+    return _archives[path]
+
+def replay_delay(path, record_numbers, settings):
+    """
+    Process all blocks of one delay point. Runs in a worker process.
+    settings: ComputeData attributes to set before processing, e.g. {"deviation_threshold_dA": 5}.
+    Returns a list of (scan, probe spectrum, dA spectrum, shots, probe RunningStats, dA RunningStats) per block.
+    """
+    archive = _open_archive(path)
+    data_processor = ComputeData()
+    for name, value in settings.items():
+        setattr(data_processor, name, value)
+
+    results = []
+    for i in record_numbers:
+        block = archive.block(i)
+        probe_spectrum, delta_A = data_processor.compute_spectra(block)
+        results.append((int(archive.index["scan"][i]), np.array(probe_spectrum), np.array(delta_A), len(block),
+                        data_processor.probe_stats, data_processor.delta_A_stats))
+    return results
+
+
+class ReplayResult():
+    """
+    Probe and dA matrices rebuilt from an archive.
+
+    delays: (delays,) delay of every delay index
+    probe, delta_A: (scans, delays, pixels) per-scan spectra, NaN where a scan has no data
+    probe_average, delta_A_average: (delays, pixels) averages over all scans
+    probe_sem, delta_A_sem: (delays, pixels) standard errors of the mean over all shots of all scans
+    """
+
+    def __init__(self, scans, delays, probe, delta_A, shots, seconds, probe_sem=None, delta_A_sem=None):
+        self.scans = scans
+        self.delays = delays
+        self.probe = probe
+        self.delta_A = delta_A
+        self.shots = shots
+        self.seconds = seconds
+        self.probe_sem = probe_sem
+        self.delta_A_sem = delta_A_sem
+        with np.errstate(invalid='ignore'):
+            self.probe_average = np.nanmean(probe, axis=0)
+            self.delta_A_average = np.nanmean(delta_A, axis=0)
+
+    @property
+    def shots_per_second(self):
+        return self.shots / self.seconds if self.seconds > 0 else float("inf")
+
+    def save_csv(self, filepath, average=None):
+        """Save a (delays, pixels) matrix in the Delay (ps), pixel... layout of the measurement files."""
+        average = self.delta_A_average if average is None else average
+        with open(filepath, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Delay (ps)'] + [f'{i}' for i in range(average.shape[1])])
+            for delay, row in zip(self.delays, average):
+                writer.writerow([delay] + row.tolist())
+
+
+def replay(path, settings=None, workers=None):
+    """
+    Rebuild the per-delay probe and dA matrices of the archive at path.
+    workers: number of worker processes, None for one per CPU, 0 to process in this process.
+    """
+    settings = {} if settings is None else settings
+    start = time.perf_counter()
+    archive = RawShotArchive(path)
+    index = archive.index
+    scans = np.unique(index["scan"])
+    delay_indices = np.unique(index["delay_index"])
+    tasks = [np.flatnonzero(index["delay_index"] == delay_index) for delay_index in delay_indices]
+
+    if workers == 0:
+        results = [replay_delay(path, records, settings) for records in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(replay_delay, [path] * len(tasks), tasks, [settings] * len(tasks)))
+
+    pixels = archive.pixel_window.width
+    probe = np.full((len(scans), len(delay_indices), pixels), np.nan)
+    delta_A = np.full((len(scans), len(delay_indices), pixels), np.nan)
+    delays = np.array([index["delay"][records[0]] for records in tasks])
+    probe_sem = np.full((len(delay_indices), pixels), np.nan)
+    delta_A_sem = np.full((len(delay_indices), pixels), np.nan)
+    shots = 0
+    scan_position = {scan: i for i, scan in enumerate(scans)}
+
+    for d, delay_results in enumerate(results):
+        # average the blocks of the same scan and delay
+        sums = {}
+        probe_stats, dA_stats = RunningStats(), RunningStats()
+        for scan, probe_spectrum, dA_spectrum, block_shots, block_probe_stats, block_dA_stats in delay_results:
+            probe_sum, dA_sum, count = sums.get(scan, (0, 0, 0))
+            sums[scan] = (probe_sum + probe_spectrum, dA_sum + dA_spectrum, count + 1)
+            shots += block_shots
+            # merge the shot statistics of all blocks and scans of this delay
+            probe_stats.merge(block_probe_stats)
+            dA_stats.merge(block_dA_stats)
+        for scan, (probe_sum, dA_sum, count) in sums.items():
+            probe[scan_position[scan], d] = probe_sum / count
+            delta_A[scan_position[scan], d] = dA_sum / count
+        if len(probe_stats):
+            probe_sem[d] = probe_stats.sem
+        if len(dA_stats):
+            delta_A_sem[d] = dA_stats.sem
+
+    return ReplayResult(scans, delays, probe, delta_A, shots, time.perf_counter() - start, probe_sem, delta_A_sem)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a raw shot archive through ComputeData.")
+    parser.add_argument("archive", help="archive path without the .raw/.idx/.json extension")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU, 0: no pool)")
+    parser.add_argument("--threshold-probe", type=float, default=None, help="deviation_threshold_probe in %%")
+    parser.add_argument("--threshold-dA", type=float, default=None, help="deviation_threshold_dA in %%")
+    parser.add_argument("--range-dA", type=int, nargs=2, default=None, help="outlier rejection pixel range for dA")
+    parser.add_argument("--output", default=None, help="CSV file for the averaged dA matrix")
+    args = parser.parse_args()
+
+    settings = {}
+    if args.threshold_probe is not None:
+        settings["outlier_rejection_probe"] = True
+        settings["deviation_threshold_probe"] = args.threshold_probe
+    if args.threshold_dA is not None:
+        settings["outlier_rejection_dA"] = True
+        settings["deviation_threshold_dA"] = args.threshold_dA
+    if args.range_dA is not None:
+        settings["range_start_dA"], settings["range_end_dA"] = sorted(args.range_dA)
+
+    result = replay(args.archive, settings, args.workers)
+    print(f"Replayed {result.shots} shots of {len(result.scans)} scans and {len(result.delays)} delays "
+          f"in {result.seconds:.2f} s ({result.shots_per_second:.0f} shots/s)")
+    output = args.output or os.path.basename(args.archive) + "_replay_dA.csv"
+    result.save_csv(output)
+    print(f"Saved averaged dA matrix to {output}")
+    sem_output = os.path.splitext(output)[0] + "_SEM.csv"
+    result.save_csv(sem_output, result.delta_A_sem)
+    print(f"Saved dA standard errors to {sem_output}")
@@ -0,0 +1,181 @@
+import numpy as np
+
+class RunningStats():
+    """
+    Streaming per-pixel mean and variance (Welford/Chan algorithm).
+
+    Rows of shots are added chunk by chunk with update(); accumulators of different blocks, scans
+    or worker processes are combined with merge(). Only count, mean and M2 (the sum of squared
+    deviations from the mean) are stored per pixel, so memory does not grow with the number of shots.
+    The state is three NumPy arrays, so the object can be pickled to and from worker processes.
+
+    ignore_nan: skip NaN values per pixel (like np.nanmean). When False, a NaN makes the pixel NaN (like np.mean).
+    """
+
+    def __init__(self, width=None, ignore_nan=True, chunk_rows=256):
+        self.ignore_nan = ignore_nan
+        self.chunk_rows = chunk_rows
+        self.count = None
+        self.mean_ = None
+        self.m2 = None
+        if width is not None:
+            self._allocate(width)
+
+    def _allocate(self, width):
+        self.count = np.zeros(width, dtype=np.int64)
+        self.mean_ = np.zeros(width)
+        self.m2 = np.zeros(width)
+
+    def __len__(self):
+        """Largest number of values added to a pixel."""
+        return 0 if self.count is None else int(self.count.max(initial=0))
+
+    def update(self, rows):
+        """Add a (shots, pixels) array, or a single (pixels,) row."""
+        rows = np.asarray(rows)
+        if rows.ndim == 1:
+            rows = rows[None, :]
+        if self.count is None:
+            self._allocate(rows.shape[1])
+        # chunks keep the float64 temporaries small
+        for first in range(0, len(rows), self.chunk_rows):
+            self._update_chunk(rows[first:first + self.chunk_rows])
+        return self
+
+    def _update_chunk(self, chunk):
+        if len(chunk) == 0:
+            return
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # sums of deviations from the approximate chunk mean, in the precision of the data;
+            # shifting by the mean keeps the sum of squares free of cancellation
+            if self.ignore_nan:
+                valid = ~np.isnan(chunk)
+                count = valid.sum(axis=0)
+                shift = np.where(valid, chunk, 0).sum(axis=0) / np.maximum(count, 1)
+                deviation = np.where(valid, chunk - shift, 0)
+            else:
+                count = np.full(chunk.shape[1], len(chunk), dtype=np.int64)
+                shift = chunk.sum(axis=0) / len(chunk)
+                deviation = chunk - shift
+            deviation_sum = deviation.sum(axis=0)
+            squares_sum = np.einsum("ij,ij->j", deviation, deviation)
+        self.add_sums(count, shift, deviation_sum, squares_sum)
+
+    def add_sums(self, count, shift, deviation_sum, squares_sum):
+        """Add values given by their count, the sum of their deviations from shift and the sum of the squared deviations."""
+        if self.count is None:
+            self._allocate(len(deviation_sum))
+        deviation_sum = np.asarray(deviation_sum, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = shift + deviation_sum / np.maximum(count, 1)
+            m2 = np.asarray(squares_sum, dtype=np.float64) - deviation_sum ** 2 / np.maximum(count, 1)
+        self._combine(count, mean, m2)
+        return self
+
+    def _combine(self, count, mean, m2):
+        """Chan's parallel update with the count, mean and M2 of another set of values."""
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean_
+            fraction = np.where(total > 0, count / np.maximum(total, 1), 0)
+            new_mean = self.mean_ + delta * fraction
+            new_m2 = self.m2 + m2 + delta ** 2 * self.count * fraction
+        # pixels without earlier values take the new state, pixels without new values keep theirs
+        self.mean_ = np.where(self.count == 0, mean, np.where(count == 0, self.mean_, new_mean))
+        self.m2 = np.where(self.count == 0, m2, np.where(count == 0, self.m2, new_m2))
+        self.count = total
+
+    def merge(self, other):
+        """Add the values of another RunningStats, e.g. of another block, scan or worker process."""
+        if other.count is None:
+            return self
+        if self.count is None:
+            self._allocate(len(other.count))
+        self._combine(other.count, other.mean_, other.m2)
+        return self
+
+    @property
+    def mean(self):
+        """Per-pixel mean, NaN for pixels without values."""
+        return np.where(self.count > 0, self.mean_, np.nan)
+
+    @property
+    def variance(self):
+        """Per-pixel sample variance (ddof=1), NaN for pixels with fewer than two values."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """Per-pixel standard error of the mean."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.std / np.sqrt(self.count)
+
+    def state(self):
+        """The accumulator state as a dict of arrays, see from_state()."""
+        return {"count": self.count, "mean": self.mean_, "m2": self.m2}
+
+    @classmethod
+    def from_state(cls, state, ignore_nan=True):
+        stats = cls(ignore_nan=ignore_nan)
+        stats.count = np.array(state["count"], dtype=np.int64)
+        stats.mean_ = np.array(state["mean"], dtype=np.float64)
+        stats.m2 = np.array(state["m2"], dtype=np.float64)
+        return stats
+
+
+class ChunkSums():
+    """
+    Per-pixel sums for a RunningStats, accumulated inside a kernel loop that already has every chunk of
+    shots in the CPU cache: the count, the sum of the deviations from a fixed shift and the sum of their
+    squares, in the precision of the chunk. stats() merges them into a RunningStats once per block.
+
+    The shift is the mean of the first chunk, which keeps the squares of counts far from zero free of
+    cancellation. shifted=False sums the values themselves and saves a subtraction per chunk, for values
+    near zero such as dA.
+    """
+
+    def __init__(self, ignore_nan=True, shifted=True):
+        self.ignore_nan = ignore_nan
+        self.shifted = shifted
+        self.shift = 0.0
+        self.count = 0
+        self.deviation_sum = None
+        self.squares_sum = None
+
+    def add(self, chunk, out=None):
+        """Add a (shots, pixels) chunk; out is an optional work array of the chunk's shape and dtype."""
+        if len(chunk) == 0:
+            return self
+        if self.deviation_sum is None:
+            self.deviation_sum = np.zeros(chunk.shape[1])
+            self.squares_sum = np.zeros(chunk.shape[1])
+            if self.ignore_nan:
+                self.count = np.zeros(chunk.shape[1], dtype=np.int64)
+            if self.shifted:
+                valid = chunk == chunk
+                self.shift = (np.where(valid, chunk, 0).sum(axis=0) / np.maximum(np.count_nonzero(valid, axis=0), 1)).astype(chunk.dtype)
+        deviation = np.subtract(chunk, self.shift, out=out) if self.shifted else chunk
+        if self.ignore_nan:
+            valid = deviation == deviation
+            self.count += np.count_nonzero(valid, axis=0)
+            if deviation is out:
+                np.copyto(deviation, 0, where=~valid)
+            else:
+                deviation = np.where(valid, deviation, 0)
+        else:
+            self.count += len(chunk)
+        self.deviation_sum += deviation.sum(axis=0)
+        self.squares_sum += np.einsum("ij,ij->j", deviation, deviation)
+        return self
+
+    def stats(self):
+        """The RunningStats of all added values."""
+        stats = RunningStats(ignore_nan=self.ignore_nan)
+        if self.deviation_sum is None:
+            return stats
+        return stats.add_sums(self.count, self.shift, self.deviation_sum, self.squares_sum)
@@ -0,0 +1,93 @@
+"""
+Order of the delay points of a step scan.
+
+MeasurementWorker plans every scan with plan_scans() and sends the whole sequence to the stage script,
+so the stepping order chosen in the interface is the order the stage moves in:
+- "Regular": the delays as given, every scan
+- "Backwards": the delays reversed, every scan
+- "Random": a new random permutation every scan; decorrelates drift from the delay, but every move
+  crosses about a third of the window
+- "Serpentine": the delays as given and reversed in alternate scans, so no scan starts with a fly-back
+- "Random (min. travel)": every scan is made of a few interleaved passes across the window (every
+  passes-th delay of the sorted grid) in random order and alternating direction; neighbouring delays
+  are measured at different times like with "Random", while the stage travels only passes windows
+
+plan_travel() and motion_time() estimate the stage travel and move time of a plan, compare_orders()
+lists them for every order, so the fastest order that still decorrelates drift can be picked.
+"""
+import numpy as np
+
+ORDERS = ["Regular", "Backwards", "Random", "Serpentine", "Random (min. travel)"]
+
+def interleaved_order(delays, passes, rng, position=None):
+    """
+    One scan of "Random (min. travel)": the sorted delays split into passes interleaved passes, taken in
+    random order, alternately up and down. The first pass starts at the end of the window nearest position.
+    """
+    delays = np.sort(np.asarray(delays, dtype=np.float64))
+    passes = max(1, min(passes, len(delays)))
+    forward = position is None or abs(position - delays[0]) <= abs(position - delays[-1])
+    order = []
+    for group in rng.permutation(passes):
+        sweep = delays[group::passes]
+        order += list(sweep if forward else sweep[::-1])
+        forward = not forward
+    return order
+
+def plan_scans(delays, order, scans, start=None, passes=4, rng=None):
+    """
+    The delays of every scan in the order they are measured, as a list of scans scans.
+    start is the delay the stage is at before the first scan, passes the number of passes of
+    "Random (min. travel)". Raises ValueError for an unknown order.
+    """
+    delays = [float(delay) for delay in delays]
+    rng = np.random.default_rng() if rng is None else rng
+    plan = []
+    position = start
+    for scan in range(scans):
+        if order == "Regular":
+            scan_delays = list(delays)
+        elif order == "Backwards":
+            scan_delays = delays[::-1]
+        elif order == "Random":
+            scan_delays = [delays[i] for i in rng.permutation(len(delays))]
+        elif order == "Serpentine":
+            scan_delays = list(delays) if scan % 2 == 0 else delays[::-1]
+        elif order == "Random (min. travel)":
+            scan_delays = [float(delay) for delay in interleaved_order(delays, passes, rng, position)]
+        else:
+            raise ValueError(f"Unknown stepping order: {order}")
+        plan.append(scan_delays)
+        position = scan_delays[-1] if scan_delays else position
+    return plan
+
+def plan_moves(plan, start=None):
+    """Distance of every move of a plan in ps of delay, including the move from start to the first delay."""
+    sequence = [delay for scan_delays in plan for delay in scan_delays]
+    if start is not None:
+        sequence = [start] + sequence
+    return np.abs(np.diff(np.asarray(sequence, dtype=np.float64)))
+
+def plan_travel(plan, start=None):
+    """Total stage travel of a plan in ps of delay."""
+    return float(plan_moves(plan, start).sum())
+
+def motion_time(plan, start=None, velocity=300.0, acceleration=1000.0, settle_seconds=0.0, c=299792458):
+    """
+    Estimated time in s the stage spends moving during a plan: trapezoidal velocity profiles with
+    velocity (mm/s) and acceleration (mm/s^2), plus settle_seconds after every move. Set them to
+    the values of the controller; the shots themselves are not included.
+    """
+    distances = plan_moves(plan, start) * 10**-9 * c / 8
+    # moves shorter than velocity**2 / acceleration do not reach the full velocity
+    full_speed = distances >= velocity**2 / acceleration
+    seconds = np.where(full_speed, distances / velocity + velocity / acceleration, 2 * np.sqrt(distances / acceleration))
+    return float(seconds.sum() + settle_seconds * len(distances))
+
+def compare_orders(delays, scans, start=None, orders=ORDERS, rng=None, **motion):
+    """{order: (travel in ps, motion time in s)} of a plan of every order; motion is passed to motion_time()."""
+    comparison = {}
+    for order in orders:
+        plan = plan_scans(delays, order, scans, start, rng=rng)
+        comparison[order] = (plan_travel(plan, start), motion_time(plan, start, **motion))
+    return comparison
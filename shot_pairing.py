@@ -0,0 +1,75 @@
+"""
+Pairing of pump-on shots with pump-off reference shots for the dA calculation.
+
+All functions take the pump state of every shot of a block in acquisition order (True for pump-on)
+and return positions among the pump-off shots and among the pump-on shots, i.e. row numbers in
+the arrays of pump-off rows and pump-on rows that compute_spectra builds in shot order.
+
+Reference modes:
+- "paired":       every pump-on shot is divided by its neighbouring pump-off shot; shots without
+                  a neighbour of the other state are dropped
+- "block":        every pump-on shot is divided by the average of all pump-off shots of the block
+- "interpolated": every pump-on shot is divided by the pump-off shots before and after it,
+                  linearly interpolated in shot number
+"""
+import numpy as np
+
+REFERENCE_MODES = ("paired", "block", "interpolated")
+
+def adjacent_pairs(pump_on):
+    """
+    Pair neighbouring shots with different pump states, from the first shot onwards.
+    Every shot is used at most once and orphan shots (the neighbours have the same state) are dropped,
+    which is the same as walking through the shots and pairing a shot with the next one whenever their states differ.
+    Returns (off_rows, on_rows): positions of the paired shots among the pump-off and the pump-on shots.
+    """
+    pump_on = np.asarray(pump_on, dtype=bool)
+    shots = len(pump_on)
+    if shots < 2:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    # alternating segments start wherever a shot has the same state as the one before it;
+    # within a segment, shots at an even offset pair with the next shot of the segment
+    changes = pump_on[1:] != pump_on[:-1]
+    index = np.arange(shots)
+    segment_start = np.maximum.accumulate(np.where(np.r_[True, ~changes], index, 0))
+    first = np.flatnonzero(((index - segment_start) % 2 == 0) & np.r_[changes, False])
+    second = first + 1
+
+    off_index = np.where(pump_on[first], second, first)
+    on_index = np.where(pump_on[first], first, second)
+    off_rank = np.cumsum(~pump_on) - 1
+    on_rank = np.cumsum(pump_on) - 1
+    return off_rank[off_index], on_rank[on_index]
+
+def interpolation_weights(pump_on):
+    """
+    For every pump-on shot, the pump-off shots directly before and after it and the weight of the later one.
+    At the block edges, where one of them is missing, the nearest pump-off shot is used with its full weight.
+    Returns (previous_rows, next_rows, next_weight) with positions among the pump-off shots, or None without pump-off shots.
+    """
+    pump_on = np.asarray(pump_on, dtype=bool)
+    off_index = np.flatnonzero(~pump_on)
+    on_index = np.flatnonzero(pump_on)
+    if len(off_index) == 0:
+        return None
+
+    next_rows = np.searchsorted(off_index, on_index)
+    previous_rows = next_rows - 1
+    # clamp to the first/last pump-off shot at the edges of the block
+    next_rows = np.minimum(next_rows, len(off_index) - 1)
+    previous_rows = np.maximum(previous_rows, 0)
+
+    distance = off_index[next_rows] - off_index[previous_rows]
+    next_weight = np.divide(on_index - off_index[previous_rows], distance,
+                            out=np.zeros(len(on_index)), where=distance > 0)
+    next_weight = np.clip(next_weight, 0, 1)
+    return previous_rows, next_rows, next_weight.astype(np.float32)
+
+def interpolated_reference(pump_off_rows, previous_rows, next_rows, next_weight, out=None):
+    """The interpolated pump-off reference of every pump-on shot as a (pump-on shots, pixels) array."""
+    out = np.empty((len(next_rows), pump_off_rows.shape[1]), dtype=np.float32) if out is None else out
+    np.take(pump_off_rows, previous_rows, axis=0, out=out)
+    out *= (1 - next_weight)[:, None]
+    out += pump_off_rows[next_rows] * next_weight[:, None]
+    return out
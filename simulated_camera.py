@@ -0,0 +1,316 @@
+import math
+import time
+import numpy as np
+from camera import PixelWindow
+
+class SimulatedTASample():
+    """
+    Synthetic transient absorption sample, probe light and choppers for SimulatedESLSCDLL.
+
+    Every shot is a raw 1088-pixel uint16 scan. The chopper word in the chopper pixel encodes
+    probe/pump chopper states like the real board: 0 (OFF/OFF), 16384 (OFF/ON), 32768 (ON/OFF)
+    and 49152 (ON/ON). The active pixels contain the probe spectrum, scaled by a slowly drifting
+    laser intensity with shot-to-shot jitter, with shot noise, dark counts, occasional outlier
+    shots and pump scatter. Pump-on probe shots are attenuated by a delay dependent dA
+    (-log(pump_on / pump_off)): a bleach and an excited state absorption band that rise with
+    the instrument response and decay with one lifetime.
+    With reference_counts, every shot is read out as two scans like a camera with a reference
+    track in a second region (see referencing.py): the probe scan and a reference scan with the
+    same laser intensity but without the sample response, scaled to reference_counts.
+    With delay_source, a function of perf_counter() times such as SimulatedDLS.delay_at, every shot
+    is taken at the delay of the stage at its acquisition time instead of at delay_ps.
+    """
+
+    def __init__(self, pixel_window=None, probe_counts=12000, dark_counts=400, noise_scale=1.0,
+                 shot_jitter=0.01, drift_amplitude=0.05, drift_period_shots=200000,
+                 outlier_probability=0.002, outlier_factor=0.3,
+                 dA_amplitude=0.01, lifetime_ps=50.0, irf_ps=0.2, scatter_counts=150,
+                 chopper_pattern=(32768, 49152), delay_ps=0.0, reference_counts=None, delay_source=None):
+        self.pixel_window = PixelWindow() if pixel_window is None else pixel_window
+        width = self.pixel_window.width
+        x = np.linspace(-1, 1, width, dtype=np.float32)
+
+        # probe spectrum: scalar peak counts or an array with one value per active pixel
+        if np.ndim(probe_counts) == 0:
+            self.probe_spectrum = (probe_counts * (0.15 + 0.85 * np.exp(-(x / 0.6) ** 2))).astype(np.float32)
+        else:
+            self.probe_spectrum = np.asarray(probe_counts, dtype=np.float32)
+        # dA spectrum at maximum signal: bleach at the blue side, excited state absorption at the red side
+        self.dA_spectrum = (dA_amplitude * (np.exp(-((x - 0.4) / 0.15) ** 2) - 0.6 * np.exp(-((x + 0.3) / 0.2) ** 2))).astype(np.float32)
+        # pump scatter and fluorescence, present in every pump-on shot
+        self.scatter_spectrum = (scatter_counts * np.exp(-((x + 0.1) / 0.05) ** 2) + 0.2 * scatter_counts * np.exp(-((x - 0.2) / 0.3) ** 2)).astype(np.float32)
+        # reference channel: the probe spectrum before the sample, or None without a reference region
+        self.reference_spectrum = None
+        if reference_counts is not None:
+            self.reference_spectrum = (self.probe_spectrum * (reference_counts / self.probe_spectrum.max())).astype(np.float32)
+
+        self.dark_counts = dark_counts
+        self.noise_scale = noise_scale
+        self.shot_jitter = shot_jitter
+        self.drift_amplitude = drift_amplitude
+        self.drift_period_shots = drift_period_shots
+        self.outlier_probability = outlier_probability
+        self.outlier_factor = outlier_factor
+        self.lifetime_ps = lifetime_ps
+        self.irf_ps = irf_ps
+        self.chopper_pattern = np.asarray(chopper_pattern, dtype=np.uint16)
+        self.delay_ps = delay_ps
+        self.delay_source = delay_source
+
+        # shots generated so far, keeps drift and chopper phase continuous over blocks
+        self.shot_counter = 0
+        self.noise_pool = None
+
+    def kinetics(self, delay_ps):
+        """Exponential decay convolved with a Gaussian instrument response, 1 at the maximum for a long lifetime."""
+        tau, irf = self.lifetime_ps, self.irf_ps
+        argument = (irf ** 2 / tau - delay_ps) / (math.sqrt(2) * irf)
+        exponent = -delay_ps / tau + irf ** 2 / (2 * tau ** 2)
+        if argument > 25:
+            return 0.0
+        return 0.5 * math.exp(exponent) * math.erfc(argument)
+
+    def delta_A(self, delay_ps=None):
+        """The noise-free dA spectrum of the active pixels at a delay."""
+        delay_ps = self.delay_ps if delay_ps is None else delay_ps
+        return self.dA_spectrum * self.kinetics(delay_ps)
+
+    def fill(self, out, rng, times=None):
+        """
+        Fill a (scans, pixel) uint16 array with the next shots, probe and reference scan alternating with a reference.
+        times: perf_counter() acquisition time of every scan, used with a delay_source.
+        """
+        if self.reference_spectrum is not None:
+            self.fill_shots(out[0::2], rng, out[1::2], None if times is None else times[0::2])
+        else:
+            self.fill_shots(out, rng, times=times)
+
+    def noisy(self, signal, rng):
+        """Add shot noise from a pool of normal numbers, so a block costs about as much as a few copies."""
+        width = signal.shape[1]
+        if self.noise_pool is None or self.noise_pool.shape[1] != width:
+            self.noise_pool = rng.standard_normal((8192, width), dtype=np.float32)
+        rows = (rng.integers(len(self.noise_pool)) + np.arange(len(signal))) % len(self.noise_pool)
+        noise = np.take(self.noise_pool, rows, axis=0)
+        noise *= np.sqrt(signal + self.dark_counts) * self.noise_scale
+        signal += noise
+        signal += self.dark_counts
+        return signal
+
+    def fill_shots(self, out, rng, reference_out=None, times=None):
+        """Fill the probe scans out and, if given, the reference scans reference_out of the next shots."""
+        shots = len(out)
+        window = self.pixel_window
+        shot_number = self.shot_counter + np.arange(shots)
+        self.shot_counter += shots
+
+        chopper = self.chopper_pattern[shot_number % len(self.chopper_pattern)]
+        probe_on = (chopper & 32768) != 0
+        pump_on = (chopper & 16384) != 0
+
+        # laser intensity per shot: slow drift, shot-to-shot jitter and occasional outliers
+        laser = 1 + self.drift_amplitude * np.sin(2 * np.pi * shot_number / self.drift_period_shots)
+        laser = laser + self.shot_jitter * rng.standard_normal(shots)
+        laser[rng.random(shots) < self.outlier_probability] *= self.outlier_factor
+        laser = (laser * probe_on).astype(np.float32)
+
+        if reference_out is not None:
+            reference = self.noisy(laser[:, None] * self.reference_spectrum[None, :], rng)
+            reference_out[:] = self.dark_counts
+            reference_out[:, window.start_pixel:window.end_pixel] = np.clip(reference, 0, 65535)
+            reference_out[:, window.chopper_pixel] = chopper
+
+        signal = laser[:, None] * self.probe_spectrum[None, :]
+        if self.delay_source is not None and times is not None:
+            # the delay changes from shot to shot while the stage moves
+            kinetics = np.array([self.kinetics(delay) for delay in self.delay_source(times[pump_on])], dtype=np.float32)
+            signal[pump_on] *= np.exp(-kinetics[:, None] * self.dA_spectrum[None, :])
+        else:
+            signal[pump_on] *= np.exp(-self.delta_A())
+        signal[pump_on] += self.scatter_spectrum
+        signal = self.noisy(signal, rng)
+
+        out[:] = self.dark_counts
+        out[:, window.start_pixel:window.end_pixel] = np.clip(signal, 0, 65535)
+        out[:, window.chopper_pixel] = chopper
+
+
+class SimulatedESLSCDLL():
+    """
+    Stand-in for ESLSCDLL.dll that can be passed to CameraSession on machines without the PCIe board.
+
+    It exposes the same DLL functions with the same arguments (ctypes pointers and the
+    measurement_settings struct), sleeps for configurable driver/board latencies and
+    counts every call, so the session lifecycle can be benchmarked on Linux.
+    With a SimulatedTASample the copied blocks contain realistic shots; without one every
+    block is the same noisy template, which only costs a memory copy.
+    """
+
+    def __init__(self, init_driver_seconds=0.05, init_board_seconds=0.02, init_measurement_seconds=0.01,
+                 exit_driver_seconds=0.01, scan_rate_hz=None, sample=None, seed=None):
+        # latencies of the driver calls, in seconds
+        self.init_driver_seconds = init_driver_seconds
+        self.init_board_seconds = init_board_seconds
+        self.init_measurement_seconds = init_measurement_seconds
+        self.exit_driver_seconds = exit_driver_seconds
+
+        # shots per second; None means a measurement finishes instantly
+        self.scan_rate_hz = scan_rate_hz
+        self.rng = np.random.default_rng(seed)
+        self.sample = sample
+        self.block_template = None
+
+        self.calls = {}
+        self.driver_open = False
+        # perf_counter() time at which the running measurement was started, None when idle
+        self.measurement_started = None
+        self.nos = 0
+        self.nob = 0
+        self.pixel = 0
+        self.camcnt = 1
+        self.continuous = False
+        self.cont_pause_seconds = 0.0
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def measurement_duration(self):
+        """Time in seconds the board needs for all blocks of one measurement."""
+        if not self.scan_rate_hz:
+            return 0.0
+        return self.nos * self.nob / self.scan_rate_hz
+
+    def scan_times(self, scans):
+        """
+        perf_counter() acquisition times of the scans of the last completed measurement
+        (or measurement cycle in continuous mode), evenly spaced at scan_rate_hz.
+        """
+        if self.measurement_started is None or not self.scan_rate_hz:
+            return np.full(scans, time.perf_counter())
+        start = self.measurement_started
+        if self.continuous:
+            period = self.measurement_duration() + self.cont_pause_seconds
+            cycles = (time.perf_counter() - start) // period
+            if self.scans_done() < self.nos * self.nob:
+                # the running cycle is not complete, the last completed one is copied
+                cycles -= 1
+            start += max(cycles, 0) * period
+        return start + (np.arange(scans) + 1) / self.scan_rate_hz
+
+    def fill_block(self, out):
+        """Fill a (scans, pixel) uint16 array with one block of shots."""
+        if self.sample is not None:
+            times = self.scan_times(len(out)) if self.sample.delay_source is not None else None
+            self.sample.fill(out, self.rng, times)
+            return
+        # generate the noisy block once, so copying a block costs about as much as a DMA copy
+        if self.block_template is None or self.block_template.shape != out.shape:
+            self.block_template = self.rng.normal(10000, 100, out.shape).astype(np.uint16)
+            # pump-off and pump-on shots alternate (ON/OFF and ON/ON chopper words)
+            self.block_template[0::2, 2] = 32768
+            self.block_template[1::2, 2] = 49152
+        out[:] = self.block_template
+
+    def copy_into(self, out):
+        """
+        Fill out like a DMA copy. The board copies a block in a fraction of a millisecond, the simulated
+        data takes a few milliseconds more under a busy interpreter lock, so in continuous mode the board
+        clock stands still while the data is generated and the next cycle is not overwritten by that time.
+        """
+        start = time.perf_counter()
+        self.fill_block(out)
+        if self.continuous and self.measurement_started is not None:
+            self.measurement_started += time.perf_counter() - start
+
+    def scans_done(self):
+        """
+        Number of scans written to the DMA buffer since the measurement (or, in continuous mode,
+        the current measurement cycle) was started. Continuous mode needs a scan_rate_hz.
+        """
+        if self.measurement_started is None:
+            return 0
+        total = self.nos * self.nob
+        if not self.scan_rate_hz:
+            return total
+        elapsed = time.perf_counter() - self.measurement_started
+        if self.continuous:
+            elapsed %= self.measurement_duration() + self.cont_pause_seconds
+        return min(total, int(elapsed * self.scan_rate_hz))
+
+    """DLL functions"""
+
+    def DLLConvertErrorCodeToMsg(self, status):
+        return f"Simulated error {status}".encode()
+
+    def DLLInitDriver(self, ptr_number_of_boards):
+        self._count("DLLInitDriver")
+        time.sleep(self.init_driver_seconds)
+        ptr_number_of_boards.contents.value = 1
+        self.driver_open = True
+        return 0
+
+    def DLLInitBoard(self):
+        self._count("DLLInitBoard")
+        time.sleep(self.init_board_seconds)
+        return 0
+
+    def DLLSetGlobalSettings(self, settings):
+        self._count("DLLSetGlobalSettings")
+        self.nos = settings.nos
+        self.nob = settings.nob
+        self.pixel = settings.camera_settings[0].PIXEL
+        self.camcnt = settings.camera_settings[0].CAMCNT
+        self.continuous = bool(settings.contiuous_measurement)
+        self.cont_pause_seconds = settings.cont_pause_in_microseconds / 1e6
+        return 0
+
+    def DLLInitMeasurement(self):
+        self._count("DLLInitMeasurement")
+        time.sleep(self.init_measurement_seconds)
+        return 0
+
+    def DLLStartMeasurement_blocking(self):
+        self._count("DLLStartMeasurement_blocking")
+        self.measurement_started = time.perf_counter()
+        time.sleep(self.measurement_duration())
+        return 0
+
+    def DLLStartMeasurement_nonblocking(self):
+        self._count("DLLStartMeasurement_nonblocking")
+        self.measurement_started = time.perf_counter()
+        return 0
+
+    def DLLGetCurrentScanNumber(self, drvno, ptr_cur_sample, ptr_cur_block):
+        """Report the last written sample and block, -1 when nothing has been written yet."""
+        self._count("DLLGetCurrentScanNumber")
+        last = self.scans_done() - 1
+        if last < 0:
+            ptr_cur_sample.contents.value = -1
+            ptr_cur_block.contents.value = -1
+        else:
+            ptr_cur_sample.contents.value = last % self.nos
+            ptr_cur_block.contents.value = last // self.nos
+        return 0
+
+    def DLLAbortMeasurement(self, drvno):
+        self._count("DLLAbortMeasurement")
+        self.measurement_started = None
+        return 0
+
+    def DLLCopyOneBlock(self, drvno, block, ptr_block_buffer):
+        self._count("DLLCopyOneBlock")
+        block_buffer = np.ctypeslib.as_array(ptr_block_buffer.contents)
+        self.copy_into(block_buffer.reshape(-1, self.pixel))
+        return 0
+
+    def DLLCopyAllData(self, drvno, ptr_data_buffer):
+        self._count("DLLCopyAllData")
+        data_buffer = np.ctypeslib.as_array(ptr_data_buffer.contents)
+        self.copy_into(data_buffer.reshape(-1, self.pixel))
+        return 0
+
+    def DLLExitDriver(self):
+        self._count("DLLExitDriver")
+        time.sleep(self.exit_driver_seconds)
+        self.driver_open = False
+        return 0
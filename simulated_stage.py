@@ -0,0 +1,102 @@
+import threading
+import time
+import numpy as np
+
+class SimulatedDLS():
+    """
+    Stand-in for the Newport DLS command interface (CommandInterfaceDLS.DLS) for development without the stage.
+
+    It implements the commands IronPythonDLS.py and stage_sweep.py use, with the same return values:
+    tuples whose second element is the value for the getters, (result, error code, state) for TS().
+    Positions are in mm. Moves run at the set velocity on the perf_counter() clock, so the position
+    changes while the stage moves and TS() reports the moving state "28" until it arrives.
+    Every move is kept, so position_at() and delay_at() return where the stage was at earlier times;
+    pass delay_at to SimulatedTASample(delay_source=...) to link the simulated sample to the stage.
+    """
+
+    def __init__(self, position=100.0, reference=100.0, velocity=300.0, command_seconds=0.0, c=299792458):
+        self.reference = reference
+        self.velocity = velocity
+        # latency of a command over the serial connection, in seconds
+        self.command_seconds = command_seconds
+        self.to_mm = 10**-9 * c / 8
+        # moves as (start time, start position, end time, end position), the first one is the initial position
+        self.moves = [(0.0, position, 0.0, position)]
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def _command(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.command_seconds:
+            time.sleep(self.command_seconds)
+
+    def position_at(self, times):
+        """Stage position in mm at perf_counter() times (a scalar or an array)."""
+        with self.lock:
+            moves = np.array(self.moves)
+        times = np.asarray(times, dtype=np.float64)
+        move = np.maximum(np.searchsorted(moves[:, 0], times, side="right") - 1, 0)
+        start_time, start, end_time, end = moves[move].T
+        fraction = np.divide(times - start_time, end_time - start_time, out=np.ones(times.shape), where=end_time > start_time)
+        return start + (end - start) * np.clip(fraction, 0, 1)
+
+    def delay_at(self, times):
+        """Delay in ps relative to the reference position at perf_counter() times."""
+        return (self.position_at(times) - self.reference) / self.to_mm
+
+    def _move_to(self, target):
+        now = time.perf_counter()
+        position = float(self.position_at(now))
+        with self.lock:
+            self.moves.append((now, position, now + abs(target - position) / self.velocity, target))
+
+    def moving(self):
+        with self.lock:
+            return time.perf_counter() < self.moves[-1][2]
+
+    """DLS commands"""
+
+    def TS(self):
+        self._command("TS")
+        return (0, 0, "00000", "28" if self.moving() else "46")
+
+    def PA_Get(self):
+        self._command("PA_Get")
+        return (0, float(self.position_at(time.perf_counter())), "")
+
+    def PA_Set(self, position):
+        self._command("PA_Set")
+        self._move_to(position)
+        return 0
+
+    def PR_Set(self, displacement):
+        self._command("PR_Set")
+        self._move_to(float(self.position_at(time.perf_counter())) + displacement)
+        return 0
+
+    def RF_Get(self):
+        self._command("RF_Get")
+        return (0, self.reference, "")
+
+    def RF_Set(self, position):
+        self._command("RF_Set")
+        self.reference = position
+        return 0
+
+    def VA_Get(self):
+        self._command("VA_Get")
+        return (0, self.velocity, "")
+
+    def VA_Set(self, velocity):
+        self._command("VA_Set")
+        self.velocity = velocity
+        return 0
+
+    def ST(self):
+        """Stop the running move where the stage is now."""
+        self._command("ST")
+        now = time.perf_counter()
+        position = float(self.position_at(now))
+        with self.lock:
+            self.moves.append((now, position, now, position))
+        return 0
@@ -0,0 +1,177 @@
+"""
+Client for the IronPythonDLS.py command server.
+
+Starting ipy.exe, loading the Newport assembly and opening the COM port takes far longer than a stage
+command itself. StageClient starts IronPythonDLS.py once in "Serve" mode, keeps one connection to it
+and sends every command as a JSON line. The server is started by a background thread and the replies
+are read by another one and returned as futures, so neither the start nor a long command like
+MeasurementLoop blocks the caller.
+"""
+from concurrent.futures import Future
+import itertools
+import json
+import socket
+import subprocess
+import threading
+import time
+
+class StageClient():
+    """
+    Persistent connection to IronPythonDLS.py running as command server.
+
+    submit() returns a Future with the reply {"id", "status", "result", "output", "errors"}; output and
+    errors hold what the command printed, in the format a single-command ipy.exe process used to write.
+    Commands submitted while the server starts are sent once it accepts connections. When the server
+    cannot be started or reached, available() is False and the caller falls back to one process per command.
+    """
+
+    def __init__(self, executable, script, host='localhost', port=9998, start_timeout=30.0):
+        self.executable = executable
+        self.script = script
+        self.host = host
+        self.port = port
+        self.start_timeout = start_timeout
+        self.process = None
+        self.sock = None
+        self.failed = False
+        self.pending = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.reader = None
+        self.starter = None
+        # request lines submitted before the connection was made
+        self.waiting = []
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=1.0)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def start(self):
+        """Connect to a running server, or start one and wait until it accepts connections."""
+        if self.sock is not None:
+            return True
+        if self.failed:
+            return False
+        try:
+            sock = self._connect()
+        except OSError:
+            sock = None
+            try:
+                self.process = subprocess.Popen([self.executable, self.script, "Serve", str(self.port)])
+            except OSError as e:
+                print(f"Could not start the stage server: {e}")
+                self._fail()
+                return False
+            deadline = time.perf_counter() + self.start_timeout
+            while sock is None:
+                try:
+                    sock = self._connect()
+                except OSError:
+                    if self.process.poll() is not None or time.perf_counter() > deadline:
+                        print("Stage server did not start, falling back to one process per command.")
+                        self._fail()
+                        return False
+                    time.sleep(0.1)
+        with self.lock:
+            self.sock = sock
+            waiting, self.waiting = self.waiting, []
+            for line in waiting:
+                sock.sendall(line)
+        self.reader = threading.Thread(target=self._read_replies, daemon=True)
+        self.reader.start()
+        return True
+
+    def start_async(self):
+        """Run start() in a background thread, unless it runs already or the server is connected."""
+        with self.lock:
+            if self.sock is not None or self.failed or (self.starter is not None and self.starter.is_alive()):
+                return
+            self.starter = threading.Thread(target=self.start, daemon=True)
+            self.starter.start()
+
+    def _fail(self):
+        """The server cannot be started: fail the commands that wait for the connection."""
+        with self.lock:
+            self.failed = True
+            waiting, self.waiting = self.waiting, []
+            futures = [self.pending.pop(json.loads(line)["id"]) for line in waiting]
+        for future in futures:
+            future.set_exception(ConnectionError("Stage server is not available"))
+
+    def available(self):
+        """
+        False when the server could not be started. Starts it in the background if needed and returns
+        without waiting, so commands submitted meanwhile are sent once it accepts connections.
+        """
+        self.start_async()
+        return not self.failed
+
+    def submit(self, command):
+        """Send a command line, e.g. "MoveRelative 100", and return a Future for its reply."""
+        self.start_async()
+        future = Future()
+        with self.lock:
+            if self.failed:
+                raise ConnectionError("Stage server is not available")
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+            line = (json.dumps({"id": request_id, "command": command}) + "\n").encode()
+            if self.sock is None:
+                self.waiting.append(line)
+            else:
+                self.sock.sendall(line)
+        return future
+
+    def stop(self):
+        """End a running MeasurementLoop or FlyScan; the server answers Stop without waiting for the command."""
+        if self.sock is not None:
+            self.submit("Stop")
+
+    def command(self, command, timeout=None):
+        """Send a command and wait for its reply."""
+        return self.submit(command).result(timeout)
+
+    def _read_replies(self):
+        buffer = b""
+        sock = self.sock
+        try:
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                buffer += chunk
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    reply = json.loads(line.decode())
+                    with self.lock:
+                        future = self.pending.pop(reply.get("id"), None)
+                    if future is not None:
+                        future.set_result(reply)
+        except OSError:
+            pass
+        # the connection is gone: fail the commands that wait for a reply
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.sock is sock:
+                self.sock = None
+        for future in pending.values():
+            future.set_exception(ConnectionError("Connection to the stage server was closed"))
+
+    def close(self, shutdown=True):
+        """Close the connection; with shutdown, stop the server so the COM port is released."""
+        if self.sock is not None and shutdown:
+            try:
+                self.command("Shutdown", timeout=5.0)
+            except Exception as e:
+                print(f"Error stopping the stage server: {e}")
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            sock.close()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5.0)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+            self.process = None
@@ -0,0 +1,129 @@
+"""
+Framed binary messages between MeasurementWorker and the stage script IronPythonDLS.py.
+
+Every message is one frame: a header with the payload length (uint32) and the message type (uint8),
+followed by the payload. Numbers are little-endian, delays and positions are in ps.
+
+Messages:
+- MOVE_DONE (stage -> GUI):  index, delay, position; the stage reached delay point index
+- POSITION  (stage -> GUI):  position, reference; readback of the stage position, e.g. for StartGUI
+- ACQ_DONE  (GUI -> stage):  index; the camera finished the exposure of point index, the stage may move on
+- STOP      (GUI -> stage):  no payload; end the measurement loop
+- ERROR     (both ways):     utf-8 message text
+- PLAN      (GUI -> stage):  any number of delays; the sequence of a MeasurementLoop started as "MeasurementLoop plan"
+
+The GUI sends ACQ_DONE as soon as the shots of a point are read out, so the stage moves to the next
+point while the block is processed and plotted. Only the standard library is used, the module is
+imported by CPython and by IronPython.
+"""
+import struct
+
+MOVE_DONE = 1
+POSITION = 2
+ACQ_DONE = 3
+STOP = 4
+ERROR = 5
+PLAN = 6
+
+HEADER = struct.Struct("<IB")
+
+# payload layout of the messages with fixed fields
+PAYLOADS = {
+    MOVE_DONE: struct.Struct("<Idd"),
+    POSITION: struct.Struct("<dd"),
+    ACQ_DONE: struct.Struct("<I"),
+    STOP: struct.Struct("<"),
+}
+
+NAMES = {MOVE_DONE: "MOVE_DONE", POSITION: "POSITION", ACQ_DONE: "ACQ_DONE", STOP: "STOP", ERROR: "ERROR", PLAN: "PLAN"}
+
+def encode(message_type, *values):
+    """One frame of message_type with values, e.g. encode(MOVE_DONE, 3, 1.5, 2001.5) or encode(ERROR, "text")."""
+    if message_type == ERROR:
+        payload = str(values[0] if values else "").encode("utf-8")
+    elif message_type == PLAN:
+        payload = struct.pack(f"<{len(values)}d", *values)
+    elif message_type in PAYLOADS:
+        payload = PAYLOADS[message_type].pack(*values)
+    else:
+        raise ValueError(f"Unknown message type: {message_type}")
+    return HEADER.pack(len(payload), message_type) + payload
+
+def decode(message_type, payload):
+    """The values of a frame payload as a tuple; (text,) for ERROR, the delays for PLAN."""
+    if message_type == ERROR:
+        return (bytes(payload).decode("utf-8", "replace"),)
+    if message_type == PLAN:
+        return struct.unpack(f"<{len(payload) // 8}d", bytes(payload))
+    if message_type not in PAYLOADS:
+        raise ValueError(f"Unknown message type: {message_type}")
+    return PAYLOADS[message_type].unpack(bytes(payload))
+
+def send(sock, message_type, *values):
+    """Send one message; the frame goes out in a single sendall."""
+    sock.sendall(encode(message_type, *values))
+
+
+class FrameReader():
+    """
+    Splits a byte stream into messages.
+
+    Received bytes are added with feed() and complete messages are taken with next_message(), or
+    read() receives from sock until the next message is complete; poll() only takes what has already
+    arrived, for loops that must keep running while they wait. Messages that arrive together,
+    e.g. a MOVE_DONE sent while the previous block was processed, stay buffered until they are read.
+    """
+
+    def __init__(self, sock=None, chunk_size=4096):
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        # set when the other side closed the connection
+        self.closed = False
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_message(self):
+        """The next complete message as (message_type, values), or None when it is not complete yet."""
+        if len(self.buffer) < HEADER.size:
+            return None
+        length, message_type = HEADER.unpack_from(self.buffer)
+        end = HEADER.size + length
+        if len(self.buffer) < end:
+            return None
+        payload = self.buffer[HEADER.size:end]
+        del self.buffer[:end]
+        return message_type, decode(message_type, payload)
+
+    def read(self):
+        """Block until the next message, None when the connection is closed."""
+        message = self.next_message()
+        while message is None:
+            chunk = self.sock.recv(self.chunk_size)
+            if not chunk:
+                self.closed = True
+                return None
+            self.feed(chunk)
+            message = self.next_message()
+        return message
+
+    def poll(self):
+        """The next message if it has arrived, without waiting; None otherwise or when the connection is closed."""
+        message = self.next_message()
+        if message is not None or self.closed:
+            return message
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(0.0)
+        try:
+            chunk = self.sock.recv(self.chunk_size)
+        except OSError:
+            # nothing received yet
+            return None
+        finally:
+            self.sock.settimeout(timeout)
+        if not chunk:
+            self.closed = True
+            return None
+        self.feed(chunk)
+        return self.next_message()
@@ -0,0 +1,75 @@
+"""
+Stage side of a fly scan.
+
+Instead of stepping from delay point to delay point, the stage moves at constant velocity across the
+delay window while the camera acquires continuously. During every sweep the stage position is read back
+periodically and sent as POSITION messages; the GUI timestamps them on arrival and interpolates the
+delay of every shot (see fly_scan.py). The module only uses the standard library and the DLS command
+interface, so IronPythonDLS.py runs it with the Newport DLS and simulated_stage.SimulatedDLS runs it
+in CPython.
+
+Messages (see stage_protocol.py):
+- MOVE_DONE 0 when the stage is at the start of the window; the GUI starts the camera and answers ACQ_DONE 0
+- POSITION every interval seconds during a sweep and once when the stage has stopped
+- MOVE_DONE n at the end of sweep n (1, 2, ...); odd sweeps go from start to end, even sweeps back
+"""
+import time
+import stage_protocol
+
+# controller states in which the DLS is ready for a move (TS()[3])
+READY_STATES = ["46", "47", "48", "49"]
+
+def wait_ready(dls, interval=0.005):
+    while dls.TS()[3] not in READY_STATES:
+        time.sleep(interval)
+
+def run_fly_scan(dls, sock, start, end, velocity, sweeps=1, interval=0.01, c=299792458):
+    """
+    Sweep the stage sweeps times between the delays start and end (ps, relative to the reference
+    position) at velocity ps/s and stream its position over the connected socket sock.
+    The velocity of the controller is restored afterwards. Returns the number of finished sweeps.
+    """
+    frames = stage_protocol.FrameReader(sock)
+    to_mm = 10**-9 * c / 8
+    reference = dls.RF_Get()[1]
+    full_velocity = dls.VA_Get()[1]
+
+    def send_position():
+        position = dls.PA_Get()[1]
+        stage_protocol.send(sock, stage_protocol.POSITION, position / to_mm, reference / to_mm)
+        return (position - reference) / to_mm
+
+    finished = 0
+    try:
+        # go to the start of the window at full velocity and wait until the camera runs
+        wait_ready(dls)
+        dls.PA_Set(reference + start * to_mm)
+        wait_ready(dls)
+        stage_protocol.send(sock, stage_protocol.MOVE_DONE, 0, start, dls.PA_Get()[1] / to_mm)
+        message = frames.read()
+        if message is None or message[0] != stage_protocol.ACQ_DONE:
+            print("Fly scan cancelled before the first sweep")
+            return finished
+
+        dls.VA_Set(velocity * to_mm)
+        for sweep in range(1, sweeps + 1):
+            target = end if sweep % 2 == 1 else start
+            dls.PA_Set(reference + target * to_mm)
+            while True:
+                # the state is read before the position, so the last readback is taken at rest
+                moving = dls.TS()[3] not in READY_STATES
+                delay = send_position()
+                if not moving:
+                    break
+                message = frames.poll()
+                if frames.closed or (message is not None and message[0] in (stage_protocol.STOP, stage_protocol.ERROR)):
+                    dls.ST()
+                    print("Stopping fly scan")
+                    return finished
+                time.sleep(interval)
+            stage_protocol.send(sock, stage_protocol.MOVE_DONE, sweep, target, delay)
+            finished = sweep
+            print(f"Sweep {sweep} done at {delay} ps")
+    finally:
+        dls.VA_Set(full_velocity)
+    return finished
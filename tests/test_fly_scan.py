@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from camera import CameraBlock
+from fly_scan import FlyScanBinner, bin_edges, sweep_range, sweep_velocity
+
+
+def block(shots, first=0):
+    """A block whose pixel holds the shot number, with a regular pump-off/pump-on chopper."""
+    chopper = np.tile(np.array([32768, 49152], dtype=np.uint16), shots // 2)
+    pixels = np.arange(first, first + shots, dtype=np.uint16)[:, None]
+    return CameraBlock(chopper, pixels)
+
+
+def test_bin_edges():
+    np.testing.assert_allclose(bin_edges([2.0, 0.0, 1.0, 3.0]), [-0.5, 0.5, 1.5, 2.5, 3.5])
+    with pytest.raises(ValueError):
+        bin_edges([1.0])
+
+
+def test_sweep_velocity():
+    # bins of 1 ps collect 100 shots at 1 kHz when the stage moves 10 ps/s
+    assert sweep_velocity([0.0, 1.0, 2.0], 100, 1000.0) == pytest.approx(10.0)
+
+
+def test_sweep_range_is_clamped_to_the_travel():
+    assert sweep_range([0.0, 1.0, 2.0], -100.0, 100.0) == (-0.5, 2.5)
+    assert sweep_range([0.0, 1.0, 2.0], 0.0, 2.0) == (0.0, 2.0)
+    with pytest.raises(ValueError):
+        sweep_range([0.0, 1.0, 3.0], 0.0, 2.0)
+
+
+def test_binner_cuts_blocks_at_the_bin_edges():
+    binner = FlyScanBinner([0.0, 1.0, 2.0])
+    # 24 shots sweeping from -0.5 to 2.5 ps: 8 shots per bin, delivered in blocks that straddle the edges
+    delays = np.linspace(-0.5, 2.5, 24, endpoint=False)
+    completed = binner.add(block(10), delays[:10])
+    completed += binner.add(block(14, 10), delays[10:])
+    completed += binner.flush()
+    assert [delay for delay, _ in completed] == [0.0, 1.0, 2.0]
+    for index, (_, binned) in enumerate(completed):
+        np.testing.assert_array_equal(binned.pixels[:, 0], np.arange(8 * index, 8 * index + 8))
+        assert list(binned.chopper[:2]) == [32768, 49152]
+
+
+def test_binner_keeps_pairs_together():
+    binner = FlyScanBinner([0.0, 1.0])
+    # the edge at 0.5 ps falls between the two shots of the pair 2-3: the pair goes to the first bin
+    delays = np.array([0.0, 0.2, 0.4, 0.6, 0.8, 1.0])
+    completed = binner.add(block(6), delays) + binner.flush()
+    assert [len(binned) for _, binned in completed] == [4, 2]
+
+
+def test_binner_drops_shots_outside_the_grid_and_without_delay():
+    binner = FlyScanBinner([0.0, 1.0])
+    delays = np.array([-2.0, -2.0, np.nan, np.nan, 0.0, 0.0, 3.0, 3.0])
+    completed = binner.add(block(8), delays) + binner.flush()
+    assert len(completed) == 1
+    delay, binned = completed[0]
+    assert delay == 0.0
+    np.testing.assert_array_equal(binned.pixels[:, 0], [4, 5])
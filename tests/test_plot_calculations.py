@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from block_pool import BlockProcessingPool
+from camera import CameraBlock
+from Plot_Calculations import ComputeData
+
+
+def processor(mode, **settings):
+    data_processor = ComputeData()
+    data_processor.rejection_mode = mode
+    for name, value in settings.items():
+        assert hasattr(data_processor, name), name
+        setattr(data_processor, name, value)
+    return data_processor
+
+
+def test_uint16_row_means_are_not_truncated():
+    # the ROI means are 10.5, 100.5 and 40.5 counts; truncated to uint16 they were 10, 100 and 40
+    block = np.array([[10, 11], [100, 101], [40, 41]], dtype=np.uint16)
+    data_processor = processor("percentage", range_start_probe=0, range_end_probe=2)
+    data_processor.OutlierRejection_probe(block)
+    means = np.array([10.5, 100.5, 40.5])
+    expected = np.sort(np.abs(means - means.mean()) / means.mean() * 100)
+    np.testing.assert_allclose(data_processor.probe_sweep.deviations, expected)
+
+
+@pytest.mark.parametrize("mode", ["mad", "sigma_clip"])
+def test_uint16_and_float_blocks_reject_the_same_shots(mode):
+    rng = np.random.default_rng(2)
+    block = rng.normal(3000, 30, (400, 8)).round().astype(np.uint16)
+    block[::50] += 900
+    kept = [processor(mode, range_start_probe=0, range_end_probe=8).OutlierRejection_probe(values)
+            for values in (block, block.astype(np.float32))]
+    assert len(kept[0]) == len(kept[1]) == 392
+
+
+def simulated_block(scans=2000, pixels=64, seed=3):
+    """Alternating pump-off/pump-on shots with a few saturated pixels."""
+    rng = np.random.default_rng(seed)
+    chopper = np.tile(np.array([32768, 49152], dtype=np.uint16), scans // 2)
+    counts = rng.normal(20000, 100, (scans, pixels))
+    counts[1::2] *= 0.99
+    counts[rng.integers(0, scans, 20), rng.integers(0, pixels, 20)] = 65535
+    return CameraBlock(chopper, counts.astype(np.uint16))
+
+
+def test_pixel_clip_averages_without_statistics():
+    spectra = []
+    for collect_statistics in (True, False):
+        data_processor = processor("pixel_clip", outlier_rejection_probe=True, outlier_rejection_dA=True,
+                                   range_start_probe=0, range_end_probe=64, range_start_dA=0, range_end_dA=64,
+                                   collect_statistics=collect_statistics)
+        probe, delta_A = data_processor.compute_spectra(simulated_block())
+        spectra.append((probe.copy(), delta_A.copy()))
+    np.testing.assert_allclose(spectra[0][0], spectra[1][0], rtol=1e-9)
+    np.testing.assert_allclose(spectra[0][1], spectra[1][1], rtol=1e-6)
+    # the saturated pixels are clipped, so the dA stays near -log(0.99)
+    np.testing.assert_allclose(spectra[1][1], -np.log(0.99), atol=0.003)
+
+
+def four_state_block(cycles=500, pixels=8):
+    """
+    Repeating OFF/OFF, OFF/ON, ON/OFF, ON/ON shots: a dark level of 100 counts, 50 counts of pump scatter,
+    10000 counts of probe and a sample that transmits 90 % of the probe while pumped.
+    """
+    chopper = np.tile(np.array([0, 16384, 32768, 49152], dtype=np.uint16), cycles)
+    counts = np.tile(np.array([100.0, 150.0, 10100.0, 9150.0])[:, None], (cycles, pixels))
+    return CameraBlock(chopper, counts.astype(np.uint16))
+
+
+def test_four_state_decoding_corrects_dark_and_scatter():
+    data_processor = processor("percentage", chopper_decoding="four-state")
+    probe, delta_A = data_processor.compute_spectra(four_state_block())
+    assert data_processor.state_counts == {"OFF/OFF": 500, "OFF/ON": 500, "ON/OFF": 500, "ON/ON": 500}
+    np.testing.assert_allclose(delta_A, -np.log(9000 / 10000), rtol=1e-5)
+    np.testing.assert_allclose(probe, 10000, rtol=1e-6)
+
+
+def test_two_state_decoding_sees_only_the_pump_state():
+    data_processor = processor("percentage", chopper_decoding="two-state")
+    _, delta_A = data_processor.compute_spectra(four_state_block())
+    # ON/ON shots against the neighbouring ON/OFF shots, without the dark and scatter correction
+    np.testing.assert_allclose(delta_A, -np.log(9150 / 10100), rtol=1e-5)
+
+
+def test_log_table_matches_division_and_log():
+    block = simulated_block()
+    dark = np.linspace(395, 405, 64)
+    spectra = [processor("percentage", use_log_table=use_log_table, dark_noise_correction=dark).compute_spectra(block)[1]
+               for use_log_table in (False, True)]
+    # the table rounds the dark correction to whole counts
+    np.testing.assert_allclose(spectra[1], spectra[0], atol=1e-5)
+
+
+def test_pool_uses_the_backgrounds_and_reference_of_the_whole_block():
+    # the dark level and the probe drift over the block, so averages over a chunk differ from the whole block
+    block = four_state_block(cycles=400)
+    drift = np.repeat(np.linspace(0, 400, 400), 4)[:, None]
+    block = CameraBlock(block.chopper, (block.pixels + drift).astype(np.uint16))
+    expected = processor("off", chopper_decoding="four-state", reference_mode="block")
+    expected.compute_spectra(block)
+    data_processor = processor("off", chopper_decoding="four-state", reference_mode="block", parallel_min_scans=0)
+    with BlockProcessingPool(workers=2) as pool:
+        data_processor.process_pool = pool
+        probe, delta_A = data_processor.compute_spectra(block)
+    np.testing.assert_allclose(delta_A, expected.delta_A, rtol=1e-5)
+    np.testing.assert_allclose(probe, expected.probe_spectrum, rtol=1e-6)
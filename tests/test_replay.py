@@ -0,0 +1,44 @@
+import numpy as np
+
+from camera import PixelWindow
+from raw_archive import RawShotRecorder
+from replay import replay
+from scan_planner import plan_scans
+from Plot_Calculations import ComputeData
+from timing import Timings
+from WorkerThread import MeasurementWorker
+
+DELAYS = [0.0, 1.0, 2.0, 5.0, 10.0, 20.0]
+
+
+def raw_block(level, shots=200, pixel_window=PixelWindow()):
+    """Alternating pump-off/pump-on raw scans with level probe counts in every active pixel."""
+    raw = np.zeros((shots, pixel_window.end_pixel + 4), dtype=np.uint16)
+    raw[:, pixel_window.chopper_pixel] = np.tile([32768, 49152], shots // 2)
+    raw[:, pixel_window.start_pixel:pixel_window.end_pixel] = level
+    return pixel_window.crop(raw)
+
+
+def test_replay_rebuilds_the_grid_of_a_shuffled_plan(tmp_path):
+    worker = MeasurementWorker(DELAYS, "Random", 200, 2)
+    worker.content = DELAYS
+    worker.data_processor = ComputeData()
+    worker.timings = Timings()
+    worker.delay_statistics = {}
+    worker.teller = 0
+    worker.raw_recorder = RawShotRecorder(str(tmp_path / "archive"))
+    plan = plan_scans(DELAYS, "Random", 2, rng=np.random.default_rng(1))
+    assert plan[0] != DELAYS
+    for scan, scan_delays in enumerate(plan, start=1):
+        worker.scans = scan
+        worker.averaged_probe_measurement = []
+        for delay in scan_delays:
+            # the probe level tells the delay point apart
+            worker.process_point(delay, raw_block(1000 + 100 * DELAYS.index(delay)))
+    worker.raw_recorder.close()
+
+    result = replay(str(tmp_path / "archive"), workers=0)
+    np.testing.assert_array_equal(result.delays, DELAYS)
+    expected = 1000 + 100 * np.arange(len(DELAYS))
+    for scan in range(2):
+        np.testing.assert_allclose(result.probe[scan, :, 0], expected)
@@ -0,0 +1,103 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from running_stats import ChunkSums, RunningStats
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    return rng.normal(1000.0, 25.0, (1000, 16))
+
+
+def test_update_matches_numpy(rows):
+    stats = RunningStats(ignore_nan=False, chunk_rows=64).update(rows)
+    assert len(stats) == len(rows)
+    np.testing.assert_allclose(stats.mean, rows.mean(axis=0))
+    np.testing.assert_allclose(stats.variance, rows.var(axis=0, ddof=1))
+    np.testing.assert_allclose(stats.sem, rows.std(axis=0, ddof=1) / np.sqrt(len(rows)))
+
+
+def test_merge_equals_one_update(rows):
+    merged = RunningStats().update(rows[:300]).merge(RunningStats().update(rows[300:]))
+    whole = RunningStats().update(rows)
+    np.testing.assert_allclose(merged.mean, whole.mean)
+    np.testing.assert_allclose(merged.variance, whole.variance)
+
+
+def test_merge_into_empty_and_with_empty(rows):
+    stats = RunningStats().merge(RunningStats().update(rows))
+    stats.merge(RunningStats())
+    np.testing.assert_allclose(stats.mean, rows.mean(axis=0))
+
+
+def test_large_offset_keeps_the_variance():
+    # float32 counts far from zero: the shifted sums must not cancel
+    rows = (60000.0 + np.tile([0.0, 1.0], 500)[:, None] * np.ones((1, 4))).astype(np.float32)
+    stats = RunningStats(ignore_nan=False).update(rows)
+    np.testing.assert_allclose(stats.variance, np.var(rows.astype(np.float64), axis=0, ddof=1), rtol=1e-6)
+
+
+def test_ignore_nan_skips_values_per_pixel(rows):
+    masked = rows.copy()
+    masked[::3, 0] = np.nan
+    stats = RunningStats(ignore_nan=True).update(masked)
+    assert stats.count[0] == np.count_nonzero(~np.isnan(masked[:, 0]))
+    np.testing.assert_allclose(stats.mean, np.nanmean(masked, axis=0))
+    np.testing.assert_allclose(stats.variance, np.nanvar(masked, axis=0, ddof=1))
+
+
+def test_nan_propagates_without_ignore_nan(rows):
+    masked = rows.copy()
+    masked[5, 2] = np.nan
+    stats = RunningStats(ignore_nan=False).update(masked)
+    assert np.isnan(stats.mean[2])
+    assert np.isfinite(np.delete(stats.mean, 2)).all()
+
+
+def test_too_few_values_give_nan():
+    stats = RunningStats(width=3)
+    assert len(stats) == 0
+    assert np.isnan(stats.mean).all()
+    stats.update(np.array([1.0, 2.0, 3.0]))
+    np.testing.assert_array_equal(stats.mean, [1.0, 2.0, 3.0])
+    assert np.isnan(stats.variance).all()
+
+
+def test_state_round_trip_and_pickle(rows):
+    stats = RunningStats().update(rows)
+    restored = RunningStats.from_state(stats.state())
+    np.testing.assert_array_equal(restored.mean, stats.mean)
+    unpickled = pickle.loads(pickle.dumps(stats))
+    np.testing.assert_array_equal(unpickled.variance, stats.variance)
+
+
+@pytest.mark.parametrize("shifted", [True, False])
+def test_chunk_sums_match_update(rows, shifted):
+    counts = rows.astype(np.float32)
+    sums = ChunkSums(ignore_nan=False, shifted=shifted)
+    work = np.empty((64, counts.shape[1]), dtype=np.float32)
+    for first in range(0, len(counts), 64):
+        chunk = counts[first:first + 64]
+        sums.add(chunk, work[:len(chunk)])
+    stats = sums.stats()
+    np.testing.assert_allclose(stats.mean, counts.mean(axis=0, dtype=np.float64), rtol=1e-6)
+    np.testing.assert_allclose(stats.variance, counts.var(axis=0, ddof=1, dtype=np.float64), rtol=1e-6 if shifted else 1e-3)
+
+
+def test_chunk_sums_skip_nan_per_pixel(rows):
+    masked = rows.astype(np.float32)
+    masked[::3, 0] = np.nan
+    sums = ChunkSums(ignore_nan=True)
+    for first in range(0, len(masked), 100):
+        sums.add(masked[first:first + 100])
+    stats = sums.stats()
+    assert stats.count[0] == np.count_nonzero(~np.isnan(masked[:, 0]))
+    np.testing.assert_allclose(stats.mean, np.nanmean(masked.astype(np.float64), axis=0), rtol=1e-6)
+    np.testing.assert_allclose(stats.variance, np.nanvar(masked.astype(np.float64), axis=0, ddof=1), rtol=1e-4)
+
+
+def test_chunk_sums_without_values():
+    assert ChunkSums().stats().count is None
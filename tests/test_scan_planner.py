@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from scan_planner import ORDERS, compare_orders, interleaved_order, motion_time, plan_scans, plan_travel
+
+DELAYS = [0.0, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0]
+
+
+@pytest.mark.parametrize("order", ORDERS)
+def test_every_scan_measures_every_delay_once(order):
+    plan = plan_scans(DELAYS, order, 3, start=0.0, rng=np.random.default_rng(5))
+    assert len(plan) == 3
+    for scan_delays in plan:
+        assert sorted(scan_delays) == DELAYS
+
+
+def test_fixed_orders():
+    assert plan_scans(DELAYS, "Regular", 2) == [DELAYS, DELAYS]
+    assert plan_scans(DELAYS, "Backwards", 1) == [DELAYS[::-1]]
+    assert plan_scans(DELAYS, "Serpentine", 3) == [DELAYS, DELAYS[::-1], DELAYS]
+
+
+def test_unknown_order():
+    with pytest.raises(ValueError):
+        plan_scans(DELAYS, "Sideways", 1)
+
+
+def test_random_orders_are_reproducible_with_a_seed():
+    for order in ("Random", "Random (min. travel)"):
+        first = plan_scans(DELAYS, order, 4, rng=np.random.default_rng(6))
+        second = plan_scans(DELAYS, order, 4, rng=np.random.default_rng(6))
+        assert first == second
+
+
+def test_interleaved_order_starts_at_the_nearest_end():
+    rng = np.random.default_rng(7)
+    order = interleaved_order(DELAYS, 2, rng, position=100.0)
+    assert order[0] in (100.0, 50.0)
+    assert order == sorted(order[:4], reverse=True) + sorted(order[4:])
+
+
+def test_plan_travel():
+    assert plan_travel([[0.0, 10.0], [10.0, 0.0]]) == 20.0
+    assert plan_travel([[0.0, 10.0]], start=5.0) == 15.0
+
+
+def test_serpentine_and_min_travel_travel_less_than_random():
+    rng = np.random.default_rng(8)
+    delays = np.linspace(0, 1000, 51)
+    comparison = compare_orders(delays, 6, start=0.0, rng=rng)
+    assert comparison["Serpentine"][0] == pytest.approx(6 * 1000)
+    assert comparison["Random (min. travel)"][0] < comparison["Random"][0] / 3
+    assert comparison["Serpentine"][0] < comparison["Regular"][0]
+
+
+def test_motion_time():
+    # 1 ps of delay is 0.0375 mm: a short move at 1000 mm/s^2 does not reach 300 mm/s
+    plan = [[1.0]]
+    distance = 1.0 * 10**-9 * 299792458 / 8
+    assert motion_time(plan, start=0.0) == pytest.approx(2 * np.sqrt(distance / 1000.0))
+    assert motion_time(plan, start=0.0, settle_seconds=0.1) == pytest.approx(2 * np.sqrt(distance / 1000.0) + 0.1)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from shot_pairing import adjacent_pairs, interpolated_reference, interpolation_weights
+
+
+def reference_pairs(pump_on):
+    """adjacent_pairs() written as the loop it replaces."""
+    off_rank = np.cumsum(~np.asarray(pump_on)) - 1
+    on_rank = np.cumsum(pump_on) - 1
+    off_rows, on_rows = [], []
+    shot = 0
+    while shot < len(pump_on) - 1:
+        if pump_on[shot] != pump_on[shot + 1]:
+            off, on = (shot + 1, shot) if pump_on[shot] else (shot, shot + 1)
+            off_rows.append(off_rank[off])
+            on_rows.append(on_rank[on])
+            shot += 2
+        else:
+            shot += 1
+    return off_rows, on_rows
+
+
+def test_regular_chopper_pairs_every_shot():
+    off_rows, on_rows = adjacent_pairs([False, True] * 4)
+    np.testing.assert_array_equal(off_rows, [0, 1, 2, 3])
+    np.testing.assert_array_equal(on_rows, [0, 1, 2, 3])
+
+
+def test_orphan_shots_are_dropped():
+    # the third shot (pump-off) follows a pump-off shot and has no pump-on neighbour left
+    off_rows, on_rows = adjacent_pairs([False, True, False, False, True])
+    np.testing.assert_array_equal(off_rows, [0, 2])
+    np.testing.assert_array_equal(on_rows, [0, 1])
+
+
+def test_matches_the_loop_on_random_patterns():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        pump_on = rng.random(rng.integers(0, 40)) < 0.5
+        off_rows, on_rows = adjacent_pairs(pump_on)
+        expected_off, expected_on = reference_pairs(pump_on)
+        np.testing.assert_array_equal(off_rows, expected_off)
+        np.testing.assert_array_equal(on_rows, expected_on)
+
+
+def test_short_blocks_have_no_pairs():
+    for pump_on in ([], [True]):
+        off_rows, on_rows = adjacent_pairs(pump_on)
+        assert len(off_rows) == len(on_rows) == 0
+
+
+def test_interpolation_weights():
+    # pump-off shots at 0, 3 and 5; pump-on shots at 1, 2, 4 and 6
+    pump_on = [False, True, True, False, True, False, True]
+    previous_rows, next_rows, next_weight = interpolation_weights(pump_on)
+    np.testing.assert_array_equal(previous_rows, [0, 0, 1, 2])
+    np.testing.assert_array_equal(next_rows, [1, 1, 2, 2])
+    np.testing.assert_allclose(next_weight, [1 / 3, 2 / 3, 0.5, 0.0], rtol=1e-6)
+
+
+def test_interpolation_needs_pump_off_shots():
+    assert interpolation_weights([True, True]) is None
+
+
+def test_interpolated_reference():
+    pump_on = [False, True, False]
+    pump_off_rows = np.array([[10.0, 20.0], [30.0, 40.0]], dtype=np.float32)
+    reference = interpolated_reference(pump_off_rows, *interpolation_weights(pump_on))
+    np.testing.assert_allclose(reference, [[20.0, 30.0]])
@@ -0,0 +1,54 @@
+import socket
+
+import pytest
+
+import stage_protocol
+from stage_protocol import ACQ_DONE, ERROR, MOVE_DONE, PLAN, POSITION, STOP, FrameReader, encode
+
+
+def test_round_trip_of_every_message():
+    messages = [(MOVE_DONE, (3, 1.5, 2001.5)), (POSITION, (2001.5, 2000.0)), (ACQ_DONE, (7,)),
+                (STOP, ()), (ERROR, ("Stage error: ä",)), (PLAN, (0.0, -1.5, 250.25))]
+    reader = FrameReader()
+    reader.feed(b"".join(encode(message_type, *values) for message_type, values in messages))
+    for message in messages:
+        assert reader.next_message() == message
+    assert reader.next_message() is None
+
+
+def test_partial_frames_wait_for_the_rest():
+    frame = encode(MOVE_DONE, 1, 2.0, 3.0)
+    reader = FrameReader()
+    for byte in frame[:-1]:
+        reader.feed(bytes([byte]))
+        assert reader.next_message() is None
+    reader.feed(frame[-1:])
+    assert reader.next_message() == (MOVE_DONE, (1, 2.0, 3.0))
+
+
+def test_unknown_message_type():
+    with pytest.raises(ValueError):
+        encode(99)
+
+
+def test_large_plan():
+    delays = tuple(float(delay) for delay in range(20000))
+    reader = FrameReader()
+    reader.feed(encode(PLAN, *delays))
+    assert reader.next_message() == (PLAN, delays)
+
+
+def test_read_and_poll_on_a_socket():
+    left, right = socket.socketpair()
+    try:
+        reader = FrameReader(right, chunk_size=5)
+        assert reader.poll() is None
+        stage_protocol.send(left, ACQ_DONE, 1)
+        stage_protocol.send(left, ERROR, "done")
+        assert reader.read() == (ACQ_DONE, (1,))
+        assert reader.read() == (ERROR, ("done",))
+        left.close()
+        assert reader.read() is None
+        assert reader.closed
+    finally:
+        right.close()
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from Plot_Calculations import ComputeData
+from threshold_sweep import ThresholdSweep
+
+
+def test_rejected_and_threshold_for():
+    sweep = ThresholdSweep(np.arange(1, 11, dtype=float))
+    np.testing.assert_allclose(sweep.rejected([0, 5, 10]), [100, 50, 0])
+    assert sweep.threshold_for(20) == 8
+    assert sweep.rejected(sweep.threshold_for(20)) <= 20
+
+
+def test_percentage_threshold_of_100_turns_rejection_off():
+    assert ThresholdSweep([150.0, 200.0], "percentage").rejected(100) == 0
+    assert ThresholdSweep([150.0, 200.0], "mad").rejected(100) == 100
+
+
+def test_threshold_follows_the_mode():
+    assert ThresholdSweep([], "percentage").threshold(2.5, 5.0) == 2.5
+    assert ThresholdSweep([], "mad").threshold(2.5, 5.0) == 5.0
+    assert ThresholdSweep([], "sigma_clip").threshold(2.5, 5.0) == 5.0
+
+
+def test_merge():
+    merged = ThresholdSweep.merge([ThresholdSweep([3.0, 1.0], "mad"), ThresholdSweep([2.0], "mad")])
+    np.testing.assert_array_equal(merged.deviations, [1.0, 2.0, 3.0])
+    assert merged.mode == "mad"
+    assert ThresholdSweep.merge([ThresholdSweep([1.0]), None]) is None
+
+
+@pytest.mark.parametrize("mode", ["percentage", "mad"])
+def test_preview_matches_the_rejection(mode):
+    # the preview of the threshold of the active mode is what the rejection of the block removes;
+    # the percent spinbox value previewed in standard deviations was not
+    rng = np.random.default_rng(4)
+    block = rng.normal(1000, 10, (1000, 4))
+    block[::40] += 200
+    data_processor = ComputeData()
+    data_processor.rejection_mode = mode
+    data_processor.range_start_probe, data_processor.range_end_probe = 0, 4
+    data_processor.deviation_threshold_probe = 5.0
+    data_processor.robust_threshold_probe = 4.0
+    data_processor.OutlierRejection_probe(block)
+    sweep = data_processor.probe_sweep
+    preview = sweep.rejected(sweep.threshold(data_processor.deviation_threshold_probe, data_processor.robust_threshold_probe))
+    assert data_processor.rejected_probe == pytest.approx(2.5)
+    assert float(preview) == pytest.approx(data_processor.rejected_probe)
@@ -0,0 +1,55 @@
+import numpy as np
+import pyqtgraph as pg
+from PySide6.QtWidgets import QWidget, QGridLayout, QLabel, QLineEdit
+
+class ThresholdPreview(QWidget):
+    """
+    Histogram of the shot deviations of the latest block with the active threshold as a red line,
+    and the percentage of its shots that threshold rejects. Shared by the probe and dA windows.
+
+    The windows pass the threshold of the rejection mode of the sweep (see ThresholdSweep.threshold()),
+    so the line and the percentage are in the unit of the deviations: % or standard deviations.
+    """
+
+    AXIS_LABELS = {"percentage": "Deviation (%)", "mad": "Deviation (σ)", "sigma_clip": "Deviation (σ)"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.threshold_sweep = None
+        layout = QGridLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.sweep_plot = pg.PlotWidget()
+        self.sweep_plot.setMaximumHeight(150)
+        self.sweep_plot.setLabel('bottom', "Deviation")
+        self.sweep_plot.setLabel('left', "Shots")
+        self.sweep_histogram = self.sweep_plot.plot([0, 1], [0], stepMode="center", fillLevel=0, brush=(100, 100, 255, 120))
+        self.sweep_threshold_line = pg.InfiniteLine(angle=90, pen='r')
+        self.sweep_plot.addItem(self.sweep_threshold_line)
+        layout.addWidget(self.sweep_plot, 0, 0, 1, 3)
+
+        self.preview_label = QLabel("Rejected at this threshold (%)")
+        self.preview_value = QLineEdit()
+        self.preview_value.setPlaceholderText("--")
+        self.preview_value.setReadOnly(True)
+        layout.addWidget(self.preview_label, 1, 0, 1, 2)
+        layout.addWidget(self.preview_value, 1, 2)
+        self.setLayout(layout)
+
+    def update_sweep(self, sweep, threshold: float) -> None:
+        """Draw the deviation histogram of the latest block and show what threshold rejects of it."""
+        self.threshold_sweep = sweep
+        if sweep is None or len(sweep) == 0:
+            self.sweep_histogram.setData([0, 1], [0])
+            self.preview_value.clear()
+            return
+        self.sweep_plot.setLabel('bottom', self.AXIS_LABELS.get(sweep.mode, "Deviation"))
+        counts, edges = sweep.histogram(upper=max(2 * np.percentile(sweep.deviations, 99), threshold * 1.1))
+        self.sweep_histogram.setData(edges, counts)
+        self.update_threshold(threshold)
+
+    def update_threshold(self, threshold: float) -> None:
+        """Move the threshold line and show the percentage of shots of the latest block it rejects."""
+        self.sweep_threshold_line.setValue(threshold)
+        if self.threshold_sweep is not None and len(self.threshold_sweep):
+            self.preview_value.setText(f"{float(self.threshold_sweep.rejected(threshold)):.1f}")
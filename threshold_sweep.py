@@ -0,0 +1,70 @@
+"""
+Preview of the outlier rejection for every threshold at once.
+
+ComputeData stores the deviation of every shot (or shot pair) of a block in the unit of the threshold
+of its rejection mode: percent of the block mean for "percentage", scaled MADs for "mad" and
+"sigma_clip". A shot is rejected when its deviation is larger than the threshold, so with the
+deviations sorted once, the rejected percentage of any number of thresholds is one searchsorted.
+"""
+import numpy as np
+
+class ThresholdSweep():
+    """
+    Sorted per-shot deviations of one block and the rejected percentages they imply.
+
+    For "sigma_clip" the deviations are scaled MADs of the first pass, which the clipped standard
+    deviation approaches for normal distributed shots; the preview is then an approximation.
+    """
+
+    def __init__(self, deviations, mode="percentage"):
+        self.deviations = np.sort(np.asarray(deviations, dtype=np.float64).ravel())
+        self.mode = mode
+
+    def __len__(self):
+        return len(self.deviations)
+
+    def threshold(self, deviation_threshold, robust_threshold):
+        """
+        The threshold the rejection applies to these deviations: deviation_threshold (%) for "percentage",
+        robust_threshold (standard deviations) for "mad" and "sigma_clip".
+        """
+        return deviation_threshold if self.mode == "percentage" else robust_threshold
+
+    def rejected(self, thresholds):
+        """Percentage of shots that are rejected at each of thresholds (a scalar or an array)."""
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        if len(self.deviations) == 0:
+            return np.zeros(thresholds.shape)
+        kept = np.searchsorted(self.deviations, thresholds, side="right")
+        rejected = (len(self.deviations) - kept) / len(self.deviations) * 100
+        if self.mode == "percentage":
+            # a threshold of 100 % or more turns the percentage rejection off
+            rejected = np.where(thresholds >= 100, 0.0, rejected)
+        return rejected
+
+    def threshold_for(self, percent):
+        """The smallest threshold that rejects at most percent of the shots."""
+        if len(self.deviations) == 0:
+            return 0.0
+        kept = int(np.ceil(len(self.deviations) * (1 - percent / 100)))
+        return float(self.deviations[max(kept, 1) - 1])
+
+    def histogram(self, bins=50, upper=None):
+        """
+        Counts and bin edges of the deviations from 0 to upper, for drawing.
+        upper defaults to twice the 99th percentile, so single large outliers do not squeeze the plot.
+        Larger deviations are counted in the last bin.
+        """
+        if upper is None:
+            upper = 2 * np.percentile(self.deviations, 99) if len(self.deviations) else 1.0
+        upper = upper if np.isfinite(upper) and upper > 0 else 1.0
+        edges = np.linspace(0, upper, bins + 1)
+        counts = np.histogram(np.minimum(self.deviations, upper), bins=edges)[0]
+        return counts, edges
+
+    @classmethod
+    def merge(cls, sweeps):
+        """One sweep of the shots of several blocks or chunks, None when a sweep is missing."""
+        if not sweeps or any(sweep is None for sweep in sweeps):
+            return None
+        return cls(np.concatenate([sweep.deviations for sweep in sweeps]), sweeps[0].mode)
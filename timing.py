@@ -0,0 +1,109 @@
+import csv
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+# Log-spaced histogram bin edges in seconds, from 10 µs to 100 s
+HISTOGRAM_EDGES = np.logspace(-5, 2, 29)
+
+class Timings():
+    """
+    Lightweight timing of the acquisition phases.
+
+    Every phase is measured as a span on the monotonic perf_counter() clock:
+
+        with timings.span("compute_spectra"):
+            data_processor.compute_spectra(block)
+
+    The last `history` durations of every span are kept for rolling statistics and histograms.
+    All durations since the last end_scan() are summarised per scan, so the time per delay point
+    can be split into camera, processing, GUI and stage time after a measurement.
+    Spans can be recorded from several threads. Every worker thread owns one instance and passes it
+    to its CameraSession and ComputeData, so resetting the timings of a measurement leaves the live view's alone.
+    """
+
+    def __init__(self, history=1000, enabled=True):
+        self.history = history
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded spans and scan summaries."""
+        with self.lock:
+            self.recent = {}
+            self.current_scan = {}
+            self.scan_summaries = []
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block as one span of the phase name."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Record a duration that was measured elsewhere, e.g. a wait between two messages."""
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.recent:
+                self.recent[name] = deque(maxlen=self.history)
+            self.recent[name].append(seconds)
+            self.current_scan.setdefault(name, []).append(seconds)
+
+    def histogram(self, name):
+        """Counts of the recent durations of name in the HISTOGRAM_EDGES bins."""
+        with self.lock:
+            durations = np.array(self.recent.get(name, ()))
+        return np.histogram(durations, bins=HISTOGRAM_EDGES)[0]
+
+    @staticmethod
+    def statistics(durations):
+        durations = np.asarray(durations)
+        return {
+            "count": len(durations),
+            "total_s": float(durations.sum()),
+            "mean_ms": float(durations.mean() * 1000),
+            "p50_ms": float(np.percentile(durations, 50) * 1000),
+            "p95_ms": float(np.percentile(durations, 95) * 1000),
+            "max_ms": float(durations.max() * 1000),
+        }
+
+    def summary(self):
+        """Rolling statistics of every phase: {name: {count, total_s, mean_ms, p50_ms, p95_ms, max_ms}}"""
+        with self.lock:
+            recent = {name: list(durations) for name, durations in self.recent.items()}
+        return {name: self.statistics(durations) for name, durations in recent.items() if durations}
+
+    def end_scan(self, scan):
+        """Summarise the spans recorded since the previous end_scan() as scan number scan."""
+        with self.lock:
+            current_scan = self.current_scan
+            self.current_scan = {name: [] for name in self.recent}
+        for name, durations in current_scan.items():
+            if durations:
+                self.scan_summaries.append({"scan": scan, "phase": name, **self.statistics(durations)})
+
+    def save_summary(self, filepath):
+        """Write the per-scan summaries to a CSV file with one row per scan and phase."""
+        fields = ["scan", "phase", "count", "total_s", "mean_ms", "p50_ms", "p95_ms", "max_ms"]
+        with open(filepath, mode='w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.scan_summaries)
+
+    def report(self):
+        """The rolling statistics as a printable table."""
+        lines = [f"{'phase':<28}{'count':>8}{'mean ms':>12}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}"]
+        for name, stats in self.summary().items():
+            lines.append(f"{name:<28}{stats['count']:>8}{stats['mean_ms']:>12.3f}{stats['p50_ms']:>12.3f}"
+                         f"{stats['p95_ms']:>12.3f}{stats['max_ms']:>12.3f}")
+        return "\n".join(lines)